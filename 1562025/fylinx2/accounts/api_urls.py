@@ -17,4 +17,19 @@ urlpatterns = [
     
     # Dashboard endpoint
     path('dashboard/', api_views.dashboard_data, name='api_dashboard'),
+    
+    # Consolidated dashboard: every widget in one request
+    path('dashboard/overview/', api_views.dashboard_overview, name='api_dashboard_overview'),
+    
+    # Response cache metrics
+    path('cache-stats/', api_views.response_cache_metrics, name='api_cache_stats'),
+    
+    # Database connection metrics
+    path('db-stats/', api_views.connection_metrics, name='api_db_stats'),
+    
+    # Query budget metrics
+    path('query-stats/', api_views.query_budget_metrics, name='api_query_stats'),
+    
+    # Request phase timings
+    path('timing-stats/', api_views.timing_metrics, name='api_timing_stats'),
 ]
\ No newline at end of file
@@ -8,12 +8,21 @@ from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 
 from .models import CustomUser
+from .dashboard import build_dashboard, dashboard_role, profile_section
+from pharmacies.scope import get_scope
+from fylinx2.db import connection_stats, reset_connection_stats
+from fylinx2.metrics import stats_view
+from fylinx2.permissions import DenyAll
+from fylinx2.queries import query_budget, query_budget_stats, reset_query_budget_stats
+from fylinx2.response_cache import cache_bypassed, cache_response, reset_response_cache_stats, response_cache_stats
+from fylinx2.timing import reset_timing_stats, timing_exposition, timing_stats
 from .serializers import (
     LoginSerializer, UserSerializer, AdminCreateSerializer,
     ManagerCreateSerializer, StaffCreateSerializer, UserDetailSerializer
 )
 
 
+@query_budget(13)
 @api_view(['POST'])
 @permission_classes([permissions.AllowAny])
 def login_api(request):
@@ -39,6 +48,7 @@ def login_api(request):
     }, status=status.HTTP_400_BAD_REQUEST)
 
 
+@query_budget(6)
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
 def logout_api(request):
@@ -56,6 +66,7 @@ def logout_api(request):
     }, status=status.HTTP_200_OK)
 
 
+@query_budget(3)
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
 def user_profile(request):
@@ -71,12 +82,13 @@ class AdminCreateAPIView(generics.CreateAPIView):
     """API endpoint for creating admin users"""
     serializer_class = AdminCreateSerializer
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = {'POST': 5}
     
     def get_permissions(self):
         # Only superusers and admins can create other admins
         if self.request.user.is_superuser or self.request.user.role == 'ADMIN':
             return [permissions.IsAuthenticated()]
-        return [permissions.DenyAll()]
+        return [DenyAll()]
     
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -98,12 +110,13 @@ class ManagerCreateAPIView(generics.CreateAPIView):
     """API endpoint for creating manager users"""
     serializer_class = ManagerCreateSerializer
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = {'POST': 12}
     
     def get_permissions(self):
         # Only superusers and admins can create managers
         if self.request.user.is_superuser or self.request.user.role == 'ADMIN':
             return [permissions.IsAuthenticated()]
-        return [permissions.DenyAll()]
+        return [DenyAll()]
     
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -125,13 +138,14 @@ class StaffCreateAPIView(generics.CreateAPIView):
     """API endpoint for creating staff users"""
     serializer_class = StaffCreateSerializer
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = {'POST': 7}
     
     def get_permissions(self):
         # Superusers, admins, and managers can create staff
         if (self.request.user.is_superuser or 
             self.request.user.role in ['ADMIN', 'MANAGER']):
             return [permissions.IsAuthenticated()]
-        return [permissions.DenyAll()]
+        return [DenyAll()]
     
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -153,6 +167,7 @@ class UserListAPIView(generics.ListAPIView):
     """API endpoint for listing users"""
     serializer_class = UserSerializer
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = {'GET': 5}
     
     def get_queryset(self):
         user = self.request.user
@@ -162,79 +177,83 @@ class UserListAPIView(generics.ListAPIView):
             return CustomUser.objects.all()
         elif user.role == 'MANAGER':
             # Managers can see staff in their pharmacies
-            managed_pharmacy_ids = user.managed_pharmacies.values_list('id', flat=True)
-            return CustomUser.objects.filter(
-                assigned_pharmacy_id__in=managed_pharmacy_ids
+            return get_scope(self.request).filter(
+                CustomUser.objects.all(), path='assigned_pharmacy'
             )
         else:
             # Staff can only see themselves
             return CustomUser.objects.filter(id=user.id)
 
 
+@query_budget(4)
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
+@cache_response('pharmacies', 'users', per_user=True)
 def dashboard_data(request):
     """Get dashboard data based on user role"""
-    user = request.user
-    
-    if user.is_superuser or user.role == 'ADMIN':
-        # Admin dashboard data
-        total_pharmacies = user.created_pharmacies.count() if not user.is_superuser else None
-        total_managers = CustomUser.objects.filter(role='MANAGER').count()
-        total_staff = CustomUser.objects.filter(role='STAFF').count()
-        
+    role = dashboard_role(request.user)
+    if role is None:
         return Response({
-            'success': True,
-            'role': 'ADMIN',
-            'data': {
-                'total_pharmacies': total_pharmacies,
-                'total_managers': total_managers,
-                'total_staff': total_staff,
-                'permissions': ['create_pharmacy', 'create_manager', 'create_staff']
-            }
-        })
+            'success': False,
+            'message': 'Invalid user role'
+        }, status=status.HTTP_400_BAD_REQUEST)
     
-    elif user.role == 'MANAGER':
-        # Manager dashboard data
-        managed_pharmacies = user.managed_pharmacies.all()
-        total_staff = CustomUser.objects.filter(
-            assigned_pharmacy__in=managed_pharmacies
-        ).count()
-        
+    return Response({
+        'success': True,
+        'role': role,
+        'data': profile_section(request.user, get_scope(request))
+    })
+
+
+@query_budget(8)
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def dashboard_overview(request):
+    """
+    Every dashboard widget in one response: the role-specific profile
+    figures, the sales summary and the stock alerts. Each section is cached
+    per scope; send `Cache-Control: no-cache` or `?nocache=1` to rebuild them.
+    """
+    role = dashboard_role(request.user)
+    if role is None:
         return Response({
-            'success': True,
-            'role': 'MANAGER',
-            'data': {
-                'managed_pharmacies': [
-                    {
-                        'id': p.id,
-                        'name': p.name,
-                        'location': p.location
-                    } for p in managed_pharmacies
-                ],
-                'total_staff': total_staff,
-                'permissions': ['create_staff', 'view_pharmacy_data']
-            }
-        })
+            'success': False,
+            'message': 'Invalid user role'
+        }, status=status.HTTP_400_BAD_REQUEST)
     
-    elif user.role == 'STAFF':
-        # Staff dashboard data
-        assigned_pharmacy = user.assigned_pharmacy
-        
-        return Response({
-            'success': True,
-            'role': 'STAFF',
-            'data': {
-                'assigned_pharmacy': {
-                    'id': assigned_pharmacy.id,
-                    'name': assigned_pharmacy.name,
-                    'location': assigned_pharmacy.location
-                } if assigned_pharmacy else None,
-                'permissions': ['view_sales', 'manage_inventory']
-            }
-        })
+    sections, outcomes = build_dashboard(request.user, get_scope(request), refresh=cache_bypassed(request))
     
-    return Response({
-        'success': False,
-        'message': 'Invalid user role'
-    }, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+    response = Response({
+        'success': True,
+        'role': role,
+        **sections
+    })
+    response['X-Cache'] = ', '.join(f"{name}={outcome}" for name, outcome in outcomes.items())
+    return response
+
+
+response_cache_metrics = stats_view(
+    'response_cache_metrics',
+    "Response cache hit rates per endpoint (admins only); DELETE resets the counters",
+    response_cache_stats, reset_response_cache_stats
+)
+
+connection_metrics = stats_view(
+    'connection_metrics',
+    "Database connection checkouts and wait times of this worker (admins only); DELETE resets the counters",
+    connection_stats, reset_connection_stats, key='connections'
+)
+
+query_budget_metrics = stats_view(
+    'query_budget_metrics',
+    "Statement counts and query budget violations per endpoint of this worker (admins only); "
+    "DELETE resets the counters",
+    query_budget_stats, reset_query_budget_stats
+)
+
+timing_metrics = stats_view(
+    'timing_metrics',
+    "Phase timings per endpoint and role of this worker (admins only): mean, p50, p95 and p99 in ms, "
+    "or Prometheus summaries with ?output=prometheus. DELETE resets them.",
+    timing_stats, reset_timing_stats, exposition=timing_exposition
+)
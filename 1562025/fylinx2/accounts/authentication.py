@@ -0,0 +1,151 @@
+"""
+Token authentication without a database query per request.
+
+CachedTokenAuthentication keeps, per worker process, a bounded LRU of
+token key -> (user, PharmacyScope). The user comes with its assigned
+pharmacy, so neither the Token -> user join nor the scope lookups the views
+make hit the database on a warm cache. Entries live for
+AUTH_TOKEN_CACHE_TIMEOUT seconds; at most AUTH_TOKEN_CACHE_SIZE are kept.
+
+Entries are checked against version stamps in the shared cache, which
+reaches every worker:
+- one per user, bumped by invalidate_tokens() on logout (the token is
+  deleted), on any save of the user (password, role, assigned pharmacy,
+  is_active) and when the pharmacies a manager manages change;
+- one for all pharmacies, bumped when a pharmacy is saved or deleted, since
+  cached users carry their assigned pharmacy.
+The stamps are always read before the user is loaded, so a change
+committed during a load leaves the new entry stale rather than fresh; a
+token not cached yet first costs a lookup of its user id for that reason.
+A stale entry costs one cache round trip and a reload, never a stale login.
+"""
+import copy
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+from pharmacies.scope import resolve_scope
+
+
+DEFAULT_SIZE = 1024
+DEFAULT_TIMEOUT = 300
+PHARMACIES_VERSION_KEY = 'auth-token-version:pharmacies'
+
+
+def _version_key(user_id):
+    return f"auth-token-version:{user_id}"
+
+
+def _timeout():
+    return getattr(settings, 'AUTH_TOKEN_CACHE_TIMEOUT', DEFAULT_TIMEOUT)
+
+
+def invalidate_tokens(*user_ids):
+    """Make every worker reload the cached tokens of `user_ids`"""
+    version = uuid.uuid4().hex
+    # Outlives any entry filled before it
+    cache.set_many({_version_key(user_id): version for user_id in user_ids}, _timeout())
+
+
+def invalidate_pharmacy_tokens():
+    """Make every worker reload all cached tokens; cached users carry their assigned pharmacy"""
+    cache.set(PHARMACIES_VERSION_KEY, uuid.uuid4().hex, _timeout())
+
+
+def _versions(user_id):
+    return cache.get_many([_version_key(user_id), PHARMACIES_VERSION_KEY])
+
+
+_lock = threading.Lock()
+_entries = OrderedDict()
+
+
+def clear_token_cache():
+    """Drop this worker's cached tokens"""
+    with _lock:
+        _entries.clear()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication backed by the token cache described in the module docstring"""
+
+    def authenticate(self, request):
+        authenticated = super().authenticate(request)
+        if authenticated is not None:
+            # Where get_scope() looks first
+            request._request._pharmacy_scope = authenticated[1].pharmacy_scope
+        return authenticated
+
+    def authenticate_credentials(self, key):
+        with _lock:
+            entry = _entries.get(key)
+            if entry is not None:
+                _entries.move_to_end(key)
+        if entry is None:
+            return self._authenticated(self._load(key))
+
+        user_id = entry['user'].pk
+        if entry['expires'] > time.monotonic() and _versions(user_id) == entry['versions']:
+            return self._authenticated(entry)
+        return self._authenticated(self._load(key, user_id))
+
+    def _load(self, key, user_id=None):
+        model = self.get_model()
+        if user_id is None:
+            user_id = model.objects.filter(key=key).values_list('user_id', flat=True).first()
+            if user_id is None:
+                self._forget(key)
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        # Read the versions before the user, so that a change committed in
+        # between leaves this entry behind it
+        versions = _versions(user_id)
+        try:
+            token = model.objects.select_related('user__assigned_pharmacy').get(key=key)
+        except model.DoesNotExist:
+            self._forget(key)
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        if token.user_id != user_id:
+            # The token was given to another user since we looked
+            return self._load(key, token.user_id)
+        if not token.user.is_active:
+            self._forget(key)
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+        entry = {
+            'user': token.user,
+            'token': token,
+            'scope': resolve_scope(token.user),
+            'versions': versions,
+            'expires': time.monotonic() + _timeout(),
+        }
+        size = getattr(settings, 'AUTH_TOKEN_CACHE_SIZE', DEFAULT_SIZE)
+        with _lock:
+            _entries[key] = entry
+            _entries.move_to_end(key)
+            while len(_entries) > size:
+                _entries.popitem(last=False)
+        return entry
+
+    def _forget(self, key):
+        with _lock:
+            _entries.pop(key, None)
+
+    def _authenticated(self, entry):
+        # Each request gets its own copies; the cached instances are shared.
+        # copy() gives the user its own related-object cache, but not its own
+        # assigned pharmacy
+        user = copy.copy(entry['user'])
+        user._state.fields_cache = {
+            name: copy.copy(related) for name, related in user._state.fields_cache.items()
+        }
+        token = copy.copy(entry['token'])
+        token.user = user
+        token.pharmacy_scope = entry['scope']
+        return (user, token)
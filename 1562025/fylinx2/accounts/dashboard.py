@@ -0,0 +1,202 @@
+"""
+The consolidated dashboard: every widget of the front page in one response.
+
+Sections:
+- profile: the role-specific figures of dashboard_data;
+- sales: today's, this month's and all-time sales (as sales_summary);
+- stock: low stock, expired and expiring batch counts from one grouped
+  query, with the first DASHBOARD_ALERT_ITEMS low-stock and expired batches.
+
+Each section is cached on its own for DASHBOARD_SECTION_TIMEOUTS[section]
+seconds. The key holds the caller's pharmacy scope (the user, for profile),
+the date and the response-cache versions of the namespaces the section
+reads, so the same writes that invalidate cached responses invalidate
+sections too.
+
+Sections missing from the cache are computed concurrently on a pool of
+DASHBOARD_WORKERS threads, each with its own database connection. Inside a
+transaction they run in the request's thread instead, since other
+connections could not see its uncommitted writes.
+"""
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, connection
+from django.db.models import Count, Q
+
+from fylinx2.response_cache import namespace_versions
+from inventory.expiry import DEFAULT_HORIZON_DAYS, expiring_within
+from inventory.lean import inventory_mapper
+from inventory.models import Inventory
+from pharmacies.models import Pharmacy
+from sales.models import DailySalesRollup
+from sales.periods import local_today
+from sales.rollups import summary_totals
+from .models import CustomUser
+
+
+DEFAULT_TIMEOUTS = {'profile': 300, 'sales': 60, 'stock': 120}
+DEFAULT_ALERT_ITEMS = 5
+DEFAULT_WORKERS = 3
+
+ROLE_PERMISSIONS = {
+    'ADMIN': ['create_pharmacy', 'create_manager', 'create_staff'],
+    'MANAGER': ['create_staff', 'view_pharmacy_data'],
+    'STAFF': ['view_sales', 'manage_inventory'],
+}
+
+
+def dashboard_role(user):
+    """'ADMIN', 'MANAGER' or 'STAFF', or None for a user without a dashboard"""
+    if user.is_superuser or user.role == 'ADMIN':
+        return 'ADMIN'
+    if user.role in ('MANAGER', 'STAFF'):
+        return user.role
+    return None
+
+
+def profile_section(user, scope):
+    """The role-specific figures dashboard_data returns as `data`"""
+    role = dashboard_role(user)
+    if role == 'ADMIN':
+        # Managers and staff in one grouped count
+        counts = CustomUser.objects.aggregate(
+            total_managers=Count('id', filter=Q(role='MANAGER')),
+            total_staff=Count('id', filter=Q(role='STAFF')),
+        )
+        return {
+            'total_pharmacies': None if user.is_superuser else user.created_pharmacies.count(),
+            **counts,
+            'permissions': ROLE_PERMISSIONS[role],
+        }
+
+    if role == 'MANAGER':
+        # The managed pharmacies with their staff counted alongside
+        pharmacies = list(
+            scope.filter(Pharmacy.objects.all(), path='')
+            .annotate(staff=Count('staff_users'))
+            .values('id', 'name', 'location', 'staff')
+            .order_by('id')
+        )
+        return {
+            'managed_pharmacies': [
+                {'id': p['id'], 'name': p['name'], 'location': p['location']} for p in pharmacies
+            ],
+            'total_staff': sum(p['staff'] for p in pharmacies),
+            'permissions': ROLE_PERMISSIONS[role],
+        }
+
+    assigned_pharmacy = user.assigned_pharmacy
+    return {
+        'assigned_pharmacy': {
+            'id': assigned_pharmacy.id,
+            'name': assigned_pharmacy.name,
+            'location': assigned_pharmacy.location
+        } if assigned_pharmacy else None,
+        'permissions': ROLE_PERMISSIONS[role],
+    }
+
+
+def sales_section(user, scope):
+    return summary_totals(scope.filter(DailySalesRollup.objects.all()), local_today())
+
+
+def stock_section(user, scope):
+    today = local_today()
+    inventory = scope.filter(Inventory.objects.all())
+    items = getattr(settings, 'DASHBOARD_ALERT_ITEMS', DEFAULT_ALERT_ITEMS)
+    low_stock = Q(stock_deficit__gte=0)
+    expired = Q(expiry_date__lt=today)
+    counts = inventory.aggregate(
+        low_stock=Count('id', filter=low_stock),
+        expired=Count('id', filter=expired),
+        expiring=Count('id', filter=Q(
+            expiry_date__gte=today,
+            expiry_date__lte=today + timedelta(days=DEFAULT_HORIZON_DAYS),
+            quantity__gt=0
+        )),
+    )
+    # Same filters and order as low_stock_alerts and expired_items
+    low_stock_rows = inventory_mapper.values(inventory.filter(low_stock).order_by('-stock_deficit', 'id'))
+    expired_rows = inventory_mapper.values(inventory.filter(expired).order_by('expiry_date', 'id'))
+    return {
+        **counts,
+        'expiring_horizon_days': DEFAULT_HORIZON_DAYS,
+        'low_stock_items': inventory_mapper.many(low_stock_rows[:items]),
+        'expired_items': inventory_mapper.many(expired_rows[:items]),
+    }
+
+
+# name: (builder, namespaces read, cached per user rather than per scope)
+SECTIONS = {
+    'profile': (profile_section, ('pharmacies', 'users'), True),
+    'sales': (sales_section, ('sales',), False),
+    'stock': (stock_section, ('inventory', 'medicines', 'pharmacies'), False),
+}
+
+
+def _section_key(name, user, scope, versions):
+    _, namespaces, per_user = SECTIONS[name]
+    if per_user:
+        audience = f"user:{user.pk}"
+    else:
+        audience = 'all' if scope.is_unrestricted else ','.join(map(str, sorted(scope.pharmacy_ids)))
+    raw = f"{name}|{audience}|{local_today()}|{[versions[namespace] for namespace in namespaces]}"
+    return f"dashboard:{name}:{hashlib.md5(raw.encode()).hexdigest()}"
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _executor():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'DASHBOARD_WORKERS', DEFAULT_WORKERS),
+                thread_name_prefix='dashboard'
+            )
+        return _pool
+
+
+def _build_in_thread(name, user, scope):
+    # Pool threads keep their connections between calls, so retire them
+    # the way request_started and request_finished do
+    close_old_connections()
+    try:
+        return SECTIONS[name][0](user, scope)
+    finally:
+        close_old_connections()
+
+
+def build_dashboard(user, scope, refresh=False):
+    """
+    {section: payload} for every section, and {section: 'HIT' | 'MISS' |
+    'BYPASS'}. With `refresh`, every section is rebuilt and re-cached.
+    """
+    all_namespaces = sorted({namespace for _, namespaces, _ in SECTIONS.values() for namespace in namespaces})
+    versions = dict(zip(all_namespaces, namespace_versions(all_namespaces)))
+    keys = {name: _section_key(name, user, scope, versions) for name in SECTIONS}
+
+    cached = {} if refresh else cache.get_many(keys.values())
+    payload = {name: cached[key] for name, key in keys.items() if key in cached}
+    outcomes = {name: 'HIT' for name in payload}
+    missing = [name for name in SECTIONS if name not in payload]
+
+    workers = getattr(settings, 'DASHBOARD_WORKERS', DEFAULT_WORKERS)
+    if len(missing) > 1 and workers > 1 and not connection.in_atomic_block:
+        futures = {name: _executor().submit(_build_in_thread, name, user, scope) for name in missing}
+        payload.update((name, future.result()) for name, future in futures.items())
+    else:
+        payload.update((name, SECTIONS[name][0](user, scope)) for name in missing)
+
+    timeouts = {**DEFAULT_TIMEOUTS, **getattr(settings, 'DASHBOARD_SECTION_TIMEOUTS', {})}
+    for name in missing:
+        cache.set(keys[name], payload[name], timeouts[name])
+        outcomes[name] = 'BYPASS' if refresh else 'MISS'
+    return {name: payload[name] for name in SECTIONS}, outcomes
@@ -1,3 +1,145 @@
-from django.test import TestCase
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
 
-# Create your tests here.
+from fylinx2.testing import API_PREFIX, PASSWORD, EndpointBudgetMixin
+from pharmacies.models import Pharmacy
+from .authentication import CachedTokenAuthentication, clear_token_cache, invalidate_tokens
+from .models import CustomUser
+
+
+class QueryBudgetTests(EndpointBudgetMixin, TestCase):
+
+    def requests(self, label, admin_only):
+        """(method, path, data, status) for every accounts endpoint; `label` keeps created names unique"""
+        pharmacy = self.fixtures['pharmacies'][0]
+        password = {'password': PASSWORD, 'password_confirm': PASSWORD}
+        return [
+            ('GET', 'auth/profile/', None, None),
+            ('GET', 'users/', None, None),
+            ('GET', 'dashboard/', None, None),
+            ('GET', 'dashboard/overview/', None, None),
+            ('GET', 'cache-stats/', None, admin_only),
+            ('DELETE', 'cache-stats/', None, admin_only),
+            ('GET', 'db-stats/', None, admin_only),
+            ('DELETE', 'db-stats/', None, admin_only),
+            ('GET', 'query-stats/', None, admin_only),
+            ('DELETE', 'query-stats/', None, admin_only),
+            ('GET', 'timing-stats/', None, admin_only),
+            ('GET', 'timing-stats/?output=prometheus', None, admin_only),
+            ('DELETE', 'timing-stats/', None, admin_only),
+            ('POST', 'users/create-admin/', {'username': f"budget-new-admin-{label}", **password}, admin_only),
+            ('POST', 'users/create-manager/', {
+                'username': f"budget-new-manager-{label}",
+                'pharmacy_ids': [p.id for p in self.fixtures['pharmacies']], **password
+            }, admin_only),
+            ('POST', 'users/create-staff/', {
+                'username': f"budget-new-staff-{label}", 'assigned_pharmacy_id': pharmacy.id, **password
+            }, None),
+        ]
+
+    def test_admin(self):
+        self.assertRequestsWithinBudget(self.fixtures['admin'], self.requests('admin', None))
+
+    def test_manager(self):
+        self.assertRequestsWithinBudget(self.fixtures['manager'], self.requests('manager', 403))
+
+    def test_login_and_logout(self):
+        client = self.budget_client(self.fixtures['admin'])
+        client.logout()
+        self.assertWithinBudget(client, 'POST', 'auth/login/', {'username': 'budget-admin', 'password': PASSWORD})
+        self.assertWithinBudget(client, 'POST', 'auth/logout/')
+
+
+class StatsViewTests(EndpointBudgetMixin, TestCase):
+    rows = 1
+
+    def test_payloads(self):
+        client = self.budget_client(self.fixtures['admin'])
+        for path, key in [
+            ('cache-stats/', 'endpoints'), ('db-stats/', 'connections'),
+            ('query-stats/', 'endpoints'), ('timing-stats/', 'endpoints'),
+        ]:
+            with self.subTest(path=path):
+                self.assertIn(key, self.assertWithinBudget(client, 'GET', path).json())
+        response = self.assertWithinBudget(client, 'GET', 'timing-stats/?output=prometheus')
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+
+    def test_admins_only(self):
+        client = self.budget_client(self.fixtures['manager'])
+        response = self.assertWithinBudget(client, 'GET', 'db-stats/', status=403)
+        self.assertEqual(response.json()['message'], 'You do not have permission to view this data')
+
+
+@override_settings(RESPONSE_CACHE_ENABLED=False)
+class CachedTokenTests(TestCase):
+    """A cached token stops working, or reloads its user, as soon as the user changes"""
+
+    @classmethod
+    def setUpTestData(cls):
+        admin = CustomUser.objects.create_user(username='token-admin', role='ADMIN')
+        pharmacy = Pharmacy.objects.create(name='Token pharmacy', location='Token', created_by=admin)
+        cls.user = CustomUser.objects.create_user(
+            username='token-staff', password=PASSWORD, role='STAFF', assigned_pharmacy=pharmacy
+        )
+        cls.key = Token.objects.create(user=cls.user).key
+
+    def setUp(self):
+        cache.clear()
+        clear_token_cache()
+        self.addCleanup(clear_token_cache)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.key}")
+
+    def profile(self):
+        return self.client.get(API_PREFIX + 'auth/profile/')
+
+    def test_logout(self):
+        self.assertEqual(self.profile().status_code, 200)
+        self.assertEqual(self.client.post(API_PREFIX + 'auth/logout/').status_code, 200)
+        # 403 rather than 401: the first authentication class is the session's
+        self.assertEqual(self.profile().status_code, 403)
+
+    def test_password_change(self):
+        self.assertEqual(self.profile().status_code, 200)
+        user = CustomUser.objects.get(pk=self.user.pk)
+        user.set_password('changed-pass-1')
+        user.save()
+        authenticated, _ = CachedTokenAuthentication().authenticate_credentials(self.key)
+        self.assertTrue(authenticated.check_password('changed-pass-1'))
+
+    def test_role_change(self):
+        self.assertEqual(self.profile().json()['user']['role'], 'STAFF')
+        user = CustomUser.objects.get(pk=self.user.pk)
+        user.role = 'MANAGER'
+        user.save()
+        self.assertEqual(self.profile().json()['user']['role'], 'MANAGER')
+
+    def test_change_while_loading(self):
+        changed = []
+
+        def change_after_user_read(execute, sql, params, many, context):
+            result = execute(sql, params, many, context)
+            if not changed and 'INNER JOIN' in sql:
+                # A role change committed just after the token and user were read
+                changed.append(True)
+                CustomUser.objects.filter(pk=self.user.pk).update(role='MANAGER')
+                invalidate_tokens(self.user.pk)
+            return result
+
+        auth = CachedTokenAuthentication()
+        with connection.execute_wrapper(change_after_user_read):
+            first, _ = auth.authenticate_credentials(self.key)
+        self.assertEqual((changed, first.role), ([True], 'STAFF'))
+        second, _ = auth.authenticate_credentials(self.key)
+        self.assertEqual(second.role, 'MANAGER')
+
+    def test_requests_get_their_own_instances(self):
+        auth = CachedTokenAuthentication()
+        first, _ = auth.authenticate_credentials(self.key)
+        second, _ = auth.authenticate_credentials(self.key)
+        self.assertIsNot(first, second)
+        self.assertIsNot(first.assigned_pharmacy, second.assigned_pharmacy)
+        self.assertEqual(first.assigned_pharmacy, second.assigned_pharmacy)
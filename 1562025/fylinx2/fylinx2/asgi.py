@@ -14,3 +14,7 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fylinx2.settings')
 
 application = get_asgi_application()
+
+from fylinx2.db import prepare_worker  # noqa: E402
+
+prepare_worker()
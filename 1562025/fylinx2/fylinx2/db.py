@@ -0,0 +1,130 @@
+"""
+Database connection reuse, warm-up and checkout metrics.
+
+Each worker thread keeps its own persistent connection (CONN_MAX_AGE), so
+the TLS handshake and login to SQL Server are paid once per connection
+lifetime rather than once per request. With CONN_HEALTH_CHECKS a reused
+connection is pinged before its first query in a request, and a dead one
+is replaced transparently.
+
+checkout_connections() runs at the start of every request. It makes sure
+each DB_CHECKOUT_ALIASES connection is open and usable, opening it if
+needed. It also records how long that took: near zero for a reused
+connection, and the full connect for a new one. warm_up() does the same
+once at worker boot, so the first request does not pay for the connect.
+
+The metrics are per process. connection_stats() reports them for the
+worker that serves the request.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import DatabaseError, connections
+from django.db.backends.signals import connection_created
+
+
+_lock = threading.Lock()
+_stats = {}
+
+
+def _reset():
+    _stats.update(
+        checkouts=0,
+        reused=0,
+        opened=0,
+        warmed=0,
+        wait_seconds=0.0,
+        max_wait_seconds=0.0,
+        connect_seconds=0.0,
+    )
+
+
+_reset()
+
+
+def _aliases():
+    return getattr(settings, 'DB_CHECKOUT_ALIASES', ['default'])
+
+
+def _checkout(alias):
+    """Ensure `alias` has a usable connection; returns (seconds waited, reused)"""
+    connection = connections[alias]
+    previous = connection.connection
+    started = time.perf_counter()
+    # With CONN_HEALTH_CHECKS a reused connection is pinged and closed if
+    # dead; then connect if there is no connection
+    connection.close_if_health_check_failed()
+    connection.ensure_connection()
+    waited = time.perf_counter() - started
+    return waited, previous is not None and connection.connection is previous
+
+
+def checkout_connections(sender=None, **kwargs):
+    """request_started receiver: open or verify this thread's connections and record the wait"""
+    for alias in _aliases():
+        waited, reused = _checkout(alias)
+        with _lock:
+            _stats['checkouts'] += 1
+            _stats['reused'] += reused
+            _stats['wait_seconds'] += waited
+            _stats['max_wait_seconds'] = max(_stats['max_wait_seconds'], waited)
+
+
+def _connection_opened(sender, connection, **kwargs):
+    with _lock:
+        _stats['opened'] += 1
+
+
+def warm_up():
+    """Open this thread's connections ahead of the first request; returns seconds spent"""
+    started = time.perf_counter()
+    for alias in _aliases():
+        connections[alias].ensure_connection()
+    elapsed = time.perf_counter() - started
+    with _lock:
+        _stats['warmed'] += 1
+        _stats['connect_seconds'] += elapsed
+    return elapsed
+
+
+def connect_checkout_metrics():
+    request_started.connect(checkout_connections, dispatch_uid='fylinx2-db-checkout')
+    connection_created.connect(_connection_opened, dispatch_uid='fylinx2-db-opened')
+
+
+def prepare_worker():
+    """
+    Called from wsgi.py / asgi.py when a worker loads the application:
+    connects the checkout metrics and, with DB_WARM_UP, opens the
+    connections. Under gunicorn --preload call it from a post_fork hook
+    instead, so each worker opens its own connection rather than sharing
+    the master's socket.
+    """
+    connect_checkout_metrics()
+    if getattr(settings, 'DB_WARM_UP', False):
+        try:
+            warm_up()
+        except DatabaseError:
+            # Database not reachable yet; the first request connects instead
+            pass
+
+
+def connection_stats():
+    """Checkout counts and wait times of this worker process"""
+    with _lock:
+        stats = dict(_stats)
+    checkouts = stats['checkouts']
+    return {
+        **stats,
+        'reuse_rate': round(stats['reused'] / checkouts, 3) if checkouts else None,
+        'mean_wait_ms': round(stats['wait_seconds'] * 1000 / checkouts, 3) if checkouts else None,
+        'max_wait_ms': round(stats['max_wait_seconds'] * 1000, 3),
+        'conn_max_age': {alias: connections[alias].settings_dict['CONN_MAX_AGE'] for alias in _aliases()},
+    }
+
+
+def reset_connection_stats():
+    with _lock:
+        _reset()
@@ -0,0 +1,45 @@
+"""
+Admin-only endpoints serving the per-process figures of fylinx2's
+instrumentation (response cache, connections, query budgets, timings).
+
+stats_view() builds one: GET returns {'success': True, <key>: stats()},
+DELETE calls reset() first, and non-admins get 403. With `exposition`,
+?output=prometheus returns exposition() as Prometheus text instead.
+"""
+from django.http import HttpResponse
+from rest_framework import permissions, status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.response import Response
+
+from .queries import query_budget
+
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def stats_view(name, doc, stats, reset, key='endpoints', exposition=None):
+    """The view `name` described by `doc`; see the module docstring"""
+    def view(request):
+        if not (request.user.is_superuser or request.user.role == 'ADMIN'):
+            return Response({
+                'success': False,
+                'message': 'You do not have permission to view this data'
+            }, status=status.HTTP_403_FORBIDDEN)
+
+        if request.method == 'DELETE':
+            reset()
+
+        if exposition is not None and request.query_params.get('output') == 'prometheus':
+            return HttpResponse(exposition(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+        return Response({
+            'success': True,
+            key: stats()
+        })
+
+    # api_view names the view class after the function and describes it by its docstring
+    view.__name__ = view.__qualname__ = name
+    view.__doc__ = doc
+    return query_budget(2)(
+        api_view(['GET', 'DELETE'])(permission_classes([permissions.IsAuthenticated])(view))
+    )
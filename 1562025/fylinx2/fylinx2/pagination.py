@@ -0,0 +1,189 @@
+"""
+Keyset (seek) pagination helpers shared by the API apps.
+
+Pages are addressed by an opaque cursor holding the sort key of the last row
+served, so page N costs the same index seek as page 1 and no COUNT(*) is run.
+Totals are opt-in (?count=1) and come from a cached estimate.
+"""
+import base64
+import hashlib
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.db.models.constants import LOOKUP_SEP
+from rest_framework.exceptions import ParseError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+MAX_PAGE_SIZE = 100
+COUNT_CACHE_TIMEOUT = 300
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def json_default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Cannot encode {type(value).__name__} in a cursor")
+
+
+def encode_cursor(values):
+    raw = json.dumps(values, default=json_default, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (ValueError, UnicodeDecodeError):
+        raise InvalidCursor("Invalid cursor")
+    if not isinstance(values, list):
+        raise InvalidCursor("Invalid cursor")
+    return values
+
+
+def _cursor_values(model, ordering, values):
+    """
+    `values` converted with each ordering field's to_python(), so a cursor
+    that decodes but holds values of the wrong type is rejected here rather
+    than by the database.
+    """
+    if len(values) != len(ordering):
+        raise InvalidCursor("Invalid cursor")
+    converted = []
+    for (path, _), value in zip(ordering, values):
+        opts = model._meta
+        *relations, name = path.split(LOOKUP_SEP)
+        for relation in relations:
+            opts = opts.get_field(relation).related_model._meta
+        try:
+            converted.append(opts.get_field(name).to_python(value))
+        except (ValidationError, ValueError, TypeError):
+            raise InvalidCursor("Invalid cursor")
+    return converted
+
+
+def get_page_size(request, default=None):
+    default = default or settings.REST_FRAMEWORK.get('PAGE_SIZE', 20)
+    try:
+        size = int(request.query_params.get('limit', default))
+    except (TypeError, ValueError):
+        size = default
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def _seek_filter(ordering, values):
+    """
+    Rows strictly after `values` in `ordering`, a list of (field, descending).
+
+    For (a desc, id asc) this is: a < v0 OR (a = v0 AND id > v1).
+    """
+    condition = Q()
+    for position, (field, descending) in enumerate(ordering):
+        step = Q(**{f"{field}__{'lt' if descending else 'gt'}": values[position]})
+        for prior in range(position):
+            step &= Q(**{ordering[prior][0]: values[prior]})
+        condition |= step
+    return condition
+
+
+def keyset_page(queryset, ordering, cursor=None, page_size=20):
+    """
+    Return (rows, next_cursor) for one page of `queryset`.
+
+    `ordering` must end in a unique field (normally ('id', False)) so the
+    sort is total. next_cursor is None on the last page. A cursor that does
+    not decode to values of the ordering fields raises InvalidCursor.
+    """
+    if cursor:
+        values = _cursor_values(queryset.model, ordering, decode_cursor(cursor))
+        queryset = queryset.filter(_seek_filter(ordering, values))
+
+    queryset = queryset.order_by(*[
+        f"-{field}" if descending else field for field, descending in ordering
+    ])
+    rows = list(queryset[:page_size + 1])
+
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        # Rows may be model instances or values() dicts
+        if isinstance(last, dict):
+            next_cursor = encode_cursor([last[field] for field, _ in ordering])
+        else:
+            next_cursor = encode_cursor([getattr(last, field) for field, _ in ordering])
+    return rows, next_cursor
+
+
+def estimated_count(queryset, timeout=COUNT_CACHE_TIMEOUT):
+    """
+    Row count of `queryset`, cached for `timeout` seconds per distinct query.
+
+    The figure may lag behind inserts by up to `timeout`, which is fine for
+    "about N results" displays and keeps COUNT(*) off every page request.
+    """
+    sql, params = queryset.order_by().query.sql_with_params()
+    digest = hashlib.md5(f"{queryset.db}|{sql}|{params!r}".encode()).hexdigest()
+    key = f"row-count:{digest}"
+    count = cache.get(key)
+    if count is None:
+        count = queryset.order_by().count()
+        cache.set(key, count, timeout)
+    return count
+
+
+class KeysetPagination(BasePagination):
+    """
+    DRF pagination class over keyset_page(), newest rows first.
+
+    Query params: `cursor` (from next_cursor), `limit` and `count=1` for an
+    approximate total. Subclasses may override `ordering`, which must end
+    in a unique field and be backed by a matching index.
+    """
+    ordering = [('created_at', True), ('id', True)]
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        try:
+            rows, self.next_cursor = keyset_page(
+                queryset,
+                self.ordering,
+                cursor=request.query_params.get('cursor'),
+                page_size=get_page_size(request)
+            )
+        except InvalidCursor:
+            raise ParseError("Invalid cursor")
+
+        self.count = None
+        if request.query_params.get('count') in ('1', 'true'):
+            self.count = estimated_count(queryset)
+        return rows
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), 'cursor', self.next_cursor)
+
+    def get_paginated_response(self, data):
+        payload = {
+            'next': self.get_next_link(),
+            'next_cursor': self.next_cursor,
+            'has_more': self.next_cursor is not None,
+            'results': data,
+        }
+        if self.count is not None:
+            payload['count'] = self.count
+        return Response(payload)
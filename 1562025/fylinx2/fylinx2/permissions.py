@@ -0,0 +1,8 @@
+from rest_framework import permissions
+
+
+class DenyAll(permissions.BasePermission):
+    """Refuse every request; REST framework has no such class of its own"""
+
+    def has_permission(self, request, view):
+        return False
@@ -0,0 +1,289 @@
+"""
+Per-request query recording, query budgets and N+1 detection.
+
+QueryBudgetMiddleware records every SQL statement a request runs, on every
+database alias, through connection.execute_wrapper(). Statements are
+grouped by fingerprint: the SQL with literals replaced and IN/VALUES lists
+collapsed, so the same query for different rows has the same fingerprint.
+A fingerprint repeated QUERY_N_PLUS_ONE_THRESHOLD times or more in one
+request is flagged as an N+1 pattern.
+
+Views declare how many statements a request may run:
+
+    @query_budget(4)
+    @api_view(['GET'])
+    def low_stock_alerts(request): ...
+
+    class SaleListCreateAPIView(generics.ListCreateAPIView):
+        query_budget = {'GET': 5, 'POST': 12}
+
+The count covers the whole request, including session and user lookups.
+A violation is either an exceeded budget or an N+1 pattern. With
+QUERY_BUDGET_LOG_STACKS (DEBUG by default) it is logged to
+'fylinx2.queries' with the SQL and the stack of the offending statement.
+Either way it is counted in the per-process metrics served by
+query_budget_stats().
+
+Tests and management commands can use assert_query_budget() to enforce
+the same rules on a block of code; fylinx2.testing uses it to check every
+API endpoint from the apps' tests.
+"""
+import logging
+import re
+import threading
+import time
+import traceback
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_N_PLUS_ONE_THRESHOLD = 5
+# Stack frames kept per statement when stacks are captured
+STACK_DEPTH = 12
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_LIST = re.compile(r"\((?:\s*(?:%s|\?|NULL)\s*,)*\s*(?:%s|\?|NULL)\s*\)", re.IGNORECASE)
+_ROWS = re.compile(r"(\(\.\.\.\))(?:\s*,\s*\(\.\.\.\))+")
+_SPACE = re.compile(r"\s+")
+# Transaction control is repeated by design and never an N+1
+_CONTROL = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT', 'BEGIN', 'COMMIT', 'ROLLBACK')
+
+
+def fingerprint(sql):
+    """`sql` with literals replaced by ? and IN / VALUES lists collapsed to (...)"""
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _LIST.sub('(...)', sql)
+    sql = _ROWS.sub(r'\1', sql)
+    return _SPACE.sub(' ', sql).strip()
+
+
+def query_budget(default=None, **methods):
+    """
+    Declare the statement budget of a view function: one number for every
+    method, or per method, e.g. @query_budget(GET=4, POST=10). Apply above
+    @api_view. Class-based views set a `query_budget` attribute instead.
+    """
+    budget = dict(methods, **({'*': default} if default is not None else {}))
+
+    def decorator(view):
+        view.query_budget = budget
+        return view
+    return decorator
+
+
+def budget_for(view, method):
+    """The budget `view` declares for `method`, or QUERY_BUDGET_DEFAULT"""
+    budget = getattr(view, 'query_budget', None)
+    if budget is None:
+        budget = getattr(getattr(view, 'view_class', None), 'query_budget', None)
+    if isinstance(budget, dict):
+        budget = budget.get(method, budget.get('*'))
+    if budget is None:
+        return getattr(settings, 'QUERY_BUDGET_DEFAULT', None)
+    return budget
+
+
+class QueryRecorder:
+    """
+    Records the statements run on the `using` aliases (default: all) while
+    entered. May be entered repeatedly, e.g. around each chunk of a
+    streaming response; the statements accumulate.
+    """
+
+    def __init__(self, using=None, capture_stacks=False):
+        self.using = using
+        self.capture_stacks = capture_stacks
+        self.queries = []
+        self._stacks = []
+
+    def __enter__(self):
+        stack = ExitStack()
+        for alias in self.using or connections:
+            stack.enter_context(connections[alias].execute_wrapper(self))
+        self._stacks.append(stack)
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stacks.pop().close()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'sql': sql,
+                'alias': context['connection'].alias,
+                'seconds': time.perf_counter() - started,
+                'stack': self._stack() if self.capture_stacks else None,
+            })
+
+    def _stack(self):
+        # The caller's frames, innermost last, without Django and library internals
+        base = str(settings.BASE_DIR)
+        frames = [
+            frame for frame in traceback.extract_stack()[:-2]
+            if frame.filename.startswith(base) and frame.filename != __file__
+        ]
+        return traceback.format_list(frames[-STACK_DEPTH:])
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def seconds(self):
+        return sum(query['seconds'] for query in self.queries)
+
+    def repeated(self, threshold=None):
+        """[(fingerprint, times)] for statements run `threshold` times or more, most repeated first"""
+        if threshold is None:
+            threshold = getattr(settings, 'QUERY_N_PLUS_ONE_THRESHOLD', DEFAULT_N_PLUS_ONE_THRESHOLD)
+        shapes = Counter(
+            fingerprint(query['sql']) for query in self.queries
+            if not query['sql'].lstrip().upper().startswith(_CONTROL)
+        )
+        return [(shape, times) for shape, times in shapes.most_common() if times >= threshold]
+
+    def last(self, shape):
+        """
+        The last statement recorded with fingerprint `shape`; the first may
+        be an unrelated lookup (e.g. the request user) that happens to share it
+        """
+        return next(query for query in reversed(self.queries) if fingerprint(query['sql']) == shape)
+
+    def violations(self, budget=None, threshold=None):
+        """Human-readable problems: exceeded `budget` and repeated statements"""
+        problems = []
+        if budget is not None and self.count > budget:
+            problems.append(f"{self.count} queries, budget {budget}")
+        for shape, times in self.repeated(threshold):
+            problems.append(f"N+1: {times} x {shape}")
+        return problems
+
+    def report(self, budget=None, threshold=None):
+        """The violations with the SQL and, if captured, the stack of each repeated statement"""
+        lines = self.violations(budget, threshold)
+        for shape, times in self.repeated(threshold):
+            query = self.last(shape)
+            lines.append(f"Last of {times}: {query['sql']}")
+            if query['stack']:
+                lines.append(''.join(query['stack']).rstrip())
+        return '\n'.join(lines)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised by assert_query_budget()"""
+
+
+@contextmanager
+def assert_query_budget(budget=None, threshold=None, using=None):
+    """
+    Fail with QueryBudgetExceeded if the block runs more than `budget`
+    statements or repeats a statement `threshold` times or more:
+
+        with assert_query_budget(4):
+            client.get('/api/v1/inventory/low-stock/')
+    """
+    recorder = QueryRecorder(using, capture_stacks=True)
+    with recorder:
+        yield recorder
+    if recorder.violations(budget, threshold):
+        raise QueryBudgetExceeded(recorder.report(budget, threshold))
+
+
+_lock = threading.Lock()
+_stats = {}
+
+
+def _record(endpoint, recorder, budget, problems):
+    with _lock:
+        row = _stats.setdefault(endpoint, {
+            'requests': 0, 'queries': 0, 'max_queries': 0, 'seconds': 0.0,
+            'over_budget': 0, 'n_plus_one': 0, 'last_violation': None,
+        })
+        row['requests'] += 1
+        row['queries'] += recorder.count
+        row['max_queries'] = max(row['max_queries'], recorder.count)
+        row['seconds'] += recorder.seconds
+        row['budget'] = budget
+        if problems:
+            row['over_budget'] += budget is not None and recorder.count > budget
+            row['n_plus_one'] += any(problem.startswith('N+1') for problem in problems)
+            row['last_violation'] = problems[0]
+
+
+def query_budget_stats():
+    """Statement counts and violations per endpoint of this worker process"""
+    with _lock:
+        rows = [dict(row, endpoint=endpoint) for endpoint, row in _stats.items()]
+    for row in rows:
+        row['mean_queries'] = round(row['queries'] / row['requests'], 2)
+        row['db_ms'] = round(row.pop('seconds') * 1000 / row['requests'], 3)
+    return sorted(rows, key=lambda row: row['endpoint'])
+
+
+def reset_query_budget_stats():
+    with _lock:
+        _stats.clear()
+
+
+class QueryBudgetMiddleware:
+    """
+    Record each request's statements and check them against the view's
+    budget (see the module docstring). Place it first in MIDDLEWARE so the
+    session and user lookups are counted too.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, 'QUERY_BUDGET_ENABLED', True)
+        self.log_stacks = getattr(settings, 'QUERY_BUDGET_LOG_STACKS', settings.DEBUG)
+
+    def __call__(self, request):
+        if not self.enabled:
+            return self.get_response(request)
+
+        recorder = QueryRecorder(capture_stacks=self.log_stacks)
+        with recorder:
+            response = self.get_response(request)
+        if getattr(request, 'query_budget_endpoint', None) is None:
+            # Not routed to a view
+            return response
+        if response.streaming:
+            # Exports run their queries while the body is sent
+            response.streaming_content = self._stream(response.streaming_content, request, recorder)
+        else:
+            self._check(request, recorder)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.query_budget_endpoint = f"{request.method} {request.resolver_match.route}"
+        request.query_budget = budget_for(view_func, request.method)
+
+    def _stream(self, content, request, recorder):
+        chunks = iter(content)
+        while True:
+            with recorder:
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            yield chunk
+        self._check(request, recorder)
+
+    def _check(self, request, recorder):
+        budget = request.query_budget
+        problems = recorder.violations(budget)
+        _record(request.query_budget_endpoint, recorder, budget, problems)
+        if problems and self.log_stacks:
+            logger.warning(
+                "Query budget violation on %s\n%s",
+                request.query_budget_endpoint, recorder.report(budget)
+            )
@@ -0,0 +1,164 @@
+"""
+Server-side caching of read-heavy API responses.
+
+A cached response is keyed by endpoint and URL arguments, the caller's
+pharmacy scope (or user, for per-user views), the query string and the
+current version of every namespace the endpoint reads. Model signals bump a namespace's
+version (see invalidate_on), so the old entries are no longer addressed
+and simply expire. Nothing has to be deleted by pattern, which works on
+every cache backend.
+
+Send `Cache-Control: no-cache` or `?nocache=1` to bypass the cache for a
+request; the fresh response still replaces the cached one. Responses carry
+an X-Cache header of HIT, MISS or BYPASS, and hit/miss/bypass counts per
+endpoint are kept in the cache for response_cache_stats().
+"""
+import functools
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from rest_framework.response import Response
+
+from pharmacies.scope import get_scope
+
+
+OUTCOMES = ('hit', 'miss', 'bypass')
+
+# Every endpoint wrapped by cache_response, for the stats report
+_endpoints = set()
+
+
+def _version_key(namespace):
+    return f"response-cache-version:{namespace}"
+
+
+def _stats_key(endpoint, outcome):
+    return f"response-cache-stats:{endpoint}:{outcome}"
+
+
+def _incr(key, initial):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Missing or evicted; start from a value no earlier key could have used
+        cache.add(key, initial)
+        return cache.get(key)
+
+
+def namespace_versions(namespaces):
+    keys = [_version_key(namespace) for namespace in namespaces]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns())
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def invalidate(*namespaces):
+    """Bump `namespaces` now and again after commit, so readers inside the transaction miss too"""
+    def bump():
+        for namespace in namespaces:
+            _incr(_version_key(namespace), time.time_ns())
+
+    bump()
+    transaction.on_commit(bump)
+
+
+def invalidate_on(model, *namespaces):
+    """Bump `namespaces` whenever an instance of `model` is saved or deleted"""
+    def handler(sender, **kwargs):
+        invalidate(*namespaces)
+
+    # `model` may be a model class or an "app_label.ModelName" string
+    uid = f"response-cache:{model if isinstance(model, str) else model._meta.label}"
+    post_save.connect(handler, sender=model, weak=False, dispatch_uid=uid)
+    post_delete.connect(handler, sender=model, weak=False, dispatch_uid=uid)
+
+
+def cache_bypassed(request):
+    return (
+        request.query_params.get('nocache') in ('1', 'true')
+        or 'no-cache' in request.META.get('HTTP_CACHE_CONTROL', '')
+    )
+
+
+def _response_key(endpoint, request, view_kwargs, namespaces, per_user):
+    if per_user:
+        audience = f"user:{request.user.pk}"
+    else:
+        scope = get_scope(request)
+        audience = 'all' if scope.is_unrestricted else ','.join(map(str, sorted(scope.pharmacy_ids)))
+    params = sorted(
+        (name, values) for name, values in request.query_params.lists() if name != 'nocache'
+    )
+    raw = f"{endpoint}|{sorted(view_kwargs.items())}|{audience}|{namespace_versions(namespaces)}|{params}"
+    return f"response-cache:{endpoint}:{hashlib.md5(raw.encode()).hexdigest()}"
+
+
+def cache_response(*namespaces, timeout=None, per_user=False):
+    """
+    Cache successful GET responses of a DRF view function or handler method.
+
+    `namespaces` are the data the view reads ('pharmacies', 'medicines',
+    'inventory', 'sales', 'users'). Use per_user=True when the response
+    depends on the user beyond their pharmacy scope. Apply under @api_view,
+    or directly to a class-based view's handler method.
+    """
+    def decorator(view):
+        endpoint = f"{view.__module__}.{view.__qualname__}"
+        _endpoints.add(endpoint)
+
+        @functools.wraps(view)
+        def wrapped(*args, **kwargs):
+            # View functions get (request, ...), handler methods (self, request, ...)
+            request = args[0] if hasattr(args[0], 'query_params') else args[1]
+            if request.method != 'GET' or not getattr(settings, 'RESPONSE_CACHE_ENABLED', True):
+                return view(*args, **kwargs)
+
+            key = _response_key(endpoint, request, kwargs, namespaces, per_user)
+            bypass = cache_bypassed(request)
+            cached = None if bypass else cache.get(key)
+            if cached is not None:
+                _incr(_stats_key(endpoint, 'hit'), 1)
+                response = Response(cached)
+                response['X-Cache'] = 'HIT'
+                return response
+
+            response = view(*args, **kwargs)
+            _incr(_stats_key(endpoint, 'bypass' if bypass else 'miss'), 1)
+            if response.status_code == 200 and isinstance(response, Response):
+                cache.set(
+                    key, response.data,
+                    timeout if timeout is not None else getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 60)
+                )
+            response['X-Cache'] = 'BYPASS' if bypass else 'MISS'
+            return response
+        return wrapped
+    return decorator
+
+
+def response_cache_stats():
+    """Hit, miss and bypass counts and hit rate per cached endpoint"""
+    keys = {
+        (endpoint, outcome): _stats_key(endpoint, outcome)
+        for endpoint in _endpoints for outcome in OUTCOMES
+    }
+    counts = cache.get_many(keys.values())
+    stats = []
+    for endpoint in sorted(_endpoints):
+        row = {outcome: counts.get(keys[endpoint, outcome], 0) for outcome in OUTCOMES}
+        lookups = row['hit'] + row['miss']
+        row['hit_rate'] = round(row['hit'] / lookups, 3) if lookups else None
+        stats.append({'endpoint': endpoint, **row})
+    return stats
+
+
+def reset_response_cache_stats():
+    cache.delete_many([
+        _stats_key(endpoint, outcome) for endpoint in _endpoints for outcome in OUTCOMES
+    ])
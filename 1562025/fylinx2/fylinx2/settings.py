@@ -33,6 +33,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'rest_framework',
+    'rest_framework.authtoken',
     'corsheaders',
     'accounts',
     'static',
@@ -47,7 +48,7 @@ AUTH_USER_MODEL = 'accounts.CustomUser'
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.TokenAuthentication',
+        'accounts.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -64,6 +65,69 @@ REST_FRAMEWORK = {
     ],
 }
 
+# Sale / return number allocation (see sales.sequences)
+# Each worker reserves this many numbers per database round trip.
+SALE_NUMBER_BLOCK_SIZE = 50
+# Number sales per pharmacy (SALE-<pharmacy>-<date>-<n>) instead of chain-wide
+SALE_NUMBERS_PER_PHARMACY = False
+
+# Cache backend: 'locmem' (per process, the default), 'file' or 'redis'.
+# Response cache invalidation and cached pharmacy scopes are only shared
+# between worker processes with 'file' or 'redis'.
+CACHE_BACKEND = os.environ.get('FYLINX_CACHE_BACKEND', 'locmem')
+CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'fylinx2',
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('FYLINX_CACHE_LOCATION', str(BASE_DIR / '.cache')),
+    },
+    'redis': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('FYLINX_CACHE_LOCATION', 'redis://127.0.0.1:6379/1'),
+    },
+}
+CACHES = {
+    'default': CACHE_BACKENDS[CACHE_BACKEND],
+}
+
+# Cached API responses (see fylinx2.response_cache)
+RESPONSE_CACHE_ENABLED = True
+RESPONSE_CACHE_TIMEOUT = 60
+
+# Consolidated dashboard (see accounts.dashboard): seconds each section is
+# cached, batches listed per alert, and threads building sections at once
+DASHBOARD_SECTION_TIMEOUTS = {'profile': 300, 'sales': 60, 'stock': 120}
+DASHBOARD_ALERT_ITEMS = 5
+DASHBOARD_WORKERS = 3
+
+# Per-request query budgets and N+1 detection (see fylinx2.queries).
+# Violations are always counted; with QUERY_BUDGET_LOG_STACKS they are also
+# logged with the SQL and stack trace
+QUERY_BUDGET_ENABLED = True
+QUERY_BUDGET_LOG_STACKS = DEBUG
+# Budget of views that declare none; None means unlimited
+QUERY_BUDGET_DEFAULT = None
+# Times one statement shape may repeat in a request before it counts as N+1
+QUERY_N_PLUS_ONE_THRESHOLD = 5
+
+# Per-worker cache of API tokens and their users (see accounts.authentication)
+AUTH_TOKEN_CACHE_SIZE = 1024
+AUTH_TOKEN_CACHE_TIMEOUT = 300
+
+# Per-request phase timings (see fylinx2.timing): a Server-Timing header on
+# sampled responses and rolling percentiles per endpoint and role
+REQUEST_TIMING_ENABLED = True
+# Fraction of requests timed
+REQUEST_TIMING_SAMPLE_RATE = float(os.environ.get('FYLINX_REQUEST_TIMING_SAMPLE_RATE', 1.0))
+# Server-Timing header: True for every sampled response, 'staff' for
+# superusers and admins only, False for none
+REQUEST_TIMING_HEADER = DEBUG
+# Durations kept per endpoint, role and phase for the percentiles
+REQUEST_TIMING_WINDOW = 512
+
 # CORS Configuration for React Frontend
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",  # React development server
@@ -85,6 +149,8 @@ CORS_ALLOW_HEADERS = [
 ]
 
 MIDDLEWARE = [
+    'fylinx2.timing.RequestTimingMiddleware',
+    'fylinx2.queries.QueryBudgetMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -133,9 +199,21 @@ DATABASES = {
             'driver': 'ODBC Driver 18 for SQL Server',
             'extra_params': 'Encrypt=yes;TrustServerCertificate=yes;',
         },
+        # Keep each worker thread's connection open between requests instead
+        # of paying the TLS handshake and login on every request; 0 closes it
+        # after each request, None never expires it
+        'CONN_MAX_AGE': int(os.environ.get('FYLINX_DB_CONN_MAX_AGE', 60)),
+        # Ping a reused connection before its first query in a request
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Connections opened or verified at the start of each request, with the wait
+# recorded in the checkout metrics (see fylinx2.db)
+DB_CHECKOUT_ALIASES = ['default']
+# Open the connections when the worker loads the application
+DB_WARM_UP = os.environ.get('FYLINX_DB_WARM_UP', '1') != '0'
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -0,0 +1,68 @@
+"""
+Production settings for fylinx2.
+
+Use with DJANGO_SETTINGS_MODULE=fylinx2.settings_production. Everything
+not overridden here comes from fylinx2.settings; secrets and hosts are
+read from the environment.
+"""
+
+import os
+
+from .settings import *  # noqa: F401,F403
+from .settings import CACHE_BACKENDS, DATABASES
+
+DEBUG = False
+
+SECRET_KEY = os.environ['DJANGO_SECRET_KEY']
+
+ALLOWED_HOSTS = [host for host in os.environ.get('DJANGO_ALLOWED_HOSTS', '').split(',') if host]
+
+CORS_ALLOWED_ORIGINS = [
+    origin for origin in os.environ.get('FYLINX_CORS_ALLOWED_ORIGINS', '').split(',') if origin
+]
+
+DATABASES = {
+    'default': {
+        **DATABASES['default'],
+        'NAME': os.environ.get('FYLINX_DB_NAME', DATABASES['default']['NAME']),
+        'USER': os.environ.get('FYLINX_DB_USER', DATABASES['default']['USER']),
+        'PASSWORD': os.environ['FYLINX_DB_PASSWORD'],
+        'HOST': os.environ.get('FYLINX_DB_HOST', DATABASES['default']['HOST']),
+        'PORT': os.environ.get('FYLINX_DB_PORT', DATABASES['default']['PORT']),
+        'OPTIONS': {
+            'driver': os.environ.get('FYLINX_DB_DRIVER', 'ODBC Driver 18 for SQL Server'),
+            'extra_params': os.environ.get('FYLINX_DB_EXTRA_PARAMS', 'Encrypt=yes;TrustServerCertificate=no;'),
+            # Seconds to wait for a login, and how often to retry it
+            'connection_timeout': 10,
+            'connection_retries': 3,
+            'connection_retry_backoff_time': 2,
+            # Seconds before a statement is abandoned
+            'query_timeout': 30,
+        },
+        # Connections live for 10 minutes per worker thread; the health check
+        # replaces any the server or a firewall dropped in the meantime
+        'CONN_MAX_AGE': int(os.environ.get('FYLINX_DB_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
+    }
+}
+
+# Shared between worker processes so cache invalidation reaches all of them
+CACHES = {
+    'default': {
+        **CACHE_BACKENDS['redis'],
+        'TIMEOUT': 300,
+    },
+}
+
+# Violations are counted but not logged with a stack per statement; the base
+# settings default QUERY_BUDGET_LOG_STACKS to their own DEBUG, which is True
+QUERY_BUDGET_LOG_STACKS = False
+
+# Time one request in ten; the rest only pay a context lookup per hook
+REQUEST_TIMING_SAMPLE_RATE = float(os.environ.get('FYLINX_REQUEST_TIMING_SAMPLE_RATE', 0.1))
+# Internal timings are only shown to staff
+REQUEST_TIMING_HEADER = 'staff'
+
+SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
+SESSION_COOKIE_SECURE = True
+CSRF_COOKIE_SECURE = True
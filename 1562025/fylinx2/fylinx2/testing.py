@@ -0,0 +1,168 @@
+"""
+Test helpers for checking API endpoints against their query budgets.
+
+The apps' tests mix EndpointBudgetMixin into django.test.TestCase. It
+builds budget_fixtures() once per class, with `rows` rows per list so an
+N+1 pattern repeats often enough to be flagged, and calls each endpoint
+the way a client does: the statement count is checked against the budget
+the view declares with assert_query_budget(), and the status against the
+one the test expects. Responses are measured uncached.
+"""
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.test.utils import override_settings
+from django.urls import get_resolver, resolve
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.models import CustomUser
+from inventory.models import Inventory, Medicine, StockMovement
+from pharmacies.models import Pharmacy
+from pharmacies.scope import resolve_scope
+from sales.models import Sale, SaleItem, SaleReturn, SaleReturnItem
+from .queries import assert_query_budget, budget_for
+
+
+API_PREFIX = '/api/v1/'
+PASSWORD = 'budget-pass-1'
+
+
+def api_routes(patterns=None, prefix=''):
+    """(route, callback) for every URL route under API_PREFIX"""
+    routes = []
+    for pattern in get_resolver().url_patterns if patterns is None else patterns:
+        route = prefix + str(pattern.pattern)
+        if hasattr(pattern, 'url_patterns'):
+            routes.extend(api_routes(pattern.url_patterns, route))
+        elif ('/' + route).startswith(API_PREFIX):
+            routes.append((route, pattern.callback))
+    return routes
+
+
+def budget_fixtures(rows):
+    """
+    An admin and a manager of two pharmacies, with `rows` staff, medicines
+    and sales, and one batch per medicine in each pharmacy: every third
+    expired, every third near expiry, all low on stock.
+    """
+    today = timezone.now().date()
+    admin = CustomUser.objects.create_user(username='budget-admin', password=PASSWORD, role='ADMIN')
+    manager = CustomUser.objects.create_user(username='budget-manager', role='MANAGER')
+    pharmacies = [
+        Pharmacy.objects.create(name=f"Budget pharmacy {n}", location='Budget', created_by=admin)
+        for n in range(2)
+    ]
+    for pharmacy in pharmacies:
+        pharmacy.managers.add(manager)
+    staff = CustomUser.objects.bulk_create([
+        CustomUser(username=f"budget-staff-{n}", role='STAFF', assigned_pharmacy=pharmacies[n % 2])
+        for n in range(rows)
+    ])
+    medicines = Medicine.objects.bulk_create([
+        Medicine(
+            name=f"Budgetol {n}", generic_name='budgetamol', manufacturer='Budget',
+            dosage_form='tablet', strength=f"{n}mg"
+        )
+        for n in range(rows)
+    ])
+    inventories = []
+    for pharmacy in pharmacies:
+        for n, medicine in enumerate(medicines):
+            expiry = today + timedelta(days=(-10, 20, 400)[n % 3])
+            inventories.append(Inventory.objects.create(
+                pharmacy=pharmacy, medicine=medicine, batch_number=f"BUDGET-{n}", quantity=5,
+                unit_price='1.00', selling_price='2.00', expiry_date=expiry,
+                manufacture_date=today - timedelta(days=500), supplier='Budget', created_by=admin
+            ))
+    StockMovement.objects.bulk_create([
+        StockMovement(
+            inventory=inventory, movement_type='IN', quantity=5, notes='Opening stock', created_by=admin
+        )
+        for inventory in inventories
+    ])
+    sales = []
+    for n in range(rows):
+        pharmacy = pharmacies[n % 2]
+        sale = Sale.objects.create(
+            pharmacy=pharmacy, sale_number=f"BUDGET-SALE-{n}", subtotal='4.00',
+            total_amount='4.00', amount_paid='4.00', created_by=admin
+        )
+        lines = [inventory for inventory in inventories if inventory.pharmacy_id == pharmacy.id][:2]
+        items = SaleItem.objects.bulk_create([
+            SaleItem(sale=sale, inventory=inventory, quantity=1, unit_price='2.00', total_price='2.00')
+            for inventory in lines
+        ])
+        sale_return = SaleReturn.objects.create(
+            original_sale=sale, return_number=f"BUDGET-RETURN-{n}", reason='OTHER',
+            return_amount='2.00', created_by=admin
+        )
+        SaleReturnItem.objects.create(
+            sale_return=sale_return, sale_item=items[0], return_quantity=1, return_amount='2.00'
+        )
+        SaleItem.objects.filter(pk=items[0].pk).update(returned_quantity=1)
+        sales.append(sale)
+    return {
+        'admin': admin,
+        'manager': manager,
+        'pharmacies': pharmacies,
+        'staff': staff,
+        'medicines': medicines,
+        'inventories': inventories,
+        'sales': sales,
+    }
+
+
+class EndpointBudgetMixin:
+    """Query budget assertions for django.test.TestCase; see the module docstring"""
+    rows = 12
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.fixtures = budget_fixtures(cls.rows)
+
+    def setUp(self):
+        super().setUp()
+        # Nothing cached by an earlier test may save a statement here
+        cache.clear()
+        uncached = override_settings(RESPONSE_CACHE_ENABLED=False)
+        uncached.enable()
+        self.addCleanup(uncached.disable)
+
+    def budget_client(self, user):
+        """An APIClient logged in as `user`, with the user's pharmacy scope cached"""
+        client = APIClient()
+        # Logging in saves the user, which drops its cached scope
+        client.force_login(user)
+        resolve_scope(user)
+        return client
+
+    def assertWithinBudget(self, client, method, path, data=None, status=None):
+        """
+        Call `path` (relative to API_PREFIX) and check its statement count
+        against the view's budget and its status against `status` (any 2xx
+        if None). Returns the response.
+        """
+        match = resolve(API_PREFIX + path.split('?')[0])
+        budget = budget_for(match.func, method)
+        self.assertIsNotNone(budget, f"{method} {match.route} declares no query budget")
+        with assert_query_budget(budget):
+            response = getattr(client, method.lower())(API_PREFIX + path, data, format='json')
+            if response.streaming:
+                b''.join(response.streaming_content)
+        if status is None:
+            self.assertTrue(
+                200 <= response.status_code < 300,
+                f"{method} {path} returned {response.status_code}"
+            )
+        else:
+            self.assertEqual(response.status_code, status, f"{method} {path}")
+        return response
+
+    def assertRequestsWithinBudget(self, user, requests):
+        """assertWithinBudget() for each (method, path, data, status) in turn, as `user`"""
+        client = self.budget_client(user)
+        for method, path, data, status in requests:
+            with self.subTest(method=method, path=path):
+                self.assertWithinBudget(client, method, path, data, status)
@@ -0,0 +1,40 @@
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.test import APIClient
+
+from accounts.models import CustomUser
+from .queries import budget_for
+from .testing import api_routes
+
+
+class QueryBudgetDeclarationTests(SimpleTestCase):
+
+    def test_every_api_view_declares_a_budget(self):
+        for route, callback in api_routes():
+            view = callback.cls
+            for method in view().allowed_methods:
+                if method in ('OPTIONS', 'HEAD'):
+                    continue
+                with self.subTest(route=route, method=method):
+                    self.assertIsNotNone(budget_for(callback, method), f"{method} {route} declares no query budget")
+
+
+@override_settings(REQUEST_TIMING_ENABLED=True, REQUEST_TIMING_SAMPLE_RATE=1.0)
+class ServerTimingTests(TestCase):
+
+    def setUp(self):
+        self.admin = CustomUser.objects.create_user(username='timing-admin', role='ADMIN')
+        self.manager = CustomUser.objects.create_user(username='timing-manager', role='MANAGER')
+
+    def header_for(self, user):
+        client = APIClient()
+        client.force_login(user)
+        return client.get('/api/v1/auth/profile/').headers.get('Server-Timing')
+
+    def test_staff_only(self):
+        with self.settings(REQUEST_TIMING_HEADER='staff'):
+            self.assertIn('db;dur=', self.header_for(self.admin))
+            self.assertIsNone(self.header_for(self.manager))
+
+    def test_off(self):
+        with self.settings(REQUEST_TIMING_HEADER=False):
+            self.assertIsNone(self.header_for(self.admin))
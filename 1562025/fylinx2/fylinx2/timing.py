@@ -0,0 +1,330 @@
+"""
+Per-request latency breakdown: Server-Timing header and rolling percentiles.
+
+RequestTimingMiddleware times a sample of requests (REQUEST_TIMING_SAMPLE_RATE)
+and splits each one into phases:
+- auth: DRF authentication (APIView.perform_authentication);
+- queryset: the view's get_queryset();
+- db: SQL statements, on every database alias;
+- validate: serializer is_valid();
+- serialize: serializer .data, and the values()-based mappers of fylinx2.lean;
+- render: JSONRenderer.render();
+- view: everything else in the request, e.g. Python-side aggregation.
+
+Phases are exclusive: a query run while serializing counts as db, not as
+serialize, so the phases add up to the total. A slow endpoint then shows
+directly whether its time goes to the database or to Python work.
+
+DRF has no extension point for serializers or get_queryset, so install()
+wraps those hooks once, at the first request. Each wrapper checks for a
+timer in the current context, so unsampled requests pay only that check.
+
+Sampled responses can carry a Server-Timing header that the browser's
+developer tools display. It reveals how the server spends its time, so
+REQUEST_TIMING_HEADER sends it to everyone (True), only to superusers and
+admins ('staff') or to no one (False). Each phase's last
+REQUEST_TIMING_WINDOW durations are kept per endpoint and per user role;
+timing_stats() turns them into p50/p95/p99. The figures are per process.
+"""
+import contextvars
+import functools
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.urls import get_resolver
+from django.utils.functional import empty
+
+
+PHASES = ('auth', 'queryset', 'db', 'validate', 'serialize', 'render', 'view')
+QUANTILES = (0.5, 0.95, 0.99)
+DEFAULT_WINDOW = 512
+# Roles (as _role() names them) shown the header when REQUEST_TIMING_HEADER is 'staff'
+STAFF_ROLES = ('superuser', 'admin')
+
+_current = contextvars.ContextVar('request_timer', default=None)
+
+
+class RequestTimer:
+    """Exclusive time per phase for one request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.seconds = defaultdict(float)
+        self.queries = 0
+        self._stack = []
+
+    def enter(self, name):
+        now = time.perf_counter()
+        if self._stack:
+            # Pause the enclosing phase
+            outer = self._stack[-1]
+            self.seconds[outer[0]] += now - outer[1]
+        self._stack.append([name, now])
+
+    def exit(self):
+        now = time.perf_counter()
+        name, resumed = self._stack.pop()
+        self.seconds[name] += now - resumed
+        if self._stack:
+            self._stack[-1][1] = now
+
+    def phases(self):
+        """{phase: seconds} for every phase, with `view` the unattributed remainder, plus `total`"""
+        total = time.perf_counter() - self.started
+        phases = {name: self.seconds.get(name, 0.0) for name in PHASES if name != 'view'}
+        phases['view'] = max(total - sum(phases.values()), 0.0)
+        phases['total'] = total
+        return phases
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper hook
+        self.queries += 1
+        self.enter('db')
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.exit()
+
+
+@contextmanager
+def phase(name):
+    """Charge the enclosed block to `name` if the current request is being timed"""
+    timer = _current.get()
+    if timer is None:
+        yield
+        return
+    timer.enter(name)
+    try:
+        yield
+    finally:
+        timer.exit()
+
+
+def timed(name):
+    """Decorator form of phase()"""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapped(*args, **kwargs):
+            timer = _current.get()
+            if timer is None:
+                return function(*args, **kwargs)
+            timer.enter(name)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                timer.exit()
+        wrapped.timed_phase = name
+        return wrapped
+    return decorator
+
+
+def _timed_property(prop, name):
+    return property(timed(name)(prop.fget), prop.fset, prop.fdel, prop.__doc__)
+
+
+_installed = False
+_install_lock = threading.Lock()
+
+
+def _view_classes(patterns):
+    for pattern in patterns:
+        if hasattr(pattern, 'url_patterns'):
+            yield from _view_classes(pattern.url_patterns)
+        else:
+            view_class = getattr(pattern.callback, 'view_class', None)
+            if view_class is not None:
+                yield view_class
+
+
+def install():
+    """Wrap the DRF hooks and every routed view's get_queryset; safe to call repeatedly"""
+    global _installed
+    with _install_lock:
+        if _installed:
+            return
+        from rest_framework.renderers import JSONRenderer
+        from rest_framework.serializers import BaseSerializer
+        from rest_framework.views import APIView
+
+        APIView.perform_authentication = timed('auth')(APIView.perform_authentication)
+        BaseSerializer.is_valid = timed('validate')(BaseSerializer.is_valid)
+        BaseSerializer.data = _timed_property(BaseSerializer.data, 'serialize')
+        JSONRenderer.render = timed('render')(JSONRenderer.render)
+
+        for view_class in set(_view_classes(get_resolver().url_patterns)):
+            get_queryset = getattr(view_class, 'get_queryset', None)
+            if get_queryset is not None and getattr(get_queryset, 'timed_phase', None) is None:
+                view_class.get_queryset = timed('queryset')(get_queryset)
+        _installed = True
+
+
+_lock = threading.Lock()
+_series = {}
+
+
+def _window():
+    return getattr(settings, 'REQUEST_TIMING_WINDOW', DEFAULT_WINDOW)
+
+
+def _record(endpoint, role, phases):
+    with _lock:
+        series = _series.get((endpoint, role))
+        if series is None:
+            series = _series[endpoint, role] = {
+                'count': 0,
+                'sum': defaultdict(float),
+                'recent': {name: deque(maxlen=_window()) for name in (*PHASES, 'total')},
+            }
+        series['count'] += 1
+        for name, seconds in phases.items():
+            series['sum'][name] += seconds
+            series['recent'][name].append(seconds)
+
+
+def _quantile(ordered, q):
+    # Nearest rank
+    return ordered[min(len(ordered) - 1, max(int(q * len(ordered) + 0.5) - 1, 0))]
+
+
+def _snapshot():
+    """(endpoint, role, count, sums, sorted recent durations per phase) per series"""
+    with _lock:
+        snapshot = [
+            (endpoint, role, series['count'], dict(series['sum']),
+             {name: sorted(values) for name, values in series['recent'].items()})
+            for (endpoint, role), series in _series.items()
+        ]
+    return sorted(snapshot, key=lambda row: row[:2])
+
+
+def timing_stats():
+    """Per endpoint and role: request count, and mean and percentiles in ms per phase"""
+    rows = []
+    for endpoint, role, count, sums, recent in _snapshot():
+        phases = {}
+        for name, ordered in recent.items():
+            if not ordered:
+                continue
+            phases[name] = {
+                'mean_ms': round(sums[name] * 1000 / count, 3),
+                **{f"p{int(q * 100)}_ms": round(_quantile(ordered, q) * 1000, 3) for q in QUANTILES},
+            }
+        rows.append({'endpoint': endpoint, 'role': role, 'requests': count, 'phases': phases})
+    return rows
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def timing_exposition():
+    """timing_stats() as Prometheus summaries, in seconds"""
+    lines = [
+        '# HELP fylinx2_request_phase_seconds Time per request phase (exclusive)',
+        '# TYPE fylinx2_request_phase_seconds summary',
+    ]
+    for endpoint, role, count, sums, recent in _snapshot():
+        for name, ordered in recent.items():
+            if not ordered:
+                continue
+            labels = f'endpoint="{_label(endpoint)}",role="{_label(role)}",phase="{name}"'
+            for q in QUANTILES:
+                lines.append(f'fylinx2_request_phase_seconds{{{labels},quantile="{q}"}} {_quantile(ordered, q):.6f}')
+            lines.append(f'fylinx2_request_phase_seconds_sum{{{labels}}} {sums[name]:.6f}')
+            lines.append(f'fylinx2_request_phase_seconds_count{{{labels}}} {count}')
+    return '\n'.join(lines) + '\n'
+
+
+def reset_timing_stats():
+    with _lock:
+        _series.clear()
+
+
+def _role(request):
+    user = request.__dict__.get('user')
+    # Leave an unevaluated lazy user alone rather than query for it
+    if user is None or getattr(user, '_wrapped', None) is empty:
+        return 'unknown'
+    if not user.is_authenticated:
+        return 'anonymous'
+    if user.is_superuser:
+        return 'superuser'
+    return (user.role or 'none').lower()
+
+
+def server_timing(timer):
+    """The Server-Timing header value for `timer`, durations in ms"""
+    entries = []
+    for name, seconds in timer.phases().items():
+        entry = f"{name};dur={seconds * 1000:.3f}"
+        if name == 'db':
+            entry += f';desc="{timer.queries} queries"'
+        entries.append(entry)
+    return ', '.join(entries)
+
+
+class RequestTimingMiddleware:
+    """
+    Time a sample of requests by phase (see the module docstring). Place it
+    first in MIDDLEWARE so `total` covers the other middleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, 'REQUEST_TIMING_ENABLED', True)
+        self.sample_rate = getattr(settings, 'REQUEST_TIMING_SAMPLE_RATE', 1.0)
+        self.header = getattr(settings, 'REQUEST_TIMING_HEADER', settings.DEBUG)
+        if self.enabled:
+            install()
+
+    def __call__(self, request):
+        if not self.enabled or random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        timer = RequestTimer()
+        token = _current.set(timer)
+        try:
+            with self._db(timer):
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+
+        if self.header is True or (self.header == 'staff' and _role(request) in STAFF_ROLES):
+            response['Server-Timing'] = server_timing(timer)
+        if getattr(request, 'request_timing_endpoint', None) is None:
+            # Not routed to a view
+            return response
+        if response.streaming:
+            # Exports run their queries while the body is sent
+            response.streaming_content = self._stream(response.streaming_content, request, timer)
+        else:
+            _record(request.request_timing_endpoint, _role(request), timer.phases())
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.request_timing_endpoint = f"{request.method} {request.resolver_match.route}"
+
+    def _db(self, timer):
+        stack = ExitStack()
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(timer))
+        return stack
+
+    def _stream(self, content, request, timer):
+        chunks = iter(content)
+        while True:
+            token = _current.set(timer)
+            try:
+                with self._db(timer):
+                    chunk = next(chunks, None)
+            finally:
+                _current.reset(token)
+            if chunk is None:
+                break
+            yield chunk
+        _record(request.request_timing_endpoint, _role(request), timer.phases())
@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fylinx2.settings')
 
 application = get_wsgi_application()
+
+from fylinx2.db import prepare_worker  # noqa: E402
+
+prepare_worker()
@@ -0,0 +1,120 @@
+"""
+First-expiry-first-out (FEFO) batch allocation.
+
+A sale line may name a medicine instead of a batch. allocate_fefo() splits
+such lines across the pharmacy's unexpired batches, soonest expiry first.
+Every candidate batch for the whole basket is read, and locked, by one
+query. The rows are locked in id order, the order every stock UPDATE takes
+its locks in, so two checkouts cannot each hold a row the other is waiting
+for; the basket's explicit batches are locked by the same query for that
+reason. The candidates are then sorted into FEFO order in memory and the
+split is a walk over per-medicine queues. The stock itself is still taken
+by inventory.stock.decrement_stock, so allocation never writes.
+"""
+from collections import defaultdict
+
+from django.db.models import Q
+
+from .models import Inventory
+from .stock import StockShortfall
+
+
+class AllocationShortfall(StockShortfall):
+    """Raised when a pharmacy's unexpired batches cannot cover a medicine line"""
+
+    def __init__(self, shortfalls):
+        self.shortfalls = shortfalls
+        Exception.__init__(
+            self,
+            "Insufficient stock for medicine "
+            + ", ".join(str(item['medicine']) for item in shortfalls)
+        )
+
+
+def fefo_batches(pharmacy_id, medicine_ids, today, lock=True, lock_ids=()):
+    """
+    Unexpired in-stock batches for `medicine_ids`, as {medicine_id: [Inventory, ...]}
+    with each list in FEFO order. With `lock`, the batches `lock_ids` are
+    locked alongside them, all in id order.
+    """
+    candidates = Q(
+        pharmacy_id=pharmacy_id,
+        medicine_id__in=medicine_ids,
+        expiry_date__gte=today,
+        quantity__gt=0
+    )
+    queryset = Inventory.objects.only(
+        'id', 'pharmacy_id', 'medicine_id', 'quantity', 'selling_price', 'expiry_date'
+    )
+    if lock:
+        queryset = queryset.filter(candidates | Q(pk__in=list(lock_ids))).select_for_update().order_by('id')
+    else:
+        queryset = queryset.filter(candidates).order_by('id')
+
+    medicine_ids = set(medicine_ids)
+    queues = defaultdict(list)
+    for inventory in queryset:
+        # Explicit batches that are not candidates were only locked
+        if (inventory.pharmacy_id == pharmacy_id and inventory.medicine_id in medicine_ids
+                and inventory.expiry_date >= today and inventory.quantity > 0):
+            queues[inventory.medicine_id].append(inventory)
+    for batches in queues.values():
+        batches.sort(key=lambda inventory: (inventory.expiry_date, inventory.id))
+    return queues
+
+
+def allocate_fefo(pharmacy_id, lines, today, lock_ids=()):
+    """
+    Split medicine lines across batches, soonest expiry first.
+
+    `lines` is a list of dicts with `medicine`, `quantity` and an optional
+    `unit_price`. Returns sale lines with `inventory` (an Inventory instance),
+    `quantity` and `unit_price`; the price defaults to each batch's selling
+    price. Raises AllocationShortfall listing every medicine that cannot be
+    covered. `lock_ids` are the basket's explicit batches, locked in the same
+    statement as the candidates. Must be called inside transaction.atomic()
+    for the locks to hold.
+    """
+    if not lines:
+        return []
+
+    queues = fefo_batches(pharmacy_id, {line['medicine'] for line in lines}, today, lock_ids=lock_ids)
+    # Quantity still free on each batch, shared by lines for the same medicine
+    remaining = {
+        inventory.id: inventory.quantity
+        for batches in queues.values()
+        for inventory in batches
+    }
+
+    requested = defaultdict(int)
+    for line in lines:
+        requested[line['medicine']] += line['quantity']
+
+    allocated = []
+    shortfalls = {}
+    for line in lines:
+        needed = line['quantity']
+        unit_price = line.get('unit_price')
+        for inventory in queues.get(line['medicine'], ()):
+            if not needed:
+                break
+            take = min(needed, remaining[inventory.id])
+            if not take:
+                continue
+            remaining[inventory.id] -= take
+            needed -= take
+            allocated.append({
+                'inventory': inventory,
+                'quantity': take,
+                'unit_price': inventory.selling_price if unit_price is None else unit_price,
+            })
+        if needed:
+            shortfalls[line['medicine']] = {
+                'medicine': line['medicine'],
+                'requested': requested[line['medicine']],
+                'available': sum(inventory.quantity for inventory in queues.get(line['medicine'], ())),
+            }
+
+    if shortfalls:
+        raise AllocationShortfall(list(shortfalls.values()))
+    return allocated
@@ -4,16 +4,22 @@ from . import api_views
 urlpatterns = [
     # Medicine endpoints
     path('medicines/', api_views.MedicineListCreateAPIView.as_view(), name='api_medicine_list_create'),
+    path('medicines/search/', api_views.medicine_search, name='api_medicine_search'),
     
     # Inventory endpoints
     path('inventory/', api_views.InventoryListCreateAPIView.as_view(), name='api_inventory_list_create'),
+    path('inventory/import/', api_views.import_inventory, name='api_inventory_import'),
     path('inventory/<int:pk>/', api_views.InventoryDetailAPIView.as_view(), name='api_inventory_detail'),
+    path('inventory/<int:pk>/stock-at/', api_views.stock_at, name='api_inventory_stock_at'),
     
     # Stock management endpoints
     path('inventory/adjust-stock/', api_views.adjust_stock, name='api_adjust_stock'),
+    path('inventory/stock-take/', api_views.stock_take_view, name='api_stock_take'),
     path('inventory/low-stock/', api_views.low_stock_alerts, name='api_low_stock'),
     path('inventory/expired/', api_views.expired_items, name='api_expired_items'),
+    path('inventory/expiring/', api_views.expiring_items, name='api_expiring_items'),
     
     # Stock movement endpoints
     path('stock-movements/', api_views.StockMovementListAPIView.as_view(), name='api_stock_movements'),
+    path('stock-movements/export/', api_views.export_stock_movements, name='api_stock_movements_export'),
 ]
\ No newline at end of file
@@ -1,16 +1,50 @@
 from rest_framework import generics, status, permissions
 from rest_framework.decorators import api_view, permission_classes
+from rest_framework.exceptions import ParseError
 from rest_framework.response import Response
+from datetime import datetime
 from django.shortcuts import get_object_or_404
-from django.db import transaction
+from django.db.models import Count, Sum
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
 from .models import Medicine, Inventory, StockMovement
+from .stock import StockShortfall, apply_movement
+from .ledger import stock_on_hand_at
+from .intake import IMPORT_FORMATS, import_rows, read_rows
+from .stocktake import stock_take
+from .search import DEFAULT_LIMIT, DOCUMENT_FIELDS, MAX_LIMIT, search_medicines
+from .lean import inventory_mapper, stock_movement_mapper
+from .expiry import (
+    DEFAULT_HORIZON_DAYS, MAX_HORIZON_DAYS, expiring_within, expiry_bands, request_today
+)
 from .serializers import (
     MedicineSerializer, InventorySerializer, StockMovementSerializer,
     InventoryCreateSerializer, StockAdjustmentSerializer
 )
 from pharmacies.models import Pharmacy
+from pharmacies.scope import get_scope
+from sales.periods import filter_created_between
+from fylinx2.permissions import DenyAll
+from fylinx2.queries import query_budget
+from fylinx2.response_cache import cache_response
+from fylinx2.exports import EXPORT_FORMATS, get_export_format, stream_export
+from fylinx2.pagination import InvalidCursor, KeysetPagination, get_page_size, keyset_page
+
+
+def _id_param(request, name):
+    """Query param `name` as an int, None if absent; ValueError if it is not a number"""
+    value = request.query_params.get(name)
+    if not value:
+        return None
+    return int(value)
+
+
+def _bad_id_response(name):
+    return Response({
+        'success': False,
+        'message': f'{name} must be an integer'
+    }, status=status.HTTP_400_BAD_REQUEST)
 
 
 class MedicineListCreateAPIView(generics.ListCreateAPIView):
@@ -18,19 +52,77 @@ class MedicineListCreateAPIView(generics.ListCreateAPIView):
     queryset = Medicine.objects.all()
     serializer_class = MedicineSerializer
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = {'GET': 4, 'POST': 4}
     
     def get_permissions(self):
         if self.request.method == 'POST':
             # Only admins and managers can create medicines
             if self.request.user.role in ['ADMIN', 'MANAGER'] or self.request.user.is_superuser:
                 return [permissions.IsAuthenticated()]
-            return [permissions.DenyAll()]
+            return [DenyAll()]
         return [permissions.IsAuthenticated()]
+    
+    @cache_response('medicines')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+
+@query_budget(5)
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def medicine_search(request):
+    """Search the medicine catalog by name, generic name, manufacturer or strength"""
+    query = request.query_params.get('q', '').strip()
+    if not query:
+        return Response({
+            'success': False,
+            'message': 'q is required'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        pharmacy_id = _id_param(request, 'pharmacy_id')
+    except ValueError:
+        return _bad_id_response('pharmacy_id')
+    try:
+        limit = min(max(int(request.query_params.get('limit', DEFAULT_LIMIT)), 1), MAX_LIMIT)
+    except (TypeError, ValueError):
+        limit = DEFAULT_LIMIT
+    
+    matches = search_medicines(query, limit)
+    
+    # Sellable stock of the matched medicines in the caller's pharmacies
+    stock = {}
+    if matches:
+        queryset = get_scope(request).filter(Inventory.objects.filter(
+            medicine_id__in=[medicine_id for medicine_id, _, _ in matches],
+            quantity__gt=0,
+            expiry_date__gte=request_today(request)
+        ))
+        if pharmacy_id is not None:
+            queryset = queryset.filter(pharmacy_id=pharmacy_id)
+        stock = dict(
+            queryset.values('medicine_id').annotate(total=Sum('quantity')).values_list('medicine_id', 'total')
+        )
+    
+    return Response({
+        'success': True,
+        'query': query,
+        'results': [
+            {
+                'id': medicine_id,
+                **dict(zip(DOCUMENT_FIELDS, document)),
+                'score': score,
+                'stock_quantity': stock.get(medicine_id, 0),
+                'in_stock': medicine_id in stock
+            }
+            for medicine_id, score, document in matches
+        ]
+    })
 
 
 class InventoryListCreateAPIView(generics.ListCreateAPIView):
     """API endpoint for listing and creating inventory items"""
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = {'GET': 4, 'POST': 8}
     
     def get_serializer_class(self):
         if self.request.method == 'POST':
@@ -38,28 +130,24 @@ class InventoryListCreateAPIView(generics.ListCreateAPIView):
         return InventorySerializer
     
     def get_queryset(self):
-        user = self.request.user
-        pharmacy_id = self.request.query_params.get('pharmacy_id')
+        try:
+            pharmacy_id = _id_param(self.request, 'pharmacy_id')
+        except ValueError:
+            raise ParseError("pharmacy_id must be an integer")
         
-        if user.is_superuser or user.role == 'ADMIN':
-            queryset = Inventory.objects.all()
-        elif user.role == 'MANAGER':
-            managed_pharmacy_ids = user.managed_pharmacies.values_list('id', flat=True)
-            queryset = Inventory.objects.filter(pharmacy_id__in=managed_pharmacy_ids)
-        elif user.role == 'STAFF':
-            if user.assigned_pharmacy:
-                queryset = Inventory.objects.filter(pharmacy=user.assigned_pharmacy)
-            else:
-                queryset = Inventory.objects.none()
-        else:
-            queryset = Inventory.objects.none()
+        queryset = get_scope(self.request).filter(Inventory.objects.all())
         
         # Filter by pharmacy if specified
-        if pharmacy_id:
+        if pharmacy_id is not None:
             queryset = queryset.filter(pharmacy_id=pharmacy_id)
         
         return queryset.select_related('medicine', 'pharmacy')
     
+    def list(self, request, *args, **kwargs):
+        # values() fast path; same JSON as InventorySerializer
+        rows = self.paginate_queryset(inventory_mapper.values(self.get_queryset()))
+        return self.get_paginated_response(inventory_mapper.many(rows, self.get_serializer_context()))
+    
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
@@ -87,26 +175,73 @@ class InventoryListCreateAPIView(generics.ListCreateAPIView):
         }, status=status.HTTP_400_BAD_REQUEST)
 
 
+@query_budget(11)
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def import_inventory(request):
+    """
+    Bulk-import inventory lines (a goods-received note) from a CSV or JSON
+    `file` upload, or a JSON body of rows. Nothing is written if any row is
+    invalid unless `partial` is set.
+    """
+    upload = request.FILES.get('file')
+    if upload is not None:
+        file_format = request.data.get('file_format') or upload.name.rsplit('.', 1)[-1].lower()
+        if file_format not in IMPORT_FORMATS:
+            return Response({
+                'success': False,
+                'message': f"file_format must be one of: {', '.join(IMPORT_FORMATS)}"
+            }, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            rows = read_rows(upload.read().decode('utf-8-sig'), file_format)
+        except (UnicodeDecodeError, ValueError) as error:
+            return Response({
+                'success': False,
+                'message': f'Could not read file: {error}'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        options = request.data
+    elif isinstance(request.data, list):
+        rows, options = request.data, request.query_params
+    else:
+        rows, options = request.data.get('rows'), request.data
+    
+    if not isinstance(rows, list) or not rows or not all(isinstance(row, dict) for row in rows):
+        return Response({
+            'success': False,
+            'message': 'Provide a non-empty list of rows or a file'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    result = import_rows(
+        rows, request.user, get_scope(request),
+        reference_number=str(options.get('reference_number', ''))[:100],
+        partial=str(options.get('partial', '')).lower() in ('1', 'true')
+    )
+    
+    if not result.imported:
+        return Response({
+            'success': False,
+            'message': 'No rows were imported',
+            **result.as_dict()
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    return Response({
+        'success': True,
+        'message': f'{result.imported} inventory lines imported',
+        **result.as_dict()
+    }, status=status.HTTP_201_CREATED)
+
+
 class InventoryDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
     """API endpoint for retrieving, updating, and deleting inventory items"""
     serializer_class = InventorySerializer
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = {'GET': 5, 'PUT': 7, 'PATCH': 7, 'DELETE': 7}
     
     def get_queryset(self):
-        user = self.request.user
-        
-        if user.is_superuser or user.role == 'ADMIN':
-            return Inventory.objects.all()
-        elif user.role == 'MANAGER':
-            managed_pharmacy_ids = user.managed_pharmacies.values_list('id', flat=True)
-            return Inventory.objects.filter(pharmacy_id__in=managed_pharmacy_ids)
-        elif user.role == 'STAFF':
-            if user.assigned_pharmacy:
-                return Inventory.objects.filter(pharmacy=user.assigned_pharmacy)
-        
-        return Inventory.objects.none()
+        return get_scope(self.request).filter(Inventory.objects.all())
 
 
+@query_budget(10)
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
 def adjust_stock(request):
@@ -114,49 +249,41 @@ def adjust_stock(request):
     serializer = StockAdjustmentSerializer(data=request.data)
     
     if serializer.is_valid():
-        inventory_id = serializer.validated_data['inventory_id']
         adjustment_quantity = serializer.validated_data['adjustment_quantity']
         movement_type = serializer.validated_data['movement_type']
         reference_number = serializer.validated_data.get('reference_number', '')
         notes = serializer.validated_data.get('notes', '')
         
-        inventory = get_object_or_404(Inventory, id=inventory_id)
+        inventory = serializer.validated_data['inventory']
         
         # Check permissions
-        user = request.user
-        if not (user.is_superuser or 
-                user.role == 'ADMIN' or
-                (user.role == 'MANAGER' and inventory.pharmacy in user.managed_pharmacies.all()) or
-                (user.role == 'STAFF' and inventory.pharmacy == user.assigned_pharmacy)):
+        if not get_scope(request).allows(inventory.pharmacy_id):
             return Response({
                 'success': False,
                 'message': 'You do not have permission to adjust this inventory'
             }, status=status.HTTP_403_FORBIDDEN)
         
-        with transaction.atomic():
-            # Create stock movement record
-            movement_quantity = adjustment_quantity
-            if movement_type == 'OUT':
-                movement_quantity = -adjustment_quantity
-            
-            StockMovement.objects.create(
-                inventory=inventory,
-                movement_type=movement_type,
-                quantity=movement_quantity,
+        try:
+            apply_movement(
+                inventory.id,
+                movement_type,
+                adjustment_quantity,
+                request.user,
                 reference_number=reference_number,
-                notes=notes,
-                created_by=request.user
+                notes=notes
             )
-            
-            # Update inventory quantity
-            if movement_type == 'IN':
-                inventory.quantity += adjustment_quantity
-            elif movement_type == 'OUT':
-                inventory.quantity -= adjustment_quantity
-            elif movement_type == 'ADJUSTMENT':
-                inventory.quantity = adjustment_quantity
-            
-            inventory.save()
+        except StockShortfall as exc:
+            available = exc.shortfalls[0]['available']
+            return Response({
+                'success': False,
+                'errors': {
+                    'non_field_errors': [
+                        f"Insufficient stock. Available: {available}, Requested: {adjustment_quantity}"
+                    ]
+                }
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        inventory.refresh_from_db(fields=['quantity', 'updated_at'])
         
         return Response({
             'success': True,
@@ -170,99 +297,289 @@ def adjust_stock(request):
     }, status=status.HTTP_400_BAD_REQUEST)
 
 
-@api_view(['GET'])
+@query_budget(8)
+@api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
-def low_stock_alerts(request):
-    """Get low stock alerts for user's accessible pharmacies"""
-    user = request.user
-    
-    if user.is_superuser or user.role == 'ADMIN':
-        low_stock_items = Inventory.objects.filter(quantity__lte=models.F('minimum_stock_level'))
-    elif user.role == 'MANAGER':
-        managed_pharmacy_ids = user.managed_pharmacies.values_list('id', flat=True)
-        low_stock_items = Inventory.objects.filter(
-            pharmacy_id__in=managed_pharmacy_ids,
-            quantity__lte=models.F('minimum_stock_level')
+def stock_take_view(request):
+    """
+    Apply a stock-take: counted quantities for many batches in one request.
+    Returns a variance report; `dry_run` reports without writing.
+    """
+    rows = request.data.get('counts')
+    if not isinstance(rows, list) or not rows or not all(isinstance(row, dict) for row in rows):
+        return Response({
+            'success': False,
+            'message': 'counts must be a non-empty list of {inventory, counted_quantity}'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    dry_run = str(request.data.get('dry_run', '')).lower() in ('1', 'true')
+    report, errors = stock_take(
+        rows, request.user, get_scope(request),
+        reference_number=str(request.data.get('reference_number', ''))[:100],
+        notes=str(request.data.get('notes', '')),
+        dry_run=dry_run
+    )
+    
+    if errors:
+        return Response({
+            'success': False,
+            'errors': [{'row': row, 'errors': row_errors} for row, row_errors in sorted(errors.items())]
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    return Response({
+        'success': True,
+        'message': 'Stock take checked' if dry_run else 'Stock take applied',
+        'dry_run': dry_run,
+        'report': report
+    })
+
+
+def _counts_by_pharmacy(queryset):
+    """Per-pharmacy row counts for `queryset` in one grouped query"""
+    rows = queryset.values('pharmacy_id', 'pharmacy__name').annotate(
+        count=Count('id')
+    ).order_by('pharmacy__name')
+    return [
+        {
+            'pharmacy': row['pharmacy_id'],
+            'pharmacy_name': row['pharmacy__name'],
+            'count': row['count']
+        }
+        for row in rows
+    ]
+
+
+def _inventory_alert_response(request, queryset, key, ordering):
+    """Shared body of the inventory alert endpoints (summary or keyset page)"""
+    if request.query_params.get('summary') in ('1', 'true'):
+        summary = _counts_by_pharmacy(queryset)
+        return Response({
+            'success': True,
+            'summary': summary,
+            'count': sum(row['count'] for row in summary)
+        })
+    
+    try:
+        items, next_cursor = keyset_page(
+            queryset.select_related('medicine', 'pharmacy'),
+            ordering,
+            cursor=request.query_params.get('cursor'),
+            page_size=get_page_size(request)
         )
-    elif user.role == 'STAFF':
-        if user.assigned_pharmacy:
-            low_stock_items = Inventory.objects.filter(
-                pharmacy=user.assigned_pharmacy,
-                quantity__lte=models.F('minimum_stock_level')
-            )
-        else:
-            low_stock_items = Inventory.objects.none()
-    else:
-        low_stock_items = Inventory.objects.none()
+    except InvalidCursor:
+        return Response({
+            'success': False,
+            'message': 'Invalid cursor'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    return Response({
+        'success': True,
+        key: InventorySerializer(items, many=True, context={'request': request}).data,
+        'next_cursor': next_cursor,
+        'has_more': next_cursor is not None
+    })
+
+
+@query_budget(5)
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def stock_at(request, pk):
+    """Get a batch's stock on hand at `at` (ISO datetime), rebuilt from the ledger"""
+    inventory = get_object_or_404(get_scope(request).filter(Inventory.objects.all()), pk=pk)
+    
+    at = parse_datetime(request.query_params.get('at', ''))
+    if at is None:
+        return Response({
+            'success': False,
+            'message': 'at must be an ISO 8601 datetime'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    if timezone.is_naive(at):
+        at = timezone.make_aware(at)
     
-    serializer = InventorySerializer(low_stock_items, many=True)
+    quantity, snapshot = stock_on_hand_at(inventory.id, at)
     
     return Response({
         'success': True,
-        'low_stock_items': serializer.data,
-        'count': low_stock_items.count()
+        'inventory': inventory.id,
+        'at': at,
+        'quantity': quantity,
+        'snapshot': {
+            'last_movement_id': snapshot.last_movement_id,
+            'taken_at': snapshot.taken_at,
+            'quantity': snapshot.quantity
+        } if snapshot else None
     })
 
 
+@query_budget(3)
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def low_stock_alerts(request):
+    """Get low stock alerts for user's accessible pharmacies, largest deficit first"""
+    low_stock_items = get_scope(request).filter(
+        Inventory.objects.filter(stock_deficit__gte=0)
+    )
+    
+    return _inventory_alert_response(
+        request, low_stock_items, 'low_stock_items',
+        ordering=[('stock_deficit', True), ('id', False)]
+    )
+
+
+@query_budget(3)
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
 def expired_items(request):
-    """Get expired items for user's accessible pharmacies"""
-    user = request.user
-    today = timezone.now().date()
-    
-    if user.is_superuser or user.role == 'ADMIN':
-        expired_items = Inventory.objects.filter(expiry_date__lt=today)
-    elif user.role == 'MANAGER':
-        managed_pharmacy_ids = user.managed_pharmacies.values_list('id', flat=True)
-        expired_items = Inventory.objects.filter(
-            pharmacy_id__in=managed_pharmacy_ids,
-            expiry_date__lt=today
+    """Get expired items for user's accessible pharmacies, longest expired first"""
+    today = request_today(request)
+    
+    expired_items = get_scope(request).filter(
+        Inventory.objects.filter(expiry_date__lt=today)
+    )
+    
+    return _inventory_alert_response(
+        request, expired_items, 'expired_items',
+        ordering=[('expiry_date', False), ('id', False)]
+    )
+
+
+@query_budget(4)
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def expiring_items(request):
+    """Get batches expiring within `days` (default 90), soonest first, with per-band totals"""
+    try:
+        horizon_days = int(request.query_params.get('days', DEFAULT_HORIZON_DAYS))
+    except (TypeError, ValueError):
+        horizon_days = 0
+    if not 1 <= horizon_days <= MAX_HORIZON_DAYS:
+        return Response({
+            'success': False,
+            'message': f'days must be between 1 and {MAX_HORIZON_DAYS}'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        pharmacy_id = _id_param(request, 'pharmacy_id')
+    except ValueError:
+        return _bad_id_response('pharmacy_id')
+    
+    today = request_today(request)
+    queryset = get_scope(request).filter(Inventory.objects.all())
+    if pharmacy_id is not None:
+        queryset = queryset.filter(pharmacy_id=pharmacy_id)
+    queryset = expiring_within(queryset, today, horizon_days)
+    
+    try:
+        items, next_cursor = keyset_page(
+            queryset.select_related('medicine', 'pharmacy'),
+            [('expiry_date', False), ('id', False)],
+            cursor=request.query_params.get('cursor'),
+            page_size=get_page_size(request)
         )
-    elif user.role == 'STAFF':
-        if user.assigned_pharmacy:
-            expired_items = Inventory.objects.filter(
-                pharmacy=user.assigned_pharmacy,
-                expiry_date__lt=today
-            )
-        else:
-            expired_items = Inventory.objects.none()
-    else:
-        expired_items = Inventory.objects.none()
+    except InvalidCursor:
+        return Response({
+            'success': False,
+            'message': 'Invalid cursor'
+        }, status=status.HTTP_400_BAD_REQUEST)
     
-    serializer = InventorySerializer(expired_items, many=True)
+    # The bands only depend on the filters, so later pages skip the grouped query
+    bands = None
+    if not request.query_params.get('cursor'):
+        bands = expiry_bands(queryset, today, horizon_days)
     
     return Response({
         'success': True,
-        'expired_items': serializer.data,
-        'count': expired_items.count()
+        'today': today,
+        'horizon_days': horizon_days,
+        'bands': bands,
+        'expiring_items': InventorySerializer(items, many=True, context={'request': request}).data,
+        'next_cursor': next_cursor,
+        'has_more': next_cursor is not None
     })
 
 
+@query_budget(3)
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def export_stock_movements(request):
+    """Stream the user's accessible stock movements as CSV or NDJSON, oldest first"""
+    file_format = get_export_format(request)
+    if file_format is None:
+        return Response({
+            'success': False,
+            'message': f"file_format must be one of: {', '.join(EXPORT_FORMATS)}"
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    movements = get_scope(request).filter(StockMovement.objects.all(), path='inventory__pharmacy')
+    
+    try:
+        inventory_id = _id_param(request, 'inventory_id')
+    except ValueError:
+        return _bad_id_response('inventory_id')
+    try:
+        pharmacy_id = _id_param(request, 'pharmacy_id')
+    except ValueError:
+        return _bad_id_response('pharmacy_id')
+    if inventory_id is not None:
+        movements = movements.filter(inventory_id=inventory_id)
+    if pharmacy_id is not None:
+        movements = movements.filter(inventory__pharmacy_id=pharmacy_id)
+    
+    # Filter by date range (half-open on created_at)
+    start_date = request.query_params.get('start_date')
+    end_date = request.query_params.get('end_date')
+    if start_date:
+        try:
+            start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
+            movements = filter_created_between(movements, start_date=start_date)
+        except ValueError:
+            pass
+    if end_date:
+        try:
+            end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
+            movements = filter_created_between(movements, end_date=end_date)
+        except ValueError:
+            pass
+    
+    return stream_export(request, movements.order_by('id'), {
+        'id': 'id',
+        'created_at': 'created_at',
+        'pharmacy_id': 'inventory__pharmacy_id',
+        'inventory_id': 'inventory_id',
+        'medicine_name': 'inventory__medicine__name',
+        'batch_number': 'inventory__batch_number',
+        'movement_type': 'movement_type',
+        'quantity': 'quantity',
+        'reference_number': 'reference_number',
+        'notes': 'notes',
+        'created_by': 'created_by__username',
+    }, 'stock-movements', file_format)
+
+
 class StockMovementListAPIView(generics.ListAPIView):
     """API endpoint for listing stock movements"""
+    pagination_class = KeysetPagination
     serializer_class = StockMovementSerializer
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = {'GET': 3}
     
     def get_queryset(self):
-        user = self.request.user
-        inventory_id = self.request.query_params.get('inventory_id')
+        try:
+            inventory_id = _id_param(self.request, 'inventory_id')
+        except ValueError:
+            raise ParseError("inventory_id must be an integer")
         
-        if user.is_superuser or user.role == 'ADMIN':
-            queryset = StockMovement.objects.all()
-        elif user.role == 'MANAGER':
-            managed_pharmacy_ids = user.managed_pharmacies.values_list('id', flat=True)
-            queryset = StockMovement.objects.filter(inventory__pharmacy_id__in=managed_pharmacy_ids)
-        elif user.role == 'STAFF':
-            if user.assigned_pharmacy:
-                queryset = StockMovement.objects.filter(inventory__pharmacy=user.assigned_pharmacy)
-            else:
-                queryset = StockMovement.objects.none()
-        else:
-            queryset = StockMovement.objects.none()
+        queryset = get_scope(self.request).filter(
+            StockMovement.objects.all(), path='inventory__pharmacy'
+        )
         
         # Filter by inventory if specified
-        if inventory_id:
+        if inventory_id is not None:
             queryset = queryset.filter(inventory_id=inventory_id)
         
-        return queryset.select_related('inventory__medicine', 'inventory__pharmacy', 'created_by')
\ No newline at end of file
+        return queryset.select_related('inventory__medicine', 'inventory__pharmacy', 'created_by')
+    
+    def list(self, request, *args, **kwargs):
+        # values() fast path; same JSON as StockMovementSerializer
+        rows = self.paginate_queryset(stock_movement_mapper.values(self.get_queryset()))
+        return self.get_paginated_response(stock_movement_mapper.many(rows, self.get_serializer_context()))
\ No newline at end of file
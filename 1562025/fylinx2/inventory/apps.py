@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class InventoryConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'inventory'
+
+    def ready(self):
+        from .search import connect_search_index
+        from .signals import connect_response_cache
+        connect_response_cache()
+        connect_search_index()
@@ -0,0 +1,87 @@
+"""
+Expiry horizon queries for inventory batches.
+
+Batches expiring within a horizon are found with a range seek on the
+(pharmacy, expiry_date) index. The per-band counts and value at risk come
+from one grouped query: each row is labelled with its band by a CASE over
+expiry_date and the database sums per label.
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db.models import Case, CharField, Count, DecimalField, F, Sum, Value, When
+from django.utils import timezone
+
+
+# Upper bounds (in days from today) of the reported expiry bands
+EXPIRY_BANDS = (30, 60, 90)
+DEFAULT_HORIZON_DAYS = 90
+MAX_HORIZON_DAYS = 365
+
+
+def request_today(request=None):
+    """The local date, computed once per request and reused for every row"""
+    if request is None:
+        return timezone.localdate()
+    today = getattr(request, '_inventory_today', None)
+    if today is None:
+        today = timezone.localdate()
+        request._inventory_today = today
+    return today
+
+
+def band_bounds(horizon_days):
+    """Band upper bounds up to and including the horizon, e.g. 120 -> [30, 60, 90, 120]"""
+    return [days for days in EXPIRY_BANDS if days < horizon_days] + [horizon_days]
+
+
+def expiring_within(queryset, today, horizon_days):
+    """Batches still in stock that expire between today and today + horizon_days"""
+    return queryset.filter(
+        expiry_date__gte=today,
+        expiry_date__lte=today + timedelta(days=horizon_days),
+        quantity__gt=0
+    )
+
+
+def expiry_bands(queryset, today, horizon_days):
+    """
+    Batch count, units and value at risk (quantity x unit_price) per band.
+
+    `queryset` should already be limited with expiring_within(). Every band is
+    returned, including empty ones, in ascending order.
+    """
+    bounds = band_bounds(horizon_days)
+    labels = []
+    whens = []
+    lower = 0
+    for upper in bounds:
+        label = f"{lower}-{upper}"
+        labels.append((label, lower, upper))
+        whens.append(When(expiry_date__lte=today + timedelta(days=upper), then=Value(label)))
+        lower = upper + 1
+
+    rows = queryset.annotate(
+        band=Case(*whens, output_field=CharField())
+    ).values('band').annotate(
+        batches=Count('id'),
+        units=Sum('quantity'),
+        value_at_risk=Sum(
+            F('quantity') * F('unit_price'),
+            output_field=DecimalField(max_digits=18, decimal_places=2)
+        )
+    ).order_by()
+    totals = {row['band']: row for row in rows}
+
+    bands = []
+    for label, lower, upper in labels:
+        row = totals.get(label, {})
+        bands.append({
+            'band': label,
+            'from_days': lower,
+            'to_days': upper,
+            'batches': row.get('batches', 0),
+            'units': row.get('units') or 0,
+            'value_at_risk': row.get('value_at_risk') or Decimal('0.00')
+        })
+    return bands
@@ -0,0 +1,355 @@
+"""
+Bulk stock intake (goods-received notes).
+
+import_rows() takes thousands of inventory lines at once. Validation runs
+in passes over all rows instead of one serializer per row:
+- each row's fields are parsed and checked against the price and date rules;
+- pharmacies, medicines and existing batches are each read with one IN
+  query per ID_BATCH_SIZE keys;
+- lines repeating a batch earlier in the same file are rejected.
+Every problem is reported against its row number.
+
+Valid rows are written with bulk_create: new batches start at zero, while
+existing batches get their prices and supplier updated. Where the backend
+supports it this is a single upsert (update_conflicts); elsewhere it is a
+bulk_create of the new rows plus a bulk_update of the existing ones. The
+received quantities are then added with inventory.stock.increment_stock,
+and matched by bulk-created IN movements, so the ledger still sums to the
+live quantity.
+
+Batches are sorted into new and existing before the write transaction, so
+another request may create one of the "new" batches in between. The insert
+then fails on the unique key; the whole write is rolled back and the rows
+are validated and written once more, now restocking that batch. Should that
+race again, the new batches are reported as row errors instead.
+"""
+import csv
+import io
+import json
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from fylinx2.response_cache import invalidate
+from pharmacies.models import Pharmacy
+
+from .ledger import ID_BATCH_SIZE, batched
+from .models import Inventory, Medicine, StockMovement
+from .stock import increment_stock
+
+
+IMPORT_FORMATS = ('csv', 'json')
+# Rows per bulk INSERT / UPDATE; the database backend lowers this further
+# where the rows' parameters would pass its limit (bulk_batch_size).
+# increment_stock chunks its CASE UPDATEs itself, by INCREMENT_BATCH_SIZE
+WRITE_BATCH_SIZE = 500
+# Fields an existing batch takes from the received line
+UPDATED_FIELDS = ['unit_price', 'selling_price', 'supplier', 'updated_at']
+DEFAULT_MINIMUM_STOCK_LEVEL = Inventory._meta.get_field('minimum_stock_level').default
+# Writes of an import whose new batches another request keeps creating
+WRITE_ATTEMPTS = 2
+
+
+class ImportResult:
+    """Outcome of an import: counts of created and restocked batches, and per-row errors"""
+
+    def __init__(self, errors, created=0, restocked=0):
+        self.errors = errors
+        self.created = created
+        self.restocked = restocked
+
+    @property
+    def imported(self):
+        return self.created + self.restocked
+
+    def as_dict(self):
+        return {
+            'imported': self.imported,
+            'created': self.created,
+            'restocked': self.restocked,
+            'errors': [
+                {'row': row, 'errors': errors} for row, errors in sorted(self.errors.items())
+            ]
+        }
+
+
+def read_rows(content, file_format):
+    """Rows (dicts) from CSV text with a header line, or a JSON list of objects"""
+    if file_format == 'json':
+        rows = json.loads(content)
+        if isinstance(rows, dict):
+            rows = rows.get('rows')
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            raise ValueError("JSON must be a list of objects or {\"rows\": [...]}")
+        return rows
+    return list(csv.DictReader(io.StringIO(content)))
+
+
+def _text(max_length, required=True):
+    def parse(value):
+        value = '' if value is None else str(value).strip()
+        if required and not value:
+            raise ValueError("This field is required.")
+        if len(value) > max_length:
+            raise ValueError(f"Ensure this field has no more than {max_length} characters.")
+        return value
+    return parse
+
+
+def _integer(minimum):
+    def parse(value):
+        try:
+            value = int(str(value).strip())
+        except (TypeError, ValueError):
+            raise ValueError("A valid integer is required.")
+        if value < minimum:
+            raise ValueError(f"Ensure this value is greater than or equal to {minimum}.")
+        return value
+    return parse
+
+
+def _money(value):
+    try:
+        value = Decimal(str(value).strip())
+    except (InvalidOperation, TypeError):
+        raise ValueError("A valid number is required.")
+    if not value.is_finite() or value < 0 or value >= Decimal('1e8'):
+        raise ValueError("Ensure this value is between 0 and 99999999.99.")
+    return value.quantize(Decimal('0.01'))
+
+
+def _date(value):
+    if isinstance(value, date):
+        return value
+    try:
+        parsed = parse_date(str(value).strip())
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValueError("Date has wrong format. Use YYYY-MM-DD.")
+    return parsed
+
+
+FIELDS = {
+    'pharmacy': _integer(1),
+    'medicine': _integer(1),
+    'batch_number': _text(100),
+    'quantity': _integer(1),
+    'unit_price': _money,
+    'selling_price': _money,
+    'expiry_date': _date,
+    'manufacture_date': _date,
+    'supplier': _text(255),
+}
+_minimum_stock_level = _integer(0)
+
+
+def _parse(row):
+    """(values, errors) for one input row"""
+    values, errors = {}, {}
+    for name, parse in FIELDS.items():
+        try:
+            values[name] = parse(row.get(name))
+        except ValueError as error:
+            errors[name] = [str(error)]
+    minimum = row.get('minimum_stock_level')
+    if minimum in (None, ''):
+        values['minimum_stock_level'] = DEFAULT_MINIMUM_STOCK_LEVEL
+    else:
+        try:
+            values['minimum_stock_level'] = _minimum_stock_level(minimum)
+        except ValueError as error:
+            errors['minimum_stock_level'] = [str(error)]
+    if errors:
+        return values, errors
+
+    rules = []
+    if values['expiry_date'] <= values['manufacture_date']:
+        rules.append("Expiry date must be after manufacture date")
+    if values['selling_price'] <= values['unit_price']:
+        rules.append("Selling price must be greater than unit price")
+    if rules:
+        errors['non_field_errors'] = rules
+    return values, errors
+
+
+def _existing_ids(model, ids):
+    found = set()
+    for batch in batched(sorted(ids), ID_BATCH_SIZE):
+        found.update(model.objects.filter(id__in=batch).values_list('id', flat=True))
+    return found
+
+
+def _existing_batches(keys):
+    """{(pharmacy, medicine, batch_number): (id, expiry_date)} for the keys that exist"""
+    batches = {}
+    by_pharmacy = {}
+    for pharmacy_id, medicine_id, batch_number in keys:
+        by_pharmacy.setdefault(pharmacy_id, set()).add(medicine_id)
+    for pharmacy_id, medicine_ids in by_pharmacy.items():
+        for batch in batched(sorted(medicine_ids), ID_BATCH_SIZE):
+            rows = Inventory.objects.filter(
+                pharmacy_id=pharmacy_id, medicine_id__in=batch
+            ).values_list('medicine_id', 'batch_number', 'id', 'expiry_date')
+            for medicine_id, batch_number, inventory_id, expiry_date in rows:
+                key = (pharmacy_id, medicine_id, batch_number)
+                if key in keys:
+                    batches[key] = (inventory_id, expiry_date)
+    return batches
+
+
+def validate_rows(rows, scope):
+    """
+    Parse and check every row. Returns ({row number: values} for valid rows,
+    {row number: errors}, {key: (id, expiry_date)} for batches that exist).
+    Row numbers start at 1.
+    """
+    valid, errors = {}, {}
+    for number, row in enumerate(rows, 1):
+        values, row_errors = _parse(row)
+        if row_errors:
+            errors[number] = row_errors
+        else:
+            valid[number] = values
+
+    def reject(number, field, message):
+        errors.setdefault(number, {}).setdefault(field, []).append(message)
+        valid.pop(number, None)
+
+    pharmacies = _existing_ids(Pharmacy, {values['pharmacy'] for values in valid.values()})
+    medicines = _existing_ids(Medicine, {values['medicine'] for values in valid.values()})
+    first_rows = {}
+    for number, values in list(valid.items()):
+        if values['pharmacy'] not in pharmacies or not scope.allows(values['pharmacy']):
+            reject(number, 'pharmacy', "Invalid pharmacy or access denied")
+        if values['medicine'] not in medicines:
+            reject(number, 'medicine', "Invalid medicine")
+        key = (values['pharmacy'], values['medicine'], values['batch_number'])
+        if key in first_rows:
+            reject(number, 'batch_number', f"Duplicate of row {first_rows[key]}")
+        else:
+            first_rows[key] = number
+
+    existing = _existing_batches({
+        (values['pharmacy'], values['medicine'], values['batch_number'])
+        for values in valid.values()
+    })
+    for number, values in list(valid.items()):
+        match = existing.get((values['pharmacy'], values['medicine'], values['batch_number']))
+        if match and match[1] != values['expiry_date']:
+            reject(
+                number, 'expiry_date',
+                f"Batch already exists with expiry date {match[1].isoformat()}"
+            )
+    return valid, errors, existing
+
+
+def _key(values):
+    return (values['pharmacy'], values['medicine'], values['batch_number'])
+
+
+def _upsert(lines, existing, user):
+    """Write the batches for `lines` at zero quantity; returns {key: inventory id}"""
+    inventories = [
+        Inventory(
+            pharmacy_id=values['pharmacy'],
+            medicine_id=values['medicine'],
+            batch_number=values['batch_number'],
+            quantity=0,
+            unit_price=values['unit_price'],
+            selling_price=values['selling_price'],
+            expiry_date=values['expiry_date'],
+            manufacture_date=values['manufacture_date'],
+            supplier=values['supplier'],
+            minimum_stock_level=values['minimum_stock_level'],
+            # bulk_create skips Inventory.save(), which normally sets this
+            stock_deficit=values['minimum_stock_level'],
+            created_by=user
+        )
+        for values in lines
+    ]
+    unique_fields = ['pharmacy', 'medicine', 'batch_number']
+    if connection.features.supports_update_conflicts_with_target:
+        Inventory.objects.bulk_create(
+            inventories, batch_size=WRITE_BATCH_SIZE,
+            update_conflicts=True, unique_fields=unique_fields, update_fields=UPDATED_FIELDS
+        )
+    else:
+        new, found = [], []
+        now = timezone.now()
+        for inventory in inventories:
+            key = (inventory.pharmacy_id, inventory.medicine_id, inventory.batch_number)
+            if key in existing:
+                inventory.pk = existing[key][0]
+                # bulk_update does not fill in auto_now fields
+                inventory.updated_at = now
+                found.append(inventory)
+            else:
+                new.append(inventory)
+        Inventory.objects.bulk_create(new, batch_size=WRITE_BATCH_SIZE)
+        Inventory.objects.bulk_update(found, UPDATED_FIELDS, batch_size=WRITE_BATCH_SIZE)
+
+    # Ids of new rows are not returned by every backend; read them all back
+    keys = {_key(values) for values in lines}
+    return {key: inventory_id for key, (inventory_id, _) in _existing_batches(keys).items()}
+
+
+def _write(lines, existing, user, reference_number):
+    with transaction.atomic():
+        ids = _upsert(lines, existing, user)
+        quantities = [(ids[_key(values)], values['quantity']) for values in lines]
+        increment_stock(quantities)
+        StockMovement.objects.bulk_create([
+            StockMovement(
+                inventory_id=inventory_id,
+                movement_type='IN',
+                quantity=quantity,
+                reference_number=reference_number,
+                notes="Goods received",
+                created_by=user
+            )
+            for inventory_id, quantity in quantities
+        ], batch_size=WRITE_BATCH_SIZE)
+        # Neither the bulk writes nor the F() updates send post_save
+        invalidate('inventory')
+
+
+def import_rows(rows, user, scope, reference_number='', partial=False):
+    """
+    Validate and import inventory lines; returns an ImportResult.
+
+    With partial=False nothing is written unless every row is valid.
+    With partial=True the valid rows are imported and the rest reported.
+    """
+    for attempt in range(WRITE_ATTEMPTS):
+        valid, errors, existing = validate_rows(rows, scope)
+        if not valid or (errors and not partial):
+            return ImportResult(errors)
+
+        lines = list(valid.values())
+        try:
+            _write(lines, existing, user, reference_number)
+        except IntegrityError:
+            # Retried only if a batch was created since validation; see the
+            # module docstring
+            if not _existing_batches({_key(values) for values in lines} - existing.keys()):
+                raise
+            continue
+        restocked = sum(1 for values in lines if _key(values) in existing)
+        return ImportResult(errors, created=len(lines) - restocked, restocked=restocked)
+
+    # Still racing: report the new batches and restock only the existing ones
+    for number, values in list(valid.items()):
+        if _key(values) not in existing:
+            errors.setdefault(number, {}).setdefault('batch_number', []).append(
+                "Batch was created by another request during the import; import it again"
+            )
+            del valid[number]
+    if not valid or not partial:
+        return ImportResult(errors)
+    lines = list(valid.values())
+    _write(lines, existing, user, reference_number)
+    return ImportResult(errors, restocked=len(lines))
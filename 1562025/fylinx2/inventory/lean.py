@@ -0,0 +1,65 @@
+"""
+values()-based mirrors of the inventory read serializers, for list pages.
+
+Each mapper produces exactly what the serializer of the same name in
+inventory.serializers produces; keep the two in step when fields change.
+"""
+from fylinx2.lean import Computed, DateTimeField, Field, ValuesMapper, as_date, as_decimal
+from .expiry import request_today
+
+
+money = as_decimal(10, 2)
+
+
+# Mirrors InventorySerializer
+inventory_mapper = ValuesMapper({
+    'id': Field('id'),
+    'pharmacy': Field('pharmacy_id'),
+    'pharmacy_name': Field('pharmacy__name'),
+    'medicine': ValuesMapper({  # MedicineSerializer
+        'id': Field('medicine__id'),
+        'name': Field('medicine__name'),
+        'generic_name': Field('medicine__generic_name'),
+        'manufacturer': Field('medicine__manufacturer'),
+        'description': Field('medicine__description'),
+        'dosage_form': Field('medicine__dosage_form'),
+        'strength': Field('medicine__strength'),
+        'created_at': DateTimeField('medicine__created_at'),
+        'updated_at': DateTimeField('medicine__updated_at'),
+    }),
+    'batch_number': Field('batch_number'),
+    'quantity': Field('quantity'),
+    'unit_price': Field('unit_price', money),
+    'selling_price': Field('selling_price', money),
+    'expiry_date': Field('expiry_date', as_date),
+    'manufacture_date': Field('manufacture_date', as_date),
+    'supplier': Field('supplier'),
+    'minimum_stock_level': Field('minimum_stock_level'),
+    'is_low_stock': Computed(
+        lambda row, context: row['quantity'] <= row['minimum_stock_level'],
+        'quantity', 'minimum_stock_level'
+    ),
+    'is_expired': Computed(
+        lambda row, context: row['expiry_date'] < request_today(context and context.get('request')),
+        'expiry_date'
+    ),
+    'created_at': DateTimeField('created_at'),
+    'updated_at': DateTimeField('updated_at'),
+})
+
+# Mirrors StockMovementSerializer
+stock_movement_mapper = ValuesMapper({
+    'id': Field('id'),
+    'inventory': Field('inventory_id'),
+    'inventory_info': ValuesMapper({
+        'medicine_name': Field('inventory__medicine__name'),
+        'batch_number': Field('inventory__batch_number'),
+        'pharmacy_name': Field('inventory__pharmacy__name'),
+    }),
+    'movement_type': Field('movement_type'),
+    'quantity': Field('quantity'),
+    'reference_number': Field('reference_number'),
+    'notes': Field('notes'),
+    'created_by_name': Field('created_by__username'),
+    'created_at': DateTimeField('created_at'),
+})
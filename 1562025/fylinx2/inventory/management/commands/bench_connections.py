@@ -0,0 +1,102 @@
+import time
+
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test.client import RequestFactory
+
+from accounts.models import CustomUser
+from fylinx2.db import connect_checkout_metrics, connection_stats, reset_connection_stats
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare per-request latency with a new database connection per request "
+        "(CONN_MAX_AGE=0) against persistent connections"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--path', default='/api/v1/inventory/low-stock/')
+        parser.add_argument('--max-age', type=int, default=60, help="CONN_MAX_AGE of the persistent run")
+        parser.add_argument(
+            '--simulated-connect-ms', type=float, default=0.0,
+            help=(
+                "Sleep this long whenever a connection is opened, to stand in for the "
+                "TLS handshake and login of a remote SQL Server"
+            )
+        )
+
+    def handle(self, *args, **options):
+        self.delay = options['simulated_connect_ms'] / 1000
+        if self.delay:
+            connection_created.connect(self._simulate_connect, dispatch_uid='bench-connections')
+        connect_checkout_metrics()
+
+        # The requests run through the full WSGI handler, which closes
+        # connections at the end of each request just as a worker does, so
+        # nothing here can run inside a transaction: the fixtures are
+        # committed and removed at the end
+        user = CustomUser.objects.create_user(username='bench-connections', role='ADMIN')
+        session = SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.create()
+
+        settings_dict = connections['default'].settings_dict
+        original_max_age = settings_dict['CONN_MAX_AGE']
+        try:
+            if self.delay:
+                self.stdout.write(f"Connect cost simulated: {options['simulated_connect_ms']:.1f} ms")
+            self.stdout.write(
+                f"{'CONN_MAX_AGE':>12} {'requests':>9} {'avg ms':>8} {'p99 ms':>8} "
+                f"{'opened':>7} {'reuse':>6} {'wait ms':>8}"
+            )
+            results = {}
+            for max_age in (0, options['max_age']):
+                settings_dict['CONN_MAX_AGE'] = max_age
+                connections['default'].close()
+                results[max_age] = self._run(options['path'], options['requests'], session.session_key)
+            saving = results[0] - results[options['max_age']]
+            self.stdout.write(f"Saving per request: {saving:.3f} ms")
+        finally:
+            settings_dict['CONN_MAX_AGE'] = original_max_age
+            connection_created.disconnect(dispatch_uid='bench-connections')
+            session.delete()
+            user.delete()
+
+    def _simulate_connect(self, sender, connection, **kwargs):
+        time.sleep(self.delay)
+
+    def _run(self, path, requests, session_key):
+        handler = WSGIHandler()
+        environ = RequestFactory().get(
+            path, SERVER_NAME='localhost', HTTP_COOKIE=f"sessionid={session_key}"
+        ).environ
+
+        def start_response(status, headers):
+            if not status.startswith('200'):
+                raise RuntimeError(f"{path} returned {status}")
+
+        reset_connection_stats()
+        timings = []
+        for _ in range(requests):
+            started = time.perf_counter()
+            response = handler(dict(environ), start_response)
+            response.close()
+            timings.append((time.perf_counter() - started) * 1000)
+
+        stats = connection_stats()
+        timings.sort()
+        average = sum(timings) / len(timings)
+        p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+        self.stdout.write(
+            f"{connections['default'].settings_dict['CONN_MAX_AGE']:>12} {requests:>9} {average:>8.3f} {p99:>8.3f} "
+            f"{stats['opened']:>7} {stats['reuse_rate']:>6} {stats['mean_wait_ms']:>8.3f}"
+        )
+        return average
+
@@ -0,0 +1,81 @@
+import random
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.test.utils import CaptureQueriesContext
+
+from accounts.models import CustomUser
+from inventory.intake import import_rows
+from inventory.models import Inventory, Medicine, StockMovement
+from pharmacies.models import Pharmacy
+from pharmacies.scope import PharmacyScope
+
+
+class Command(BaseCommand):
+    help = "Measure bulk inventory import throughput (lines per second) for new and existing batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000)
+        parser.add_argument('--medicines', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+
+        # Everything runs in one transaction that is rolled back at the end
+        with transaction.atomic():
+            user, pharmacy, medicine_ids = self._fixtures(options['medicines'])
+            today = date.today()
+            rows = [
+                {
+                    'pharmacy': pharmacy.id,
+                    'medicine': rng.choice(medicine_ids),
+                    'batch_number': f"GRN-{number}",
+                    'quantity': str(rng.randint(1, 500)),
+                    'unit_price': '4.50',
+                    'selling_price': '6.00',
+                    'expiry_date': (today + timedelta(days=rng.randint(30, 900))).isoformat(),
+                    'manufacture_date': (today - timedelta(days=rng.randint(1, 300))).isoformat(),
+                    'supplier': 'Bench Supplier',
+                }
+                for number in range(options['rows'])
+            ]
+
+            self.stdout.write(f"{'run':<12} {'lines':>7} {'seconds':>8} {'lines/s':>9} {'queries':>8}")
+            # The second run receives the same batches again, exercising the upsert
+            for name in ('new', 'restock'):
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    result = import_rows(rows, user, PharmacyScope(), reference_number=f"BENCH-{name}")
+                    seconds = time.perf_counter() - started
+                if result.errors or result.imported != len(rows):
+                    raise CommandError(f"{name}: {len(result.errors)} rows rejected")
+                self.stdout.write(
+                    f"{name:<12} {len(rows):>7} {seconds:>8.2f} {len(rows) / seconds:>9.0f} "
+                    f"{len(queries.captured_queries):>8}"
+                )
+
+            on_hand = Inventory.objects.filter(pharmacy=pharmacy).aggregate(total=Sum('quantity'))['total']
+            ledger = StockMovement.objects.filter(
+                inventory__pharmacy=pharmacy
+            ).aggregate(total=Sum('quantity'))['total']
+            expected = 2 * sum(int(row['quantity']) for row in rows)
+            if not on_hand == ledger == expected:
+                raise CommandError(f"on hand {on_hand}, ledger {ledger}, expected {expected}")
+            transaction.set_rollback(True)
+
+    def _fixtures(self, medicines):
+        user = CustomUser.objects.create_user(username='bench-import', role='ADMIN')
+        pharmacy = Pharmacy.objects.create(name='Bench Import', location='-', created_by=user)
+        Medicine.objects.bulk_create([
+            Medicine(
+                name=f"Bench Import {number}", manufacturer='Bench',
+                dosage_form='Tablet', strength='10mg'
+            )
+            for number in range(medicines)
+        ])
+        medicine_ids = list(Medicine.objects.filter(manufacturer='Bench').values_list('id', flat=True))
+        return user, pharmacy, medicine_ids
@@ -0,0 +1,88 @@
+import random
+import string
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from inventory.models import Medicine
+from inventory.search import MedicineIndex
+
+
+SYLLABLES = ['pa', 'ra', 'ce', 'ta', 'mol', 'ami', 'xi', 'cil', 'lin', 'ome', 'pra', 'zole',
+             'met', 'for', 'min', 'ator', 'va', 'sta', 'tin', 'lo', 'sar', 'tan', 'ibu', 'pro', 'fen']
+FORMS = ['Tablet', 'Capsule', 'Syrup', 'Injection', 'Cream']
+STRENGTHS = ['5mg', '10mg', '20mg', '250mg', '500mg', '1g', '5ml', '100ml']
+
+
+def _word(rng, syllables=3):
+    return ''.join(rng.choice(SYLLABLES) for _ in range(syllables)).capitalize()
+
+
+def _typo(rng, word):
+    i = rng.randrange(1, len(word) - 1)
+    return word[:i] + rng.choice(string.ascii_lowercase) + word[i + 1:]
+
+
+class Command(BaseCommand):
+    help = "Measure medicine search latency per keystroke over a synthetic catalog"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--skus', type=int, default=200000)
+        parser.add_argument('--queries', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+
+        # Everything runs in one transaction that is rolled back at the end
+        with transaction.atomic():
+            names = self._fixtures(rng, options['skus'])
+
+            index = MedicineIndex()
+            started = time.perf_counter()
+            index.sync()
+            self.stdout.write(
+                f"built index of {len(index)} medicines in {time.perf_counter() - started:.1f}s"
+            )
+
+            # Keystroke sequences: growing prefixes of real names, some with a typo
+            queries = []
+            while len(queries) < options['queries']:
+                name = rng.choice(names).casefold()
+                if rng.random() < 0.3:
+                    name = _typo(rng, name)
+                queries.extend(name[:length] for length in range(2, len(name) + 1))
+
+            timings = []
+            with CaptureQueriesContext(connection) as queries_run:
+                for query in queries:
+                    started = time.perf_counter()
+                    index.search(query)
+                    timings.append((time.perf_counter() - started) * 1000)
+            if queries_run.captured_queries:
+                raise CommandError(f"search ran {len(queries_run.captured_queries)} queries")
+
+            timings.sort()
+            self.stdout.write(
+                f"{len(timings)} searches  p50 {timings[len(timings) // 2]:.2f} ms  "
+                f"p99 {timings[int(len(timings) * 0.99)]:.2f} ms  max {timings[-1]:.2f} ms"
+            )
+            transaction.set_rollback(True)
+
+    def _fixtures(self, rng, skus):
+        manufacturers = [f"{_word(rng, 2)} Pharma" for _ in range(200)]
+        medicines, seen = [], set()
+        while len(medicines) < skus:
+            name = _word(rng, rng.choice([2, 3, 4]))
+            key = (name, rng.choice(manufacturers), rng.choice(STRENGTHS))
+            if key in seen:
+                continue
+            seen.add(key)
+            medicines.append(Medicine(
+                name=key[0], generic_name=_word(rng, 3), manufacturer=key[1],
+                dosage_form=rng.choice(FORMS), strength=key[2]
+            ))
+        Medicine.objects.bulk_create(medicines, batch_size=5000)
+        return [medicine.name for medicine in medicines]
@@ -0,0 +1,46 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.models import CustomUser
+from inventory.intake import IMPORT_FORMATS, import_rows, read_rows
+from pharmacies.scope import resolve_scope
+
+
+class Command(BaseCommand):
+    help = "Import inventory lines (a goods-received note) from a CSV or JSON file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--user', required=True, help="Username recorded as creator; their pharmacy scope applies")
+        parser.add_argument('--file-format', choices=IMPORT_FORMATS, help="Defaults to the file extension")
+        parser.add_argument('--reference-number', default='', help="Reference stored on the IN movements")
+        parser.add_argument('--partial', action='store_true', help="Import the valid rows even if some are invalid")
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        file_format = options['file_format'] or path.suffix.lstrip('.').lower()
+        if file_format not in IMPORT_FORMATS:
+            raise CommandError(f"Unsupported file format {file_format!r}; use --file-format")
+        try:
+            user = CustomUser.objects.get(username=options['user'])
+        except CustomUser.DoesNotExist:
+            raise CommandError(f"No user {options['user']!r}")
+        try:
+            rows = read_rows(path.read_text(encoding='utf-8-sig'), file_format)
+        except (OSError, ValueError) as error:
+            raise CommandError(f"Could not read {path}: {error}")
+
+        result = import_rows(
+            rows, user, resolve_scope(user),
+            reference_number=options['reference_number'], partial=options['partial']
+        )
+        for row, errors in sorted(result.errors.items()):
+            for field, messages in errors.items():
+                self.stderr.write(f"row {row}: {field}: {' '.join(messages)}")
+        if not result.imported:
+            raise CommandError(f"No rows imported ({len(result.errors)} invalid)")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {result.imported} lines ({result.created} new batches, "
+            f"{result.restocked} restocked); {len(result.errors)} invalid"
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from inventory.models import Inventory
+
+
+class Command(BaseCommand):
+    help = "Recompute Inventory.stock_deficit for rows written before it existed or via bulk_create"
+
+    def handle(self, *args, **options):
+        stale = Inventory.objects.exclude(
+            stock_deficit=F('minimum_stock_level') - F('quantity')
+        ).update(stock_deficit=F('minimum_stock_level') - F('quantity'))
+        self.stdout.write(self.style.SUCCESS(f"Refreshed stock deficit on {stale} inventory rows"))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from inventory.ledger import take_snapshots
+
+
+class Command(BaseCommand):
+    help = "Write StockSnapshot checkpoints for batches with stock movements since the previous run"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=100000, help="Movement ids per grouped query")
+        parser.add_argument(
+            '--settle-seconds', type=int, default=300,
+            help="Leave movements younger than this for the next run"
+        )
+
+    def handle(self, *args, **options):
+        written = take_snapshots(options['chunk_size'], options['settle_seconds'])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} stock snapshots"))
@@ -0,0 +1,148 @@
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from accounts.models import CustomUser
+from inventory.allocation import allocate_fefo
+from inventory.models import Inventory, Medicine, StockMovement
+from inventory.stock import StockShortfall, apply_movement, decrement_stock
+from pharmacies.models import Pharmacy
+
+
+class Command(BaseCommand):
+    help = "Hammer the stock mutation service from many threads and check quantities against the ledger"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=32)
+        parser.add_argument('--operations', type=int, default=200, help="Operations per thread")
+        parser.add_argument('--batches', type=int, default=5, help="Inventory rows to contend on")
+        parser.add_argument('--initial-quantity', type=int, default=500)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        user, pharmacy, inventory_ids = self._fixtures(options['batches'], options['initial_quantity'])
+        medicine_ids = dict(Inventory.objects.filter(id__in=inventory_ids).values_list('id', 'medicine_id'))
+        outcomes = Counter()
+        outcomes_lock = threading.Lock()
+
+        def worker(worker_number):
+            rng = random.Random(options['seed'] + worker_number)
+            local = Counter()
+            try:
+                for _ in range(options['operations']):
+                    local[self._random_operation(rng, user, pharmacy, medicine_ids)] += 1
+            finally:
+                connection.close()
+                with outcomes_lock:
+                    outcomes.update(local)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['threads']) as pool:
+            list(pool.map(worker, range(options['threads'])))
+        elapsed = time.perf_counter() - started
+
+        ledger = dict(
+            StockMovement.objects.filter(inventory_id__in=inventory_ids)
+            .values('inventory_id').annotate(total=Sum('quantity'))
+            .values_list('inventory_id', 'total')
+        )
+        mismatches = [
+            (inventory_id, quantity, ledger.get(inventory_id, 0))
+            for inventory_id, quantity in Inventory.objects.filter(id__in=inventory_ids).values_list('id', 'quantity')
+            if quantity != ledger.get(inventory_id, 0)
+        ]
+
+        total = sum(outcomes.values())
+        self.stdout.write(f"operations: {total} in {elapsed:.2f}s ({total / elapsed:.0f}/s)")
+        for outcome, count in sorted(outcomes.items()):
+            self.stdout.write(f"  {outcome}: {count}")
+
+        pharmacy.delete()
+        Medicine.objects.filter(manufacturer='Stress test').delete()
+        user.delete()
+
+        if mismatches:
+            for inventory_id, quantity, ledger_total in mismatches:
+                self.stderr.write(f"inventory {inventory_id}: quantity {quantity}, ledger {ledger_total}")
+            raise CommandError(f"{len(mismatches)} inventory rows disagree with the ledger")
+        self.stdout.write(self.style.SUCCESS("All quantities match the StockMovement ledger"))
+
+    def _random_operation(self, rng, user, pharmacy, medicine_ids):
+        inventory_ids = list(medicine_ids)
+        roll = rng.random()
+        try:
+            if roll < 0.4:
+                # A checkout taking a few batches at once
+                self._checkout(user, [
+                    (rng.choice(inventory_ids), rng.randint(1, 5)) for _ in range(rng.randint(1, 3))
+                ])
+                return 'sale'
+            if roll < 0.6 and len(inventory_ids) > 1:
+                # A checkout naming one batch and one medicine, as a till
+                # scanning a box and picking another from the shelf does;
+                # it locks the FEFO candidates before taking stock
+                explicit, other = rng.sample(inventory_ids, 2)
+                with transaction.atomic():
+                    allocated = allocate_fefo(
+                        pharmacy.id, [{'medicine': medicine_ids[other], 'quantity': rng.randint(1, 5)}],
+                        timezone.now().date(), lock_ids={explicit}
+                    )
+                    self._checkout(user, [(explicit, rng.randint(1, 5))] + [
+                        (line['inventory'].id, line['quantity']) for line in allocated
+                    ])
+                return 'sale (fefo)'
+            if roll < 0.85:
+                apply_movement(rng.choice(inventory_ids), 'IN', rng.randint(1, 10), user, 'STRESS')
+                return 'in'
+            if roll < 0.95:
+                apply_movement(rng.choice(inventory_ids), 'DAMAGED', rng.randint(1, 3), user, 'STRESS')
+                return 'damaged'
+            apply_movement(rng.choice(inventory_ids), 'ADJUSTMENT', rng.randint(0, 500), user, 'STRESS')
+            return 'adjustment'
+        except StockShortfall:
+            return 'refused (shortfall)'
+        except DatabaseError:
+            # Lock timeouts / deadlock victims roll back cleanly; the ledger
+            # check below still has to hold
+            return 'aborted (database error)'
+
+    def _checkout(self, user, lines):
+        with transaction.atomic():
+            decrement_stock(lines)
+            StockMovement.objects.bulk_create([
+                StockMovement(
+                    inventory_id=inventory_id, movement_type='OUT', quantity=-quantity,
+                    reference_number='STRESS', created_by=user
+                )
+                for inventory_id, quantity in lines
+            ])
+
+    def _fixtures(self, batches, initial_quantity):
+        user = CustomUser.objects.create_user(username=f"stress-{int(time.time())}", role='ADMIN')
+        pharmacy = Pharmacy.objects.create(name='Stress test pharmacy', location='Stress', created_by=user)
+        today = timezone.now().date()
+        inventory_ids = []
+        for n in range(batches):
+            medicine = Medicine.objects.create(
+                name=f"Stress medicine {n}", manufacturer='Stress test', dosage_form='tablet', strength='1mg'
+            )
+            inventory = Inventory.objects.create(
+                pharmacy=pharmacy, medicine=medicine, batch_number=f"STRESS-{n}",
+                quantity=initial_quantity, unit_price='1.00', selling_price='2.00',
+                expiry_date=today + timedelta(days=365), manufacture_date=today - timedelta(days=30),
+                supplier='Stress', created_by=user
+            )
+            StockMovement.objects.create(
+                inventory=inventory, movement_type='IN', quantity=initial_quantity,
+                reference_number=f"INITIAL-{inventory.id}", notes="Initial stock entry", created_by=user
+            )
+            inventory_ids.append(inventory.id)
+        return user, pharmacy, inventory_ids
@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import F
 from django.conf import settings
 from pharmacies.models import Pharmacy
 
@@ -16,6 +17,10 @@ class Medicine(models.Model):
     
     class Meta:
         unique_together = ['name', 'manufacturer', 'strength']
+        indexes = [
+            # The search index re-reads only rows changed since its last sync
+            models.Index(fields=['updated_at'], name='medicine_updated_idx'),
+        ]
     
     def __str__(self):
         return f"{self.name} ({self.strength}) - {self.manufacturer}"
@@ -33,16 +38,89 @@ class Inventory(models.Model):
     manufacture_date = models.DateField()
     supplier = models.CharField(max_length=255)
     minimum_stock_level = models.PositiveIntegerField(default=10)
+    # minimum_stock_level - quantity, kept in step by save() and inventory.stock;
+    # >= 0 means low on stock
+    stock_deficit = models.IntegerField(default=0, editable=False)
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         unique_together = ['pharmacy', 'medicine', 'batch_number']
+        indexes = [
+            # Filtered index: low stock alerts seek only the rows at or
+            # below their minimum, already in deficit order
+            models.Index(
+                fields=['pharmacy', '-stock_deficit', 'id'],
+                condition=models.Q(stock_deficit__gte=0),
+                name='inventory_low_stock_idx'
+            ),
+            # Expiry horizon queries seek a date range within a pharmacy
+            models.Index(fields=['pharmacy', 'expiry_date'], name='inventory_expiry_idx'),
+            # FEFO allocation reads a medicine's batches in expiry order
+            models.Index(fields=['pharmacy', 'medicine', 'expiry_date'], name='inventory_fefo_idx'),
+        ]
     
     def __str__(self):
         return f"{self.medicine.name} - {self.pharmacy.name} (Batch: {self.batch_number})"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_stock_deficit = instance.__dict__.get('stock_deficit')
+        instance._loaded_minimum_stock_level = instance.__dict__.get('minimum_stock_level')
+        return instance
+    
+    def save(self, *args, **kwargs):
+        from .signals import send_low_stock_transition
+        
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'quantity' not in update_fields:
+            self._save_without_quantity(*args, **kwargs)
+            return
+        
+        self.stock_deficit = self.minimum_stock_level - self.quantity
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {'stock_deficit'}
+        previous = getattr(self, '_loaded_stock_deficit', None)
+        super().save(*args, **kwargs)
+        
+        was_low = previous is not None and previous >= 0
+        if self.is_low_stock != was_low:
+            if self.is_low_stock:
+                send_low_stock_transition(entered=[self.pk])
+            elif previous is not None:
+                send_low_stock_transition(cleared=[self.pk])
+        self._loaded_stock_deficit = self.stock_deficit
+        self._loaded_minimum_stock_level = self.minimum_stock_level
+    
+    def _save_without_quantity(self, *args, **kwargs):
+        # This instance's quantity may be stale: a sale may have committed
+        # since it was read. Leave the stored quantity alone and derive the
+        # deficit from it in SQL, then read both back
+        from .signals import send_low_stock_transition
+        
+        if 'minimum_stock_level' not in kwargs['update_fields']:
+            super().save(*args, **kwargs)
+            return
+        
+        kwargs['update_fields'] = set(kwargs['update_fields']) | {'stock_deficit'}
+        # The new minimum as a value: SET expressions see the old column
+        self.stock_deficit = self.minimum_stock_level - F('quantity')
+        super().save(*args, **kwargs)
+        self.refresh_from_db(fields=['quantity', 'stock_deficit'])
+        
+        # Only the change of minimum can cross it here; stock changes announce their own
+        previous_minimum = getattr(self, '_loaded_minimum_stock_level', None)
+        if previous_minimum is not None and (self.quantity <= previous_minimum) != self.is_low_stock:
+            if self.is_low_stock:
+                send_low_stock_transition(entered=[self.pk])
+            else:
+                send_low_stock_transition(cleared=[self.pk])
+        self._loaded_stock_deficit = self.stock_deficit
+        self._loaded_minimum_stock_level = self.minimum_stock_level
+    
     @property
     def is_low_stock(self):
         return self.quantity <= self.minimum_stock_level
@@ -71,5 +149,37 @@ class StockMovement(models.Model):
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    class Meta:
+        indexes = [
+            # Ledger sums after a snapshot seek (inventory, id > checkpoint)
+            models.Index(fields=['inventory', 'id'], name='stockmovement_ledger_idx'),
+            # Keyset pages on (created_at, id), overall and per batch
+            models.Index(fields=['created_at', 'id'], name='stockmovement_recent_idx'),
+            models.Index(fields=['inventory', 'created_at', 'id'], name='stockmovement_batch_recent_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.movement_type} - {self.inventory.medicine.name} ({self.quantity})"
+
+
+class StockSnapshot(models.Model):
+    """
+    Checkpoint of an inventory row's ledger: `quantity` is the sum of its
+    StockMovements with id <= `last_movement_id`, and `taken_at` is the
+    latest created_at among them. Written by manage.py snapshot_stock.
+    """
+    inventory = models.ForeignKey(Inventory, on_delete=models.CASCADE, related_name='snapshots')
+    quantity = models.IntegerField()
+    last_movement_id = models.PositiveBigIntegerField()
+    taken_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        unique_together = ['inventory', 'last_movement_id']
+        indexes = [
+            models.Index(fields=['inventory', 'taken_at'], name='stocksnapshot_taken_idx'),
+            models.Index(fields=['last_movement_id'], name='stocksnapshot_checkpoint_idx'),
+        ]
+    
     def __str__(self):
-        return f"{self.movement_type} - {self.inventory.medicine.name} ({self.quantity})"
\ No newline at end of file
+        return f"{self.inventory_id} @ {self.last_movement_id}: {self.quantity}"
@@ -0,0 +1,299 @@
+"""
+In-process medicine catalog search.
+
+MedicineIndex keeps an inverted index of the tokens in each medicine's
+name, generic name, manufacturer and strength, a sorted token list for
+prefix lookups, and a trigram index over the tokens for typo-tolerant
+matching. A search never reads the Medicine table.
+
+Every query token must match some field, exactly, as a prefix or, if it
+prefixes no indexed token, within a small edit distance of a prefix. A
+match scores its kind (exact > prefix > fuzzy) times the field's weight
+(name > generic name > strength > manufacturer).
+
+The index is built from one values_list() pass on first use. Saves and
+deletes in this process update it through signals. Other processes'
+changes are noticed through the 'medicines' response cache version, and
+only the rows whose updated_at moved are re-read.
+"""
+import bisect
+import heapq
+import re
+import threading
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from fylinx2.response_cache import namespace_versions
+
+from .models import Medicine
+
+
+# Indexed fields and their weights; documents are tuples in DOCUMENT_FIELDS order
+DOCUMENT_FIELDS = ('name', 'generic_name', 'manufacturer', 'dosage_form', 'strength')
+FIELD_WEIGHTS = {
+    'name': 8,
+    'generic_name': 6,
+    'strength': 3,
+    'manufacturer': 2,
+}
+_weighted_positions = [
+    (DOCUMENT_FIELDS.index(field), weight) for field, weight in FIELD_WEIGHTS.items()
+]
+
+# Match kinds; a fuzzy match scores one less per edit beyond the first
+EXACT, PREFIX, FUZZY = 6, 4, 2
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+# Index tokens a single query token may expand to as a prefix
+MAX_PREFIX_EXPANSIONS = 256
+# Query tokens shorter than this are never matched fuzzily
+MIN_FUZZY_LENGTH = 4
+# Typo matching compares the query with token prefixes, so only trigrams
+# this close to the start of a token are indexed
+TRIGRAM_SPAN = 24
+# Candidates (most shared trigrams first) checked by edit distance per query token
+MAX_FUZZY_CANDIDATES = 64
+# updated_at comes from each app server's clock; re-read a little further
+# back than the last sync to tolerate skew between servers
+SYNC_OVERLAP = timedelta(seconds=30)
+
+_words = re.compile(r'\w+')
+# "500mg" is also indexed as "500" and "mg"
+_parts = re.compile(r'\d+(?:[.,]\d+)?|[^\W\d_]+')
+
+
+def tokenize(text):
+    tokens = []
+    for word in _words.findall(text.casefold()):
+        tokens.append(word)
+        parts = _parts.findall(word)
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return list(dict.fromkeys(tokens))
+
+
+def _trigrams(token):
+    """(position, trigram) pairs of the token's leading TRIGRAM_SPAN characters"""
+    padded = f"  {token[:TRIGRAM_SPAN]}"
+    return [(i, padded[i:i + 3]) for i in range(len(padded) - 2)]
+
+
+def _max_edits(token):
+    if len(token) < MIN_FUZZY_LENGTH:
+        return 0
+    return 1 if len(token) < 8 else 2
+
+
+def prefix_distance(query, token, max_edits):
+    """
+    Edit distance between `query` and the closest prefix of `token`, or
+    max_edits + 1 once it is certain to exceed `max_edits`. Only the band
+    of cells within `max_edits` of the diagonal is computed.
+    """
+    token = token[:len(query) + max_edits]
+    over = max_edits + 1
+    previous = [j if j <= max_edits else over for j in range(len(token) + 1)]
+    for i, char in enumerate(query, 1):
+        current = [i if i <= max_edits else over] + [over] * len(token)
+        for j in range(max(1, i - max_edits), min(len(token), i + max_edits) + 1):
+            current[j] = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char != token[j - 1]),
+                over
+            )
+        if min(current) > max_edits:
+            return over
+        previous = current
+    return min(previous)
+
+
+class MedicineIndex:
+    """Token, prefix and trigram index over the medicine catalog"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self._loaded = False
+        self._version = None
+        self._synced_at = None
+        self.documents = {}
+        # token -> {medicine_id: best field weight}
+        self._postings = defaultdict(dict)
+        self._tokens = []
+        # (position, trigram) -> tokens with that trigram at that position
+        self._trigram_tokens = defaultdict(set)
+        # medicine_id -> {token: field weight}, to unindex on update
+        self._document_tokens = {}
+
+    def __len__(self):
+        return len(self.documents)
+
+    # Maintenance
+
+    def _add(self, medicine_id, document):
+        self._remove(medicine_id)
+        self.documents[medicine_id] = document
+        weights = {}
+        for position, weight in _weighted_positions:
+            for token in tokenize(document[position] or ''):
+                if weights.get(token, 0) < weight:
+                    weights[token] = weight
+        self._document_tokens[medicine_id] = weights
+        for token, weight in weights.items():
+            postings = self._postings[token]
+            if not postings:
+                bisect.insort(self._tokens, token)
+                for trigram in _trigrams(token):
+                    self._trigram_tokens[trigram].add(token)
+            postings[medicine_id] = weight
+
+    def _remove(self, medicine_id):
+        self.documents.pop(medicine_id, None)
+        for token in self._document_tokens.pop(medicine_id, ()):
+            postings = self._postings[token]
+            postings.pop(medicine_id, None)
+            if not postings:
+                del self._postings[token]
+                del self._tokens[bisect.bisect_left(self._tokens, token)]
+                for trigram in _trigrams(token):
+                    self._trigram_tokens[trigram].discard(token)
+
+    def _read(self, queryset):
+        return queryset.values_list('id', *DOCUMENT_FIELDS, 'updated_at').iterator(chunk_size=5000)
+
+    def _load(self):
+        version, = namespace_versions(['medicines'])
+        self._reset()
+        synced_at = None
+        for medicine_id, *document, updated_at in self._read(Medicine.objects.all()):
+            self._add(medicine_id, tuple(document))
+            if synced_at is None or updated_at > synced_at:
+                synced_at = updated_at
+        self._version, self._synced_at, self._loaded = version, synced_at, True
+
+    def _catch_up(self, version):
+        """Apply rows changed by other processes since the last sync"""
+        changed = Medicine.objects.all()
+        if self._synced_at is not None:
+            changed = changed.filter(updated_at__gte=self._synced_at - SYNC_OVERLAP)
+        for medicine_id, *document, updated_at in self._read(changed):
+            self._add(medicine_id, tuple(document))
+            if self._synced_at is None or updated_at > self._synced_at:
+                self._synced_at = updated_at
+        # Deletes leave no row behind; a size mismatch means some happened
+        if Medicine.objects.count() != len(self.documents):
+            live = set(Medicine.objects.values_list('id', flat=True).iterator(chunk_size=5000))
+            for medicine_id in [pk for pk in self.documents if pk not in live]:
+                self._remove(medicine_id)
+        self._version = version
+
+    def sync(self):
+        """Load the index, or bring it up to date if the catalog changed elsewhere"""
+        with self._lock:
+            if not self._loaded:
+                self._load()
+                return
+            version, = namespace_versions(['medicines'])
+            if version != self._version:
+                self._catch_up(version)
+
+    def update(self, medicine):
+        with self._lock:
+            if self._loaded:
+                self._add(medicine.pk, tuple(getattr(medicine, field) for field in DOCUMENT_FIELDS))
+
+    def remove(self, medicine_id):
+        with self._lock:
+            if self._loaded:
+                self._remove(medicine_id)
+
+    # Lookup
+
+    def _collect(self, scores, token, kind):
+        for medicine_id, weight in self._postings[token].items():
+            score = kind * weight
+            if scores.get(medicine_id, 0) < score:
+                scores[medicine_id] = score
+
+    def _matches(self, query_token):
+        """
+        {medicine_id: score} for the documents `query_token` matches exactly
+        or as a prefix, or failing those, within the typo allowance.
+        """
+        scores = {}
+        start = bisect.bisect_left(self._tokens, query_token)
+        for token in self._tokens[start:start + MAX_PREFIX_EXPANSIONS]:
+            if not token.startswith(query_token):
+                break
+            self._collect(scores, token, EXACT if token == query_token else PREFIX)
+        if scores:
+            return scores
+
+        max_edits = _max_edits(query_token)
+        if max_edits:
+            grams = _trigrams(query_token)
+            shared = Counter()
+            for position, trigram in grams:
+                # An edit shifts the rest of the token by at most one place
+                for shift in range(max(0, position - max_edits), position + max_edits + 1):
+                    shared.update(self._trigram_tokens.get((shift, trigram), ()))
+            # Each edit breaks at most three of the query's trigrams
+            needed = max(1, len(grams) - 3 * max_edits)
+            for token, count in shared.most_common(MAX_FUZZY_CANDIDATES):
+                if count < needed:
+                    break
+                distance = prefix_distance(query_token, token, max_edits)
+                if distance <= max_edits:
+                    self._collect(scores, token, FUZZY - max(distance - 1, 0))
+        return scores
+
+    def search(self, query, limit=DEFAULT_LIMIT):
+        """The best `limit` matches for `query` as (medicine_id, score, document) tuples"""
+        query_tokens = _words.findall(query.casefold())
+        if not query_tokens:
+            return []
+        with self._lock:
+            combined = None
+            # Narrowest token first, so the intersection shrinks fastest
+            for scores in sorted((self._matches(token) for token in query_tokens), key=len):
+                if combined is None:
+                    combined = scores
+                else:
+                    combined = {
+                        medicine_id: score + scores[medicine_id]
+                        for medicine_id, score in combined.items() if medicine_id in scores
+                    }
+                if not combined:
+                    return []
+            best = heapq.nsmallest(
+                limit, combined.items(),
+                key=lambda item: (-item[1], len(self.documents[item[0]][0]), item[0])
+            )
+            return [(medicine_id, score, self.documents[medicine_id]) for medicine_id, score in best]
+
+
+medicine_index = MedicineIndex()
+
+
+def search_medicines(query, limit=DEFAULT_LIMIT):
+    medicine_index.sync()
+    return medicine_index.search(query, limit)
+
+
+def connect_search_index():
+    """Keep medicine_index in step with this process's Medicine writes, once committed"""
+    def saved(sender, instance, **kwargs):
+        transaction.on_commit(lambda: medicine_index.update(instance))
+
+    def deleted(sender, instance, **kwargs):
+        medicine_id = instance.pk
+        transaction.on_commit(lambda: medicine_index.remove(medicine_id))
+
+    post_save.connect(saved, sender=Medicine, weak=False, dispatch_uid='medicine-search-index')
+    post_delete.connect(deleted, sender=Medicine, weak=False, dispatch_uid='medicine-search-index')
@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from .models import Medicine, Inventory, StockMovement
+from .expiry import request_today
 from pharmacies.models import Pharmacy
 
 
@@ -22,7 +23,7 @@ class InventorySerializer(serializers.ModelSerializer):
     medicine_id = serializers.IntegerField(write_only=True)
     pharmacy_name = serializers.CharField(source='pharmacy.name', read_only=True)
     is_low_stock = serializers.BooleanField(read_only=True)
-    is_expired = serializers.BooleanField(read_only=True)
+    is_expired = serializers.SerializerMethodField()
     
     class Meta:
         model = Inventory
@@ -33,7 +34,8 @@ class InventorySerializer(serializers.ModelSerializer):
             'minimum_stock_level', 'is_low_stock', 'is_expired',
             'created_at', 'updated_at'
         ]
-        read_only_fields = ['id', 'created_by', 'created_at', 'updated_at']
+        # Quantity only changes through stock movements (see inventory.stock)
+        read_only_fields = ['id', 'quantity', 'created_by', 'created_at', 'updated_at']
     
     def validate(self, attrs):
         # Validate that expiry date is after manufacture date
@@ -46,9 +48,21 @@ class InventorySerializer(serializers.ModelSerializer):
         
         return attrs
     
+    def get_is_expired(self, obj):
+        # One date per request rather than timezone.now() per row
+        return obj.expiry_date < request_today(self.context.get('request'))
+    
     def create(self, validated_data):
         validated_data['created_by'] = self.context['request'].user
         return super().create(validated_data)
+    
+    def update(self, instance, validated_data):
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        # Write only the edited fields: a full save would put back the
+        # quantity read at the start of the request over any sale since
+        instance.save(update_fields=[*validated_data, 'updated_at'])
+        return instance
 
 
 class StockMovementSerializer(serializers.ModelSerializer):
@@ -117,24 +131,21 @@ class InventoryCreateSerializer(serializers.ModelSerializer):
 class StockAdjustmentSerializer(serializers.Serializer):
     """Serializer for stock adjustments"""
     inventory_id = serializers.IntegerField()
-    adjustment_quantity = serializers.IntegerField()
+    adjustment_quantity = serializers.IntegerField(min_value=0)
     movement_type = serializers.ChoiceField(choices=StockMovement.MOVEMENT_TYPES)
     reference_number = serializers.CharField(max_length=100, required=False)
     notes = serializers.CharField(required=False)
     
-    def validate_inventory_id(self, value):
-        try:
-            inventory = Inventory.objects.get(id=value)
-            return value
-        except Inventory.DoesNotExist:
-            raise serializers.ValidationError("Invalid inventory ID")
-    
     def validate(self, attrs):
-        inventory = Inventory.objects.get(id=attrs['inventory_id'])
+        # One read serves the existence check, the stock check and the view
+        inventory = Inventory.objects.filter(id=attrs['inventory_id']).first()
+        if inventory is None:
+            raise serializers.ValidationError({'inventory_id': ["Invalid inventory ID"]})
+        attrs['inventory'] = inventory
         adjustment_quantity = attrs['adjustment_quantity']
         
-        # For OUT movements, check if sufficient stock is available
-        if attrs['movement_type'] == 'OUT' and adjustment_quantity > 0:
+        # For outbound movements, check if sufficient stock is available
+        if attrs['movement_type'] in ('OUT', 'EXPIRED', 'DAMAGED') and adjustment_quantity > 0:
             if inventory.quantity < adjustment_quantity:
                 raise serializers.ValidationError(
                     f"Insufficient stock. Available: {inventory.quantity}, Requested: {adjustment_quantity}"
@@ -0,0 +1,36 @@
+from django.db import transaction
+from django.dispatch import Signal
+
+
+# Sent after commit whenever inventory rows cross their minimum stock level.
+# Receivers get `entered` (ids that became low on stock) and `cleared`
+# (ids that are back above the minimum); sender is Inventory.
+low_stock_transition = Signal()
+
+
+def has_low_stock_listeners():
+    from .models import Inventory
+    return low_stock_transition.has_listeners(Inventory)
+
+
+def send_low_stock_transition(entered=(), cleared=()):
+    from .models import Inventory
+    entered, cleared = list(entered), list(cleared)
+    if not (entered or cleared):
+        return
+    transaction.on_commit(lambda: low_stock_transition.send(
+        sender=Inventory, entered=entered, cleared=cleared
+    ))
+
+
+def connect_response_cache():
+    """Bump the cached-response namespaces the inventory models feed"""
+    from fylinx2.response_cache import invalidate_on
+    from .models import Inventory, Medicine, StockMovement
+    invalidate_on(Medicine, 'medicines')
+    invalidate_on(Inventory, 'inventory')
+    # Quantities change through F() updates, which send no signal; single
+    # changes are paired with a saved StockMovement or Sale. Bulk paths
+    # (import, stock-take) bulk_create their movements, which sends no
+    # signal either, so they call invalidate('inventory') themselves
+    invalidate_on(StockMovement, 'inventory')
@@ -0,0 +1,240 @@
+"""
+Stock mutation service: every change to Inventory.quantity goes through here.
+
+Quantities are changed with F() expression UPDATEs that touch only
+`quantity`, `stock_deficit` and `updated_at`, never with a
+read-modify-write save(), so concurrent tills cannot lose each other's
+updates. Decrements are conditional on enough stock being present, which
+keeps quantities from going below zero without a separate read. Each
+mutation is paired with a StockMovement carrying the signed delta, so the
+ledger always sums to the live quantity. The stored stock_deficit moves
+with the quantity, and rows crossing their minimum stock level are
+announced through inventory.signals.low_stock_transition.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from fylinx2.expressions import case_batch_size, case_by_pk
+
+from .ledger import batched
+from .models import Inventory, StockMovement
+from .signals import has_low_stock_listeners, send_low_stock_transition
+
+
+# Movement types that take stock out of a batch
+OUTBOUND_MOVEMENT_TYPES = ('OUT', 'EXPIRED', 'DAMAGED')
+# Rows per UPDATE: a decrement repeats its CASE in the filter, quantity and
+# stock_deficit, an increment in quantity and stock_deficit
+DECREMENT_BATCH_SIZE = case_batch_size(3)
+INCREMENT_BATCH_SIZE = case_batch_size(2)
+# A count sets quantity and stock_deficit from the same CASE
+SET_BATCH_SIZE = case_batch_size(2)
+
+
+class StockShortfall(Exception):
+    """Raised when one or more inventory rows cannot cover a decrement"""
+
+    def __init__(self, shortfalls):
+        self.shortfalls = shortfalls
+        super().__init__(
+            "Insufficient stock for inventory "
+            + ", ".join(str(item['inventory']) for item in shortfalls)
+        )
+
+
+def _sum_lines(lines):
+    quantities = defaultdict(int)
+    for inventory_id, quantity in lines:
+        quantities[inventory_id] += quantity
+    return quantities
+
+
+def _per_row_case(quantities):
+    return case_by_pk(Inventory, quantities)
+
+
+def _chunks(quantities, size):
+    """`quantities` split into dicts of at most `size` ids, in ascending id order"""
+    for ids in batched(sorted(quantities), size):
+        yield {pk: quantities[pk] for pk in ids}
+
+
+def decrement_stock(lines):
+    """
+    Take stock for many inventory rows with conditional UPDATEs.
+
+    `lines` is an iterable of (inventory_id, quantity) pairs; repeated ids are
+    summed. Rows are updated DECREMENT_BATCH_SIZE at a time, in id order.
+    Either every row is decremented or StockShortfall is raised, so
+    callers must run this inside transaction.atomic() to roll back the
+    partial update together with the rest of their writes.
+    """
+    quantities = _sum_lines(lines)
+    if not quantities:
+        return
+
+    entered = []
+    with transaction.atomic():
+        for chunk in _chunks(quantities, DECREMENT_BATCH_SIZE):
+            requested = _per_row_case(chunk)
+            updated = Inventory.objects.filter(
+                pk__in=list(chunk),
+                quantity__gte=requested
+            ).update(
+                quantity=F('quantity') - requested,
+                stock_deficit=F('stock_deficit') + requested,
+                updated_at=timezone.now()
+            )
+            if updated != len(chunk):
+                # Undo every chunk so the report below compares against the
+                # quantities as they were before this call
+                transaction.set_rollback(True)
+                break
+            if has_low_stock_listeners():
+                # Rows whose deficit was below zero before this decrement
+                entered += Inventory.objects.filter(
+                    pk__in=list(chunk),
+                    stock_deficit__gte=0,
+                    stock_deficit__lt=requested
+                ).values_list('id', flat=True)
+        else:
+            send_low_stock_transition(entered=entered)
+            return
+
+    available = {}
+    for ids in batched(quantities):
+        available.update(Inventory.objects.filter(pk__in=ids).values_list('id', 'quantity'))
+    raise StockShortfall([
+        {
+            'inventory': pk,
+            'requested': quantity,
+            'available': available.get(pk, 0),
+        }
+        for pk, quantity in quantities.items()
+        if available.get(pk, 0) < quantity
+    ])
+
+
+def increment_stock(lines):
+    """
+    Add stock to many inventory rows with one UPDATE per INCREMENT_BATCH_SIZE
+    rows. Run it inside transaction.atomic() so a failure cannot leave only
+    some of the rows updated.
+    """
+    quantities = _sum_lines(lines)
+    if not quantities:
+        return
+
+    cleared = []
+    for chunk in _chunks(quantities, INCREMENT_BATCH_SIZE):
+        added = _per_row_case(chunk)
+        Inventory.objects.filter(pk__in=list(chunk)).update(
+            quantity=F('quantity') + added,
+            stock_deficit=F('stock_deficit') - added,
+            updated_at=timezone.now()
+        )
+        if has_low_stock_listeners():
+            # Rows whose deficit was zero or more before this increment
+            cleared += Inventory.objects.filter(
+                pk__in=list(chunk),
+                stock_deficit__lt=0,
+                stock_deficit__gte=_per_row_case({pk: -quantity for pk, quantity in chunk.items()})
+            ).values_list('id', flat=True)
+    send_low_stock_transition(cleared=cleared)
+
+
+def set_stock(inventory_id, quantity):
+    """
+    Set a batch to an absolute (counted) quantity and return the delta applied.
+
+    The row is locked for the read so a concurrent sale cannot slip in between
+    reading the old quantity and writing the new one.
+    """
+    with transaction.atomic():
+        current, minimum = Inventory.objects.select_for_update().filter(
+            pk=inventory_id
+        ).values_list('quantity', 'minimum_stock_level').get()
+        Inventory.objects.filter(pk=inventory_id).update(
+            quantity=quantity,
+            stock_deficit=minimum - quantity,
+            updated_at=timezone.now()
+        )
+
+    was_low, is_low = current <= minimum, quantity <= minimum
+    if was_low != is_low:
+        if is_low:
+            send_low_stock_transition(entered=[inventory_id])
+        else:
+            send_low_stock_transition(cleared=[inventory_id])
+    return quantity - current
+
+
+def set_stock_many(counts, batch_size=SET_BATCH_SIZE):
+    """
+    Set many batches to absolute (counted) quantities.
+
+    `counts` maps inventory ids to counted quantities. Per `batch_size`
+    ids, the rows are locked in id order, like every other stock write,
+    and read, then written with one CASE UPDATE. Returns
+    {inventory_id: (previous quantity, delta)}. Must be called inside
+    transaction.atomic() for the locks to hold until the movements are
+    written.
+    """
+    ids = sorted(counts)
+    changes = {}
+    entered, cleared = [], []
+    for start in range(0, len(ids), batch_size):
+        batch = ids[start:start + batch_size]
+        current = {
+            pk: (quantity, minimum)
+            for pk, quantity, minimum in Inventory.objects.select_for_update().filter(
+                pk__in=batch
+            ).order_by('id').values_list('id', 'quantity', 'minimum_stock_level')
+        }
+        changed = {pk: counts[pk] for pk in batch if pk in current and counts[pk] != current[pk][0]}
+        if changed:
+            counted = _per_row_case(changed)
+            Inventory.objects.filter(pk__in=list(changed)).update(
+                quantity=counted,
+                stock_deficit=F('minimum_stock_level') - counted,
+                updated_at=timezone.now()
+            )
+        for pk, (quantity, minimum) in current.items():
+            changes[pk] = (quantity, counts[pk] - quantity)
+            was_low, is_low = quantity <= minimum, counts[pk] <= minimum
+            if was_low != is_low:
+                (entered if is_low else cleared).append(pk)
+
+    send_low_stock_transition(entered=entered, cleared=cleared)
+    return changes
+
+
+def apply_movement(inventory_id, movement_type, quantity, user, reference_number='', notes=''):
+    """
+    Apply a single stock movement and record it in the ledger.
+
+    `quantity` is the amount moved for IN and outbound types, and the counted
+    quantity for ADJUSTMENT. Raises StockShortfall for outbound movements that
+    exceed the stock on hand.
+    """
+    with transaction.atomic():
+        if movement_type == 'ADJUSTMENT':
+            delta = set_stock(inventory_id, quantity)
+        elif movement_type in OUTBOUND_MOVEMENT_TYPES:
+            decrement_stock([(inventory_id, quantity)])
+            delta = -quantity
+        else:
+            increment_stock([(inventory_id, quantity)])
+            delta = quantity
+
+        return StockMovement.objects.create(
+            inventory_id=inventory_id,
+            movement_type=movement_type,
+            quantity=delta,
+            reference_number=reference_number,
+            notes=notes,
+            created_by=user
+        )
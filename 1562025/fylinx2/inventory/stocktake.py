@@ -0,0 +1,142 @@
+"""
+Batch stock-takes.
+
+A physical count posts counted quantities for many batches at once. The
+batches are read with one query per ID_BATCH_SIZE ids to check scope and
+describe them in the report. inventory.stock.set_stock_many then locks
+them and writes the new quantities set-wise, and the differences become
+ADJUSTMENT movements in one bulk insert. Everything happens in a single
+transaction, so a count sheet is applied completely or not at all.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+
+from fylinx2.response_cache import invalidate
+
+from .ledger import ID_BATCH_SIZE, batched
+from .models import Inventory, StockMovement
+from .stock import set_stock_many
+
+
+# Rows per bulk INSERT of movements; the backend lowers it further where the
+# rows' parameters would pass its limit. The counted quantities are written
+# in set_stock_many's own SET_BATCH_SIZE chunks
+WRITE_BATCH_SIZE = 500
+
+
+def _parse_counts(rows):
+    """
+    ({inventory_id: counted quantity}, {row number: errors}, {inventory_id: row
+    number}); row numbers start at 1
+    """
+    counts, errors, first_rows = {}, {}, {}
+    for number, row in enumerate(rows, 1):
+        row_errors = {}
+        values = {}
+        for field in ('inventory', 'counted_quantity'):
+            try:
+                values[field] = int(row.get(field))
+                if values[field] < (1 if field == 'inventory' else 0):
+                    raise ValueError
+            except (TypeError, ValueError):
+                row_errors[field] = ["A valid non-negative integer is required."]
+        if not row_errors and values['inventory'] in first_rows:
+            row_errors['inventory'] = [f"Duplicate of row {first_rows[values['inventory']]}"]
+        if row_errors:
+            errors[number] = row_errors
+            continue
+        first_rows[values['inventory']] = number
+        counts[values['inventory']] = values['counted_quantity']
+    return counts, errors, first_rows
+
+
+def _describe(inventory_ids):
+    batches = {}
+    for ids in batched(sorted(inventory_ids), ID_BATCH_SIZE):
+        for row in Inventory.objects.filter(id__in=ids).values(
+            'id', 'pharmacy_id', 'medicine__name', 'batch_number', 'quantity', 'unit_price'
+        ):
+            batches[row['id']] = row
+    return batches
+
+
+def _variance_report(counts, batches, book):
+    lines = []
+    units_over = units_short = 0
+    value = Decimal('0.00')
+    for inventory_id, counted in counts.items():
+        if inventory_id not in book:
+            # Deleted after it was validated
+            continue
+        variance = counted - book[inventory_id]
+        if not variance:
+            continue
+        batch = batches[inventory_id]
+        variance_value = variance * batch['unit_price']
+        if variance > 0:
+            units_over += variance
+        else:
+            units_short -= variance
+        value += variance_value
+        lines.append({
+            'inventory': inventory_id,
+            'pharmacy': batch['pharmacy_id'],
+            'medicine_name': batch['medicine__name'],
+            'batch_number': batch['batch_number'],
+            'book_quantity': book[inventory_id],
+            'counted_quantity': counted,
+            'variance': variance,
+            'variance_value': variance_value
+        })
+    lines.sort(key=lambda line: (abs(line['variance_value']), line['inventory']), reverse=True)
+    return {
+        'lines_counted': len(counts),
+        'lines_with_variance': len(lines),
+        'units_over': units_over,
+        'units_short': units_short,
+        'net_variance_value': value,
+        'variances': lines
+    }
+
+
+def stock_take(rows, user, scope, reference_number='', notes='', dry_run=False):
+    """
+    Apply a count sheet; returns (report, {row number: errors}).
+
+    `rows` are dicts with `inventory` and `counted_quantity`. Nothing is
+    written if any row is invalid, or with dry_run=True, which reports the
+    variances against the current quantities only.
+    """
+    counts, errors, first_rows = _parse_counts(rows)
+    batches = _describe(counts)
+    for inventory_id, number in first_rows.items():
+        batch = batches.get(inventory_id)
+        if batch is None or not scope.allows(batch['pharmacy_id']):
+            errors[number] = {'inventory': ["Invalid inventory or access denied"]}
+    if errors or not counts:
+        return None, errors
+
+    if dry_run:
+        book = {inventory_id: batches[inventory_id]['quantity'] for inventory_id in counts}
+        return _variance_report(counts, batches, book), {}
+
+    with transaction.atomic():
+        changes = set_stock_many(counts)
+        StockMovement.objects.bulk_create([
+            StockMovement(
+                inventory_id=inventory_id,
+                movement_type='ADJUSTMENT',
+                quantity=delta,
+                reference_number=reference_number,
+                notes=notes or "Stock take",
+                created_by=user
+            )
+            for inventory_id, (_, delta) in changes.items() if delta
+        ], batch_size=WRITE_BATCH_SIZE)
+        # The counts are written with an UPDATE and the movements with
+        # bulk_create, neither of which sends post_save
+        invalidate('inventory')
+
+    book = {inventory_id: previous for inventory_id, (previous, _) in changes.items()}
+    return _variance_report(counts, batches, book), {}
@@ -1,3 +1,321 @@
-from django.test import TestCase
+from datetime import timedelta
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from accounts.models import CustomUser
+from fylinx2.expressions import MAX_QUERY_PARAMS
+from fylinx2.pagination import encode_cursor
+from fylinx2.testing import EndpointBudgetMixin, budget_fixtures
+from fylinx2.response_cache import namespace_versions
+from pharmacies.models import Pharmacy
+from pharmacies.scope import PharmacyScope
+from . import intake
+from .intake import import_rows
+from .lean import inventory_mapper, stock_movement_mapper
+from .models import Inventory, Medicine, StockMovement
+from .serializers import InventorySerializer, StockMovementSerializer
+from .stock import StockShortfall, decrement_stock, increment_stock
+from .stocktake import stock_take
+
+
+class ParameterCounter:
+    """execute_wrapper recording the parameter count of every statement"""
+
+    def __init__(self):
+        self.counts = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.counts.append(len(params or ()))
+        return execute(sql, params, many, context)
+
+
+def create_batches(count, quantity=10, **extra):
+    """`count` batches of one new medicine in a new pharmacy, and their creator"""
+    user = CustomUser.objects.create_user(username=f"stock-{CustomUser.objects.count()}", role='ADMIN')
+    pharmacy = Pharmacy.objects.create(name='Test pharmacy', location='Test', created_by=user)
+    medicine = Medicine.objects.create(name='Testol', manufacturer='Test', dosage_form='tablet', strength='1mg')
+    today = timezone.now().date()
+    batches = Inventory.objects.bulk_create([
+        Inventory(
+            pharmacy=pharmacy, medicine=medicine, batch_number=f"TEST-{n}", quantity=quantity,
+            stock_deficit=10 - quantity, unit_price='1.00', selling_price='2.00',
+            expiry_date=today + timedelta(days=365), manufacture_date=today - timedelta(days=30),
+            supplier='Test', created_by=user, **extra
+        )
+        for n in range(count)
+    ])
+    return user, batches
+
+
+class StockParameterLimitTests(TestCase):
+    """Set-wise stock writes stay within SQL Server's parameter limit however many rows they touch"""
+
+    def setUp(self):
+        self.user, self.batches = create_batches(700)
+        self.counter = ParameterCounter()
+
+    def test_large_decrement(self):
+        with connection.execute_wrapper(self.counter), transaction.atomic():
+            decrement_stock((batch.id, 3) for batch in self.batches)
+        self.assertLessEqual(max(self.counter.counts), MAX_QUERY_PARAMS)
+        self.assertEqual(set(Inventory.objects.values_list('quantity', flat=True)), {7})
+
+    def test_large_increment(self):
+        with connection.execute_wrapper(self.counter), transaction.atomic():
+            increment_stock((batch.id, 3) for batch in self.batches)
+        self.assertLessEqual(max(self.counter.counts), MAX_QUERY_PARAMS)
+        self.assertEqual(set(Inventory.objects.values_list('quantity', flat=True)), {13})
+
+    def test_shortfall_in_a_later_chunk_rolls_back_every_chunk(self):
+        Inventory.objects.filter(pk=self.batches[-1].pk).update(quantity=1)
+        with self.assertRaises(StockShortfall) as raised, transaction.atomic():
+            decrement_stock((batch.id, 3) for batch in self.batches)
+        self.assertEqual(
+            raised.exception.shortfalls,
+            [{'inventory': self.batches[-1].pk, 'requested': 3, 'available': 1}]
+        )
+        self.assertEqual(Inventory.objects.filter(quantity=10).count(), 699)
+
+    def test_large_stock_take(self):
+        before = namespace_versions(['inventory'])
+        with connection.execute_wrapper(self.counter):
+            report, errors = stock_take(
+                [{'inventory': batch.id, 'counted_quantity': 4} for batch in self.batches],
+                self.user, PharmacyScope()
+            )
+        self.assertFalse(errors)
+        self.assertLessEqual(max(self.counter.counts), MAX_QUERY_PARAMS)
+        self.assertEqual(set(Inventory.objects.values_list('quantity', flat=True)), {4})
+        # Nothing in a stock-take sends post_save
+        self.assertNotEqual(namespace_versions(['inventory']), before)
+
+
+class ImportTests(TestCase):
+
+    def setUp(self):
+        self.user, (self.batch,) = create_batches(1)
+        today = timezone.now().date()
+        self.row = {
+            'pharmacy': self.batch.pharmacy_id, 'medicine': self.batch.medicine_id, 'quantity': 5,
+            'unit_price': '1.00', 'selling_price': '2.00', 'supplier': 'Test',
+            'expiry_date': str(self.batch.expiry_date), 'manufacture_date': str(today - timedelta(days=10)),
+        }
+
+    def test_import_invalidates_cached_inventory(self):
+        before = namespace_versions(['inventory'])
+        result = import_rows(
+            [{**self.row, 'batch_number': self.batch.batch_number}, {**self.row, 'batch_number': 'NEW'}],
+            self.user, PharmacyScope()
+        )
+        self.assertFalse(result.errors)
+        self.assertNotEqual(namespace_versions(['inventory']), before)
+        self.assertEqual(
+            dict(Inventory.objects.values_list('batch_number', 'quantity')), {'TEST-0': 15, 'NEW': 5}
+        )
+
+    def import_racing(self, races, partial=False):
+        """import_rows() with another request creating batch NEW after each of the first `races` validations"""
+        validate_rows = intake.validate_rows
+
+        def validate_then_race(rows, scope):
+            if not validate_then_race.races:
+                return validate_rows(rows, scope)
+            validate_then_race.races -= 1
+            # Undo the previous race so NEW is validated as a new batch again
+            Inventory.objects.filter(batch_number='NEW').delete()
+            validated = validate_rows(rows, scope)
+            Inventory.objects.create(
+                pharmacy_id=self.batch.pharmacy_id, medicine_id=self.batch.medicine_id, batch_number='NEW',
+                quantity=1, unit_price='1.00', selling_price='2.00', expiry_date=self.batch.expiry_date,
+                manufacture_date=self.batch.manufacture_date, supplier='Other', created_by=self.user
+            )
+            return validated
+        validate_then_race.races = races
+
+        # The insert-then-update path taken where bulk_create cannot upsert
+        with mock.patch.object(connection.features, 'supports_update_conflicts_with_target', False), \
+                mock.patch.object(intake, 'validate_rows', validate_then_race):
+            return import_rows(
+                [{**self.row, 'batch_number': self.batch.batch_number}, {**self.row, 'batch_number': 'NEW'}],
+                self.user, PharmacyScope(), partial=partial
+            )
+
+    def test_batch_created_during_import_is_restocked(self):
+        result = self.import_racing(1)
+        self.assertFalse(result.errors)
+        self.assertEqual((result.created, result.restocked), (0, 2))
+        self.assertEqual(
+            dict(Inventory.objects.values_list('batch_number', 'quantity')), {'TEST-0': 15, 'NEW': 6}
+        )
+
+    def test_batch_created_during_every_attempt_is_reported(self):
+        for partial, quantity in ((False, 10), (True, 15)):
+            with self.subTest(partial=partial):
+                result = self.import_racing(intake.WRITE_ATTEMPTS, partial)
+                self.assertEqual(list(result.errors), [2])
+                self.assertEqual(result.imported, 1 if partial else 0)
+                self.assertEqual(Inventory.objects.get(batch_number='TEST-0').quantity, quantity)
+
+
+class CursorTests(TestCase):
+    """A cursor that decodes but does not fit the ordering is a 400, not a 500"""
+
+    def setUp(self):
+        self.user, _ = create_batches(3, quantity=0)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_tampered_cursor(self):
+        today = str(timezone.now().date())
+        for path, cursor in [
+            ('/api/v1/inventory/expired/', ['abc', 1]),
+            ('/api/v1/inventory/expired/', [today, 'x']),
+            ('/api/v1/inventory/low-stock/', [{}, 1]),
+            ('/api/v1/inventory/expiring/', [today]),
+        ]:
+            with self.subTest(path=path, cursor=cursor):
+                response = self.client.get(path, {'cursor': encode_cursor(cursor)})
+                self.assertEqual(response.status_code, 400)
+
+    def test_cursor_round_trip(self):
+        first = self.client.get('/api/v1/inventory/low-stock/', {'limit': 2}).json()
+        second = self.client.get('/api/v1/inventory/low-stock/', {'cursor': first['next_cursor']}).json()
+        self.assertEqual(len(first['low_stock_items']) + len(second['low_stock_items']), 3)
+        self.assertFalse(second['has_more'])
+
+
+class ConcurrentStockTests(TransactionTestCase):
+    """Checkouts, FEFO checkouts and movements from many threads keep stock equal to the ledger"""
+
+    def test_stress(self):
+        out = StringIO()
+        # Raises CommandError if any row disagrees with the ledger
+        call_command('stress_stock', threads=8, operations=25, batches=4, stdout=out, stderr=StringIO())
+        if connection.features.has_select_for_update:
+            # Rows are locked in one order everywhere, so no checkout is a
+            # deadlock victim
+            self.assertNotIn('aborted', out.getvalue())
+
+
+class QueryBudgetTests(EndpointBudgetMixin, TestCase):
+
+    def requests(self, label):
+        """(method, path, data, status) for every inventory endpoint; `label` keeps created names unique"""
+        today = timezone.now().date()
+        pharmacy = self.fixtures['pharmacies'][0]
+        inventory = self.fixtures['inventories'][0]
+        spare = Inventory.objects.create(
+            pharmacy=pharmacy, medicine=self.fixtures['medicines'][0], batch_number=f"BUDGET-SPARE-{label}",
+            quantity=0, unit_price='1.00', selling_price='2.00', expiry_date=today + timedelta(days=400),
+            manufacture_date=today - timedelta(days=10), supplier='Budget', created_by=self.fixtures['admin']
+        )
+        batch = {
+            'pharmacy': pharmacy.id, 'medicine': self.fixtures['medicines'][1].id, 'quantity': 10,
+            'unit_price': '1.00', 'selling_price': '2.00', 'expiry_date': str(today + timedelta(days=300)),
+            'manufacture_date': str(today - timedelta(days=10)), 'supplier': 'Budget',
+        }
+        return [
+            ('GET', 'medicines/', None, None),
+            ('POST', 'medicines/', {
+                'name': f"Budgetol new {label}", 'manufacturer': 'Budget', 'dosage_form': 'tablet', 'strength': '1mg'
+            }, None),
+            ('GET', 'medicines/search/?q=budgetol', None, None),
+            ('GET', 'inventory/', None, None),
+            ('POST', 'inventory/', {**batch, 'batch_number': f"BUDGET-NEW-{label}"}, None),
+            ('POST', 'inventory/import/', [
+                {**batch, 'medicine': medicine.id, 'batch_number': f"BUDGET-GRN-{label}"}
+                for medicine in self.fixtures['medicines']
+            ], None),
+            ('GET', f"inventory/{inventory.id}/", None, None),
+            ('PUT', f"inventory/{inventory.id}/", {
+                **batch, 'medicine_id': inventory.medicine_id, 'batch_number': inventory.batch_number,
+                'minimum_stock_level': 4
+            }, None),
+            ('DELETE', f"inventory/{spare.id}/", None, None),
+            ('GET', f"inventory/{inventory.id}/stock-at/?at={timezone.now().isoformat().replace('+', '%2B')}", None, None),
+            ('POST', 'inventory/adjust-stock/', {
+                'inventory_id': inventory.id, 'adjustment_quantity': 1, 'movement_type': 'IN'
+            }, None),
+            ('POST', 'inventory/stock-take/', {'counts': [
+                {'inventory': item.id, 'counted_quantity': 7}
+                for item in self.fixtures['inventories'] if item.pharmacy_id == pharmacy.id
+            ]}, None),
+            ('GET', 'inventory/low-stock/', None, None),
+            ('GET', 'inventory/expired/', None, None),
+            ('GET', 'inventory/expiring/', None, None),
+            ('GET', 'stock-movements/', None, None),
+            ('GET', 'stock-movements/export/', None, None),
+        ]
+
+    def test_admin(self):
+        self.assertRequestsWithinBudget(self.fixtures['admin'], self.requests('admin'))
+
+    def test_manager(self):
+        self.assertRequestsWithinBudget(self.fixtures['manager'], self.requests('manager'))
+
+    def test_non_numeric_ids(self):
+        self.assertRequestsWithinBudget(self.fixtures['admin'], [
+            ('GET', 'medicines/search/?q=budgetol&pharmacy_id=abc', None, 400),
+            ('GET', 'inventory/?pharmacy_id=abc', None, 400),
+            ('GET', 'inventory/expiring/?pharmacy_id=abc', None, 400),
+            ('GET', 'stock-movements/?inventory_id=abc', None, 400),
+            ('GET', 'stock-movements/export/?pharmacy_id=abc', None, 400),
+            ('GET', 'stock-movements/export/?inventory_id=1.5', None, 400),
+        ])
+
+
+class InventoryEditTests(TestCase):
+
+    def test_edit_keeps_stock_taken_since_read(self):
+        _, (batch,) = create_batches(1)
+        batch = Inventory.objects.get(pk=batch.pk)
+        # A sale commits between the edit's read and its save
+        with transaction.atomic():
+            decrement_stock([(batch.id, 4)])
+        serializer = InventorySerializer(batch, data={
+            'pharmacy': batch.pharmacy_id, 'medicine_id': batch.medicine_id, 'batch_number': 'EDITED',
+            'quantity': 10, 'unit_price': '1.00', 'selling_price': '3.00', 'expiry_date': str(batch.expiry_date),
+            'manufacture_date': str(batch.manufacture_date), 'supplier': 'Test', 'minimum_stock_level': 5,
+        })
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        serializer.save()
+        self.assertEqual(
+            Inventory.objects.values('batch_number', 'quantity', 'stock_deficit').get(pk=batch.pk),
+            {'batch_number': 'EDITED', 'quantity': 6, 'stock_deficit': -1}
+        )
+        self.assertEqual((batch.quantity, batch.stock_deficit), (6, -1))
+
+
+class LeanMapperTests(TestCase):
+    """The values() mappers render the same JSON bytes as the serializers they mirror"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = budget_fixtures(6)['admin']
+
+    def assertSameJSON(self, mapper, serializer_class, queryset):
+        renderer = JSONRenderer()
+        for zone in ('UTC', 'Asia/Kolkata'):
+            context = {'request': SimpleNamespace(user=self.admin)}
+            with self.subTest(time_zone=zone), timezone.override(zone):
+                serialized = renderer.render(serializer_class(queryset, many=True, context=context).data)
+                mapped = renderer.render(mapper.many(mapper.values(queryset), context))
+                self.assertEqual(mapped, serialized)
+
+    def test_inventory(self):
+        queryset = Inventory.objects.select_related('medicine', 'pharmacy').order_by('id')
+        self.assertSameJSON(inventory_mapper, InventorySerializer, queryset)
+
+    def test_stock_movements(self):
+        queryset = StockMovement.objects.select_related(
+            'inventory__medicine', 'inventory__pharmacy', 'created_by'
+        ).order_by('id')
+        self.assertSameJSON(stock_movement_mapper, StockMovementSerializer, queryset)
@@ -4,17 +4,22 @@ from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
 
 from .models import Pharmacy
+from .scope import get_scope
 from .serializers import (
     PharmacySerializer, PharmacyDetailSerializer, 
     PharmacyCreateSerializer, PharmacyUpdateSerializer,
     AssignManagerSerializer
 )
 from accounts.models import CustomUser
+from fylinx2.permissions import DenyAll
+from fylinx2.queries import query_budget
+from fylinx2.response_cache import cache_response
 
 
 class PharmacyListCreateAPIView(generics.ListCreateAPIView):
     """API endpoint for listing and creating pharmacies"""
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = {'GET': 4, 'POST': 4}
     
     def get_serializer_class(self):
         if self.request.method == 'POST':
@@ -22,21 +27,13 @@ class PharmacyListCreateAPIView(generics.ListCreateAPIView):
         return PharmacySerializer
     
     def get_queryset(self):
-        user = self.request.user
-        
-        if user.is_superuser or user.role == 'ADMIN':
-            # Admins can see all pharmacies
-            return Pharmacy.objects.all()
-        elif user.role == 'MANAGER':
-            # Managers can see their assigned pharmacies
-            return user.managed_pharmacies.all()
-        elif user.role == 'STAFF':
-            # Staff can see only their assigned pharmacy
-            if user.assigned_pharmacy:
-                return Pharmacy.objects.filter(id=user.assigned_pharmacy.id)
-            return Pharmacy.objects.none()
-        
-        return Pharmacy.objects.none()
+        # Admins see all pharmacies, managers their managed ones and
+        # staff only their assigned pharmacy
+        return get_scope(self.request).filter(Pharmacy.objects.all(), path='').select_related('created_by')
+    
+    @cache_response('pharmacies')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
     
     def get_permissions(self):
         if self.request.method == 'POST':
@@ -44,7 +41,7 @@ class PharmacyListCreateAPIView(generics.ListCreateAPIView):
             if (self.request.user.is_superuser or 
                 self.request.user.role == 'ADMIN'):
                 return [permissions.IsAuthenticated()]
-            return [permissions.DenyAll()]
+            return [DenyAll()]
         return [permissions.IsAuthenticated()]
     
     def create(self, request, *args, **kwargs):
@@ -67,19 +64,12 @@ class PharmacyDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
     """API endpoint for retrieving, updating, and deleting a specific pharmacy"""
     serializer_class = PharmacyDetailSerializer
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = {'GET': 5, 'PUT': 6, 'PATCH': 6, 'DELETE': 11}
     
     def get_queryset(self):
-        user = self.request.user
-        
-        if user.is_superuser or user.role == 'ADMIN':
-            return Pharmacy.objects.all()
-        elif user.role == 'MANAGER':
-            return user.managed_pharmacies.all()
-        elif user.role == 'STAFF':
-            if user.assigned_pharmacy:
-                return Pharmacy.objects.filter(id=user.assigned_pharmacy.id)
-        
-        return Pharmacy.objects.none()
+        return get_scope(self.request).filter(Pharmacy.objects.all(), path='').select_related(
+            'created_by'
+        ).prefetch_related('managers')
     
     def get_serializer_class(self):
         if self.request.method in ['PUT', 'PATCH']:
@@ -98,7 +88,7 @@ class PharmacyDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
         # Check permissions for update
         if not (request.user.is_superuser or 
                 request.user.role == 'ADMIN' or 
-                pharmacy.created_by == request.user):
+                pharmacy.created_by_id == request.user.id):
             return Response({
                 'success': False,
                 'message': 'You do not have permission to update this pharmacy'
@@ -124,7 +114,7 @@ class PharmacyDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
         # Check permissions for delete
         if not (request.user.is_superuser or 
                 request.user.role == 'ADMIN' or 
-                pharmacy.created_by == request.user):
+                pharmacy.created_by_id == request.user.id):
             return Response({
                 'success': False,
                 'message': 'You do not have permission to delete this pharmacy'
@@ -139,6 +129,7 @@ class PharmacyDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
         })
 
 
+@query_budget(12)
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
 def assign_managers(request, pharmacy_id):
@@ -148,7 +139,7 @@ def assign_managers(request, pharmacy_id):
     # Check permissions
     if not (request.user.is_superuser or 
             request.user.role == 'ADMIN' or 
-            pharmacy.created_by == request.user):
+            pharmacy.created_by_id == request.user.id):
         return Response({
             'success': False,
             'message': 'You do not have permission to assign managers to this pharmacy'
@@ -175,6 +166,7 @@ def assign_managers(request, pharmacy_id):
     }, status=status.HTTP_400_BAD_REQUEST)
 
 
+@query_budget(5)
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
 def pharmacy_managers(request, pharmacy_id):
@@ -184,7 +176,7 @@ def pharmacy_managers(request, pharmacy_id):
     # Check permissions
     if not (request.user.is_superuser or 
             request.user.role == 'ADMIN' or 
-            pharmacy.created_by == request.user):
+            pharmacy.created_by_id == request.user.id):
         return Response({
             'success': False,
             'message': 'You do not have permission to view this data'
@@ -192,13 +184,14 @@ def pharmacy_managers(request, pharmacy_id):
     
     # Get all managers
     managers = CustomUser.objects.filter(role='MANAGER')
+    assigned = set(pharmacy.managers.values_list('id', flat=True))
     manager_data = [
         {
             'id': manager.id,
             'username': manager.username,
             'full_name': f"{manager.first_name} {manager.last_name}".strip(),
             'email': manager.email,
-            'is_assigned': pharmacy.managers.filter(id=manager.id).exists()
+            'is_assigned': manager.id in assigned
         }
         for manager in managers
     ]
@@ -209,19 +202,18 @@ def pharmacy_managers(request, pharmacy_id):
     })
 
 
+@query_budget(5)
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
+@cache_response('pharmacies', 'users', per_user=True)
 def pharmacy_stats(request, pharmacy_id):
     """Get pharmacy statistics"""
-    pharmacy = get_object_or_404(Pharmacy, id=pharmacy_id)
+    pharmacy = get_object_or_404(Pharmacy.objects.select_related('created_by'), id=pharmacy_id)
     
     # Check permissions
     user = request.user
-    if not (user.is_superuser or 
-            user.role == 'ADMIN' or 
-            pharmacy.created_by == user or
-            pharmacy.managers.filter(id=user.id).exists() or
-            (user.role == 'STAFF' and user.assigned_pharmacy == pharmacy)):
+    if not (get_scope(request).allows(pharmacy.id) or
+            pharmacy.created_by_id == user.id):
         return Response({
             'success': False,
             'message': 'You do not have permission to view this data'
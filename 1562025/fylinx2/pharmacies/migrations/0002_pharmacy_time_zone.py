@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-17 18:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharmacies', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pharmacy',
+            name='time_zone',
+            field=models.CharField(default='UTC', max_length=64),
+        ),
+    ]
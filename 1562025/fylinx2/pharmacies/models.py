@@ -11,6 +11,8 @@ class Pharmacy(models.Model):
         related_name='created_pharmacies'
     )
     is_superuser_created = models.BooleanField(default=False)
+    # IANA zone used to bucket this pharmacy's sales into local days
+    time_zone = models.CharField(max_length=64, default=settings.TIME_ZONE)
 
     # Assign multiple managers
     managers = models.ManyToManyField(
@@ -0,0 +1,77 @@
+"""
+Per-user pharmacy access scope.
+
+A user's accessible pharmacy ids are resolved once per request:
+- admins and superusers see every pharmacy (no filter is applied);
+- managers see the pharmacies they manage, cached across requests;
+- staff see their assigned pharmacy, read straight off the user row.
+
+The cached manager sets are dropped by the signal handlers in
+pharmacies.signals whenever Pharmacy.managers or a user changes.
+"""
+from django.core.cache import cache
+
+from .models import Pharmacy
+
+
+SCOPE_CACHE_TIMEOUT = 300
+
+
+def _cache_key(user_id):
+    return f"pharmacy-scope:{user_id}"
+
+
+class PharmacyScope:
+    """The set of pharmacies a user may see; `pharmacy_ids` is None for unrestricted users"""
+
+    def __init__(self, pharmacy_ids=None):
+        self.pharmacy_ids = None if pharmacy_ids is None else frozenset(pharmacy_ids)
+
+    @property
+    def is_unrestricted(self):
+        return self.pharmacy_ids is None
+
+    def allows(self, pharmacy_id):
+        return self.is_unrestricted or pharmacy_id in self.pharmacy_ids
+
+    def filter(self, queryset, path='pharmacy'):
+        """
+        Restrict `queryset` to rows whose pharmacy (reached through `path`)
+        is in scope. Use path='' for Pharmacy querysets themselves.
+        """
+        if self.is_unrestricted:
+            return queryset
+        if not self.pharmacy_ids:
+            return queryset.none()
+        lookup = f"{path}__in" if path else 'id__in'
+        return queryset.filter(**{lookup: sorted(self.pharmacy_ids)})
+
+
+def resolve_scope(user):
+    """Build the PharmacyScope for `user`, using the cache for managers"""
+    if user.is_superuser or user.role == 'ADMIN':
+        return PharmacyScope()
+    if user.role == 'MANAGER':
+        pharmacy_ids = cache.get(_cache_key(user.pk))
+        if pharmacy_ids is None:
+            pharmacy_ids = list(
+                Pharmacy.objects.filter(managers=user).values_list('id', flat=True)
+            )
+            cache.set(_cache_key(user.pk), pharmacy_ids, SCOPE_CACHE_TIMEOUT)
+        return PharmacyScope(pharmacy_ids)
+    if user.role == 'STAFF' and user.assigned_pharmacy_id:
+        return PharmacyScope([user.assigned_pharmacy_id])
+    return PharmacyScope([])
+
+
+def get_scope(request):
+    """Return the request's PharmacyScope, resolving it on first use"""
+    scope = getattr(request, '_pharmacy_scope', None)
+    if scope is None:
+        scope = resolve_scope(request.user)
+        request._pharmacy_scope = scope
+    return scope
+
+
+def invalidate_scope(*user_ids):
+    cache.delete_many([_cache_key(user_id) for user_id in user_ids])
@@ -1,3 +1,5 @@
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
 from rest_framework import serializers
 from .models import Pharmacy
 from accounts.models import CustomUser
@@ -9,7 +11,7 @@ class PharmacySerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Pharmacy
-        fields = ['id', 'name', 'location', 'created_by', 'is_superuser_created']
+        fields = ['id', 'name', 'location', 'time_zone', 'created_by', 'is_superuser_created']
         read_only_fields = ['id', 'created_by', 'is_superuser_created']
     
     def create(self, validated_data):
@@ -28,7 +30,7 @@ class PharmacyDetailSerializer(serializers.ModelSerializer):
     class Meta:
         model = Pharmacy
         fields = [
-            'id', 'name', 'location', 'created_by', 
+            'id', 'name', 'location', 'time_zone', 'created_by', 
             'is_superuser_created', 'managers', 'staff_count'
         ]
     
@@ -59,7 +61,7 @@ class PharmacyCreateSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Pharmacy
-        fields = ['name', 'location']
+        fields = ['name', 'location', 'time_zone']
     
     def validate_name(self, value):
         # Check if pharmacy name already exists
@@ -67,6 +69,13 @@ class PharmacyCreateSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("A pharmacy with this name already exists.")
         return value
     
+    def validate_time_zone(self, value):
+        try:
+            ZoneInfo(value)
+        except (ZoneInfoNotFoundError, ValueError):
+            raise serializers.ValidationError("Unknown time zone.")
+        return value
+    
     def create(self, validated_data):
         validated_data['created_by'] = self.context['request'].user
         validated_data['is_superuser_created'] = self.context['request'].user.is_superuser
@@ -78,7 +87,7 @@ class PharmacyUpdateSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Pharmacy
-        fields = ['name', 'location']
+        fields = ['name', 'location', 'time_zone']
     
     def validate_name(self, value):
         # Check if pharmacy name already exists (excluding current instance)
@@ -86,6 +95,13 @@ class PharmacyUpdateSerializer(serializers.ModelSerializer):
             .exclude(id=self.instance.id).exists()):
             raise serializers.ValidationError("A pharmacy with this name already exists.")
         return value
+    
+    def validate_time_zone(self, value):
+        try:
+            ZoneInfo(value)
+        except (ZoneInfoNotFoundError, ValueError):
+            raise serializers.ValidationError("Unknown time zone.")
+        return value
 
 
 class AssignManagerSerializer(serializers.Serializer):
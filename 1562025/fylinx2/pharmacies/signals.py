@@ -0,0 +1,73 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from accounts.authentication import invalidate_pharmacy_tokens, invalidate_tokens
+from fylinx2.response_cache import invalidate, invalidate_on
+from .models import Pharmacy
+from .scope import invalidate_scope
+
+
+# Cached API responses reading pharmacies or users
+invalidate_on(Pharmacy, 'pharmacies')
+invalidate_on(settings.AUTH_USER_MODEL, 'users')
+
+
+def _invalidate(user_ids):
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    invalidate_scope(*user_ids)
+    invalidate_tokens(*user_ids)
+    # Drop again after commit in case a request re-cached the old set
+    # while the change was still uncommitted
+    transaction.on_commit(lambda: (invalidate_scope(*user_ids), invalidate_tokens(*user_ids)))
+
+
+@receiver(post_save, sender=Pharmacy)
+@receiver(post_delete, sender=Pharmacy)
+def pharmacy_changed(sender, **kwargs):
+    # Cached token users carry their assigned pharmacy, and deleting one
+    # unassigns its staff without saving them
+    invalidate_pharmacy_tokens()
+    transaction.on_commit(invalidate_pharmacy_tokens)
+
+
+@receiver(m2m_changed, sender=Pharmacy.managers.through)
+def pharmacy_managers_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        # user.managed_pharmacies.add(...) and friends
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            _invalidate([instance.pk])
+        return
+
+    if action == 'pre_clear':
+        instance._cleared_manager_ids = list(instance.managers.values_list('id', flat=True))
+    elif action == 'post_clear':
+        _invalidate(getattr(instance, '_cleared_manager_ids', []))
+    elif action in ('post_add', 'post_remove'):
+        _invalidate(pk_set or [])
+
+
+@receiver(m2m_changed, sender=Pharmacy.managers.through)
+def pharmacy_managers_cached(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate('pharmacies', 'users')
+
+
+@receiver(pre_delete, sender=Pharmacy)
+def pharmacy_deleting(sender, instance, **kwargs):
+    instance._deleted_manager_ids = list(instance.managers.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Pharmacy)
+def pharmacy_deleted(sender, instance, **kwargs):
+    _invalidate(getattr(instance, '_deleted_manager_ids', []))
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def user_changed(sender, instance, **kwargs):
+    # Role or assigned pharmacy may have changed
+    _invalidate([instance.pk])
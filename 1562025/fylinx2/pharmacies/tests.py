@@ -1,3 +1,33 @@
 from django.test import TestCase
 
-# Create your tests here.
+from fylinx2.testing import EndpointBudgetMixin
+from pharmacies.models import Pharmacy
+
+
+class QueryBudgetTests(EndpointBudgetMixin, TestCase):
+
+    def requests(self, label, admin_only):
+        """(method, path, data, status) for every pharmacies endpoint; `label` keeps created names unique"""
+        pharmacy = self.fixtures['pharmacies'][0]
+        spare = Pharmacy.objects.create(
+            name=f"Budget spare {label}", location='Budget', created_by=self.fixtures['admin']
+        )
+        return [
+            ('GET', 'pharmacies/', None, None),
+            ('POST', 'pharmacies/', {'name': f"Budget new pharmacy {label}", 'location': 'Budget'}, admin_only),
+            ('GET', f"pharmacies/{pharmacy.id}/", None, None),
+            ('PATCH', f"pharmacies/{pharmacy.id}/", {'location': f"Budget {label}"}, admin_only),
+            # Outside a manager's scope
+            ('DELETE', f"pharmacies/{spare.id}/", None, None if admin_only is None else 404),
+            ('POST', f"pharmacies/{pharmacy.id}/assign-managers/", {
+                'manager_ids': [self.fixtures['manager'].id]
+            }, admin_only),
+            ('GET', f"pharmacies/{pharmacy.id}/managers/", None, admin_only),
+            ('GET', f"pharmacies/{pharmacy.id}/stats/", None, None),
+        ]
+
+    def test_admin(self):
+        self.assertRequestsWithinBudget(self.fixtures['admin'], self.requests('admin', None))
+
+    def test_manager(self):
+        self.assertRequestsWithinBudget(self.fixtures['manager'], self.requests('manager', 403))
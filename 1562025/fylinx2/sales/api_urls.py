@@ -6,6 +6,10 @@ urlpatterns = [
     path('sales/', api_views.SaleListCreateAPIView.as_view(), name='api_sale_list_create'),
     path('sales/<int:pk>/', api_views.SaleDetailAPIView.as_view(), name='api_sale_detail'),
     
+    # Streaming export endpoints
+    path('sales/export/', api_views.export_sales, name='api_sales_export'),
+    path('sales/items/export/', api_views.export_sale_items, name='api_sale_items_export'),
+    
     # Sale returns endpoints
     path('sale-returns/', api_views.SaleReturnListCreateAPIView.as_view(), name='api_sale_return_list_create'),
     
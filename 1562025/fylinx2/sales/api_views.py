@@ -1,20 +1,70 @@
 from rest_framework import generics, status, permissions
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
-from django.db.models import Sum, Count, Q
-from django.utils import timezone
+from django.db.models import Sum, Count, Q, F, prefetch_related_objects
 from datetime import datetime, timedelta
 
-from .models import Sale, SaleReturn
+from .models import Sale, SaleItem, SaleReturn, DailySalesRollup
+from .lean import sale_dicts, sale_mapper
+from .returns import ReturnExceeded
+from .rollups import summary_totals
+from .periods import (
+    DATE_TRUNCATIONS, GRANULARITIES, filter_created_between,
+    get_timezone, local_today, pharmacy_timezone, truncate_datetime
+)
+from pharmacies.models import Pharmacy
+from pharmacies.scope import get_scope
+from inventory.stock import StockShortfall
+from fylinx2.pagination import KeysetPagination
+from fylinx2.queries import query_budget
+from fylinx2.response_cache import cache_response
+from fylinx2.exports import EXPORT_FORMATS, get_export_format, stream_export
 from .serializers import (
     SaleSerializer, SaleCreateSerializer,
     SaleReturnSerializer, SaleReturnCreateSerializer
 )
 
 
+def filter_sales(request, queryset, prefix=''):
+    """
+    Apply role scoping and the pharmacy_id / start_date / end_date query
+    params to a Sale queryset, or to one reaching Sale through `prefix`
+    (e.g. 'sale__' for SaleItem).
+    """
+    pharmacy_id = request.query_params.get('pharmacy_id')
+    start_date = request.query_params.get('start_date')
+    end_date = request.query_params.get('end_date')
+    
+    queryset = get_scope(request).filter(queryset, path=f'{prefix}pharmacy')
+    
+    # Filter by pharmacy if specified
+    if pharmacy_id:
+        queryset = queryset.filter(**{f'{prefix}pharmacy_id': pharmacy_id})
+    
+    # Filter by date range (half-open on created_at so the index is used)
+    if start_date:
+        try:
+            start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
+            queryset = filter_created_between(queryset, start_date=start_date, field=f'{prefix}created_at')
+        except ValueError:
+            pass
+    
+    if end_date:
+        try:
+            end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
+            queryset = filter_created_between(queryset, end_date=end_date, field=f'{prefix}created_at')
+        except ValueError:
+            pass
+    
+    return queryset
+
+
 class SaleListCreateAPIView(generics.ListCreateAPIView):
     """API endpoint for listing and creating sales"""
+    # Newest first by (created_at, id); deep pages cost the same as the first
+    pagination_class = KeysetPagination
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = {'GET': 4, 'POST': 21}
     
     def get_serializer_class(self):
         if self.request.method == 'POST':
@@ -22,49 +72,27 @@ class SaleListCreateAPIView(generics.ListCreateAPIView):
         return SaleSerializer
     
     def get_queryset(self):
-        user = self.request.user
-        pharmacy_id = self.request.query_params.get('pharmacy_id')
-        start_date = self.request.query_params.get('start_date')
-        end_date = self.request.query_params.get('end_date')
-        
-        if user.is_superuser or user.role == 'ADMIN':
-            queryset = Sale.objects.all()
-        elif user.role == 'MANAGER':
-            managed_pharmacy_ids = user.managed_pharmacies.values_list('id', flat=True)
-            queryset = Sale.objects.filter(pharmacy_id__in=managed_pharmacy_ids)
-        elif user.role == 'STAFF':
-            if user.assigned_pharmacy:
-                queryset = Sale.objects.filter(pharmacy=user.assigned_pharmacy)
-            else:
-                queryset = Sale.objects.none()
-        else:
-            queryset = Sale.objects.none()
-        
-        # Filter by pharmacy if specified
-        if pharmacy_id:
-            queryset = queryset.filter(pharmacy_id=pharmacy_id)
-        
-        # Filter by date range
-        if start_date:
-            try:
-                start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
-                queryset = queryset.filter(created_at__date__gte=start_date)
-            except ValueError:
-                pass
-        
-        if end_date:
-            try:
-                end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
-                queryset = queryset.filter(created_at__date__lte=end_date)
-            except ValueError:
-                pass
-        
+        queryset = filter_sales(self.request, Sale.objects.all())
         return queryset.select_related('pharmacy', 'created_by').prefetch_related('items__inventory__medicine')
     
+    def list(self, request, *args, **kwargs):
+        # values() fast path; same JSON as SaleSerializer
+        rows = self.paginate_queryset(sale_mapper.values(self.get_queryset()))
+        return self.get_paginated_response(sale_dicts(rows, self.get_serializer_context()))
+    
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
-            sale = serializer.save()
+            try:
+                sale = serializer.save()
+            except StockShortfall as exc:
+                # Stock moved between validation and the decrement, or the
+                # unexpired batches could not cover a medicine line
+                return Response({
+                    'success': False,
+                    'errors': {'items': exc.shortfalls}
+                }, status=status.HTTP_400_BAD_REQUEST)
+            prefetch_related_objects([sale], 'items__inventory__medicine')
             return Response({
                 'success': True,
                 'message': 'Sale created successfully',
@@ -81,25 +109,19 @@ class SaleDetailAPIView(generics.RetrieveAPIView):
     """API endpoint for retrieving sale details"""
     serializer_class = SaleSerializer
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = {'GET': 6}
     
     def get_queryset(self):
-        user = self.request.user
-        
-        if user.is_superuser or user.role == 'ADMIN':
-            return Sale.objects.all()
-        elif user.role == 'MANAGER':
-            managed_pharmacy_ids = user.managed_pharmacies.values_list('id', flat=True)
-            return Sale.objects.filter(pharmacy_id__in=managed_pharmacy_ids)
-        elif user.role == 'STAFF':
-            if user.assigned_pharmacy:
-                return Sale.objects.filter(pharmacy=user.assigned_pharmacy)
-        
-        return Sale.objects.none()
+        return get_scope(self.request).filter(Sale.objects.all()).select_related(
+            'pharmacy', 'created_by'
+        ).prefetch_related('items__inventory__medicine')
 
 
 class SaleReturnListCreateAPIView(generics.ListCreateAPIView):
     """API endpoint for listing and creating sale returns"""
+    pagination_class = KeysetPagination
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = {'GET': 7, 'POST': 23}
     
     def get_serializer_class(self):
         if self.request.method == 'POST':
@@ -107,27 +129,26 @@ class SaleReturnListCreateAPIView(generics.ListCreateAPIView):
         return SaleReturnSerializer
     
     def get_queryset(self):
-        user = self.request.user
-        
-        if user.is_superuser or user.role == 'ADMIN':
-            queryset = SaleReturn.objects.all()
-        elif user.role == 'MANAGER':
-            managed_pharmacy_ids = user.managed_pharmacies.values_list('id', flat=True)
-            queryset = SaleReturn.objects.filter(original_sale__pharmacy_id__in=managed_pharmacy_ids)
-        elif user.role == 'STAFF':
-            if user.assigned_pharmacy:
-                queryset = SaleReturn.objects.filter(original_sale__pharmacy=user.assigned_pharmacy)
-            else:
-                queryset = SaleReturn.objects.none()
-        else:
-            queryset = SaleReturn.objects.none()
+        queryset = get_scope(self.request).filter(
+            SaleReturn.objects.all(), path='original_sale__pharmacy'
+        )
         
-        return queryset.select_related('original_sale', 'created_by')
+        return queryset.select_related('original_sale', 'created_by').prefetch_related(
+            'items__sale_item__inventory__medicine'
+        )
     
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
-            sale_return = serializer.save()
+            try:
+                sale_return = serializer.save()
+            except ReturnExceeded as exc:
+                # Another return of the same lines committed after validation
+                return Response({
+                    'success': False,
+                    'errors': {'items': exc.exceeded}
+                }, status=status.HTTP_400_BAD_REQUEST)
+            prefetch_related_objects([sale_return], 'items__sale_item__inventory__medicine')
             return Response({
                 'success': True,
                 'message': 'Sale return created successfully',
@@ -140,34 +161,112 @@ class SaleReturnListCreateAPIView(generics.ListCreateAPIView):
         }, status=status.HTTP_400_BAD_REQUEST)
 
 
+def _unsupported_format_response():
+    return Response({
+        'success': False,
+        'message': f"file_format must be one of: {', '.join(EXPORT_FORMATS)}"
+    }, status=status.HTTP_400_BAD_REQUEST)
+
+
+@query_budget(3)
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def export_sales(request):
+    """Stream the user's accessible sales as CSV or NDJSON, oldest first"""
+    file_format = get_export_format(request)
+    if file_format is None:
+        return _unsupported_format_response()
+    
+    sales = filter_sales(request, Sale.objects.all()).order_by('created_at', 'id')
+    return stream_export(request, sales, {
+        'id': 'id',
+        'sale_number': 'sale_number',
+        'pharmacy_id': 'pharmacy_id',
+        'pharmacy_name': 'pharmacy__name',
+        'customer_name': 'customer_name',
+        'customer_phone': 'customer_phone',
+        'payment_method': 'payment_method',
+        'subtotal': 'subtotal',
+        'discount': 'discount',
+        'tax': 'tax',
+        'total_amount': 'total_amount',
+        'amount_paid': 'amount_paid',
+        'change_amount': 'change_amount',
+        'created_by': 'created_by__username',
+        'created_at': 'created_at',
+    }, 'sales', file_format)
+
+
+@query_budget(3)
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def export_sale_items(request):
+    """Stream the line items of the user's accessible sales as CSV or NDJSON"""
+    file_format = get_export_format(request)
+    if file_format is None:
+        return _unsupported_format_response()
+    
+    items = filter_sales(request, SaleItem.objects.all(), prefix='sale__').order_by('sale_id', 'id')
+    return stream_export(request, items, {
+        'id': 'id',
+        'sale_id': 'sale_id',
+        'sale_number': 'sale__sale_number',
+        'sale_created_at': 'sale__created_at',
+        'pharmacy_id': 'sale__pharmacy_id',
+        'inventory_id': 'inventory_id',
+        'medicine_name': 'inventory__medicine__name',
+        'batch_number': 'inventory__batch_number',
+        'quantity': 'quantity',
+        'unit_price': 'unit_price',
+        'total_price': 'total_price',
+    }, 'sale-items', file_format)
+
+
+@query_budget(6)
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
 def sales_analytics(request):
-    """Get sales analytics for user's accessible pharmacies"""
+    """
+    Get sales analytics for user's accessible pharmacies.
+    
+    Totals, the payment method breakdown and day/week/month/year buckets
+    read only DailySalesRollup. Two figures are finer than the rollup and
+    still read the period's raw sales, through the (pharmacy, created_at)
+    index: top_selling_medicines (the rollup is not kept per medicine) and
+    granularity=hour (it is not kept per hour). Their cost grows with the
+    sales in the period, not with the whole table.
+    """
     user = request.user
     pharmacy_id = request.query_params.get('pharmacy_id')
     period = request.query_params.get('period', 'month')  # day, week, month, year
     
-    # Get base queryset based on user permissions
-    if user.is_superuser or user.role == 'ADMIN':
-        sales_queryset = Sale.objects.all()
-    elif user.role == 'MANAGER':
-        managed_pharmacy_ids = user.managed_pharmacies.values_list('id', flat=True)
-        sales_queryset = Sale.objects.filter(pharmacy_id__in=managed_pharmacy_ids)
-    elif user.role == 'STAFF':
-        if user.assigned_pharmacy:
-            sales_queryset = Sale.objects.filter(pharmacy=user.assigned_pharmacy)
-        else:
-            sales_queryset = Sale.objects.none()
-    else:
-        sales_queryset = Sale.objects.none()
+    # Get base querysets based on user permissions
+    scope = get_scope(request)
+    sales_queryset = scope.filter(Sale.objects.all())
+    rollups = scope.filter(DailySalesRollup.objects.all())
     
     # Filter by pharmacy if specified
     if pharmacy_id:
         sales_queryset = sales_queryset.filter(pharmacy_id=pharmacy_id)
+        rollups = rollups.filter(pharmacy_id=pharmacy_id)
+    
+    granularity = request.query_params.get('granularity', 'day')  # hour, day, week, month
+    if granularity not in GRANULARITIES:
+        granularity = 'day'
+    
+    # Local days are taken in the pharmacy's time zone when a single
+    # pharmacy is being looked at
+    if pharmacy_id:
+        tz = get_timezone(
+            Pharmacy.objects.filter(id=pharmacy_id).values_list('time_zone', flat=True).first()
+        )
+    elif user.role == 'STAFF' and user.assigned_pharmacy_id:
+        tz = pharmacy_timezone(user.assigned_pharmacy)
+    else:
+        tz = get_timezone()
     
     # Calculate date range based on period
-    today = timezone.now().date()
+    today = local_today(tz)
     if period == 'day':
         start_date = today
     elif period == 'week':
@@ -179,21 +278,21 @@ def sales_analytics(request):
     else:
         start_date = today - timedelta(days=30)
     
-    # Filter sales by date range
-    period_sales = sales_queryset.filter(created_at__date__gte=start_date)
+    # Totals come from the daily rollup, never from the raw sales table
+    period_rollups = rollups.filter(date__gte=start_date, date__lte=today)
+    totals = period_rollups.aggregate(
+        total_sales=Sum('sale_count'),
+        total_revenue=Sum('revenue')
+    )
     
-    # Calculate analytics
     analytics = {
-        'total_sales': period_sales.count(),
-        'total_revenue': period_sales.aggregate(
-            total=Sum('total_amount')
-        )['total'] or 0,
-        'average_sale_amount': period_sales.aggregate(
-            avg=Sum('total_amount')
-        )['avg'] or 0,
+        'total_sales': totals['total_sales'] or 0,
+        'total_revenue': totals['total_revenue'] or 0,
+        'average_sale_amount': 0,
         'payment_method_breakdown': {},
         'top_selling_medicines': [],
-        'daily_sales': []
+        'daily_sales': [],
+        'sales_over_time': []
     }
     
     # Calculate average
@@ -201,18 +300,19 @@ def sales_analytics(request):
         analytics['average_sale_amount'] = analytics['total_revenue'] / analytics['total_sales']
     
     # Payment method breakdown
-    payment_methods = period_sales.values('payment_method').annotate(
-        count=Count('id'),
-        total=Sum('total_amount')
-    )
+    payment_methods = period_rollups.values('payment_method').annotate(
+        count=Sum('sale_count'),
+        total=Sum('revenue')
+    ).filter(count__gt=0).order_by()
     for method in payment_methods:
         analytics['payment_method_breakdown'][method['payment_method']] = {
             'count': method['count'],
             'total': method['total']
         }
     
-    # Top selling medicines (by quantity)
-    from django.db.models import F
+    # Top selling medicines (by quantity); the rollup is not kept per
+    # medicine, so this is one of the two reads of the period's raw sales
+    period_sales = filter_created_between(sales_queryset, start_date, today, tz)
     top_medicines = period_sales.values(
         'items__inventory__medicine__name'
     ).annotate(
@@ -223,66 +323,61 @@ def sales_analytics(request):
     analytics['top_selling_medicines'] = list(top_medicines)
     
     # Daily sales for the period
-    daily_sales = period_sales.extra(
-        select={'day': 'date(created_at)'}
-    ).values('day').annotate(
-        count=Count('id'),
-        total=Sum('total_amount')
-    ).order_by('day')
+    daily_sales = period_rollups.values('date').annotate(
+        count=Sum('sale_count'),
+        total=Sum('revenue')
+    ).filter(count__gt=0).order_by('date')
     
-    analytics['daily_sales'] = list(daily_sales)
+    analytics['daily_sales'] = [
+        {'day': day['date'], 'count': day['count'], 'total': day['total']}
+        for day in daily_sales
+    ]
+    
+    # Sales bucketed at the requested granularity
+    if granularity == 'day':
+        analytics['sales_over_time'] = [
+            {'period': day['day'], 'count': day['count'], 'total': day['total']}
+            for day in analytics['daily_sales']
+        ]
+    elif granularity == 'hour':
+        # Hours are finer than the rollup, so bucket the period's raw sales
+        hourly_sales = period_sales.annotate(
+            period=truncate_datetime('hour', tz=tz)
+        ).values('period').annotate(
+            count=Count('id'),
+            total=Sum('total_amount')
+        ).order_by('period')
+        analytics['sales_over_time'] = list(hourly_sales)
+    else:
+        bucketed_sales = period_rollups.annotate(
+            period=DATE_TRUNCATIONS[granularity]('date')
+        ).values('period').annotate(
+            count=Sum('sale_count'),
+            total=Sum('revenue')
+        ).filter(count__gt=0).order_by('period')
+        analytics['sales_over_time'] = list(bucketed_sales)
     
     return Response({
         'success': True,
         'period': period,
+        'granularity': granularity,
         'start_date': start_date,
         'end_date': today,
         'analytics': analytics
     })
 
 
+@query_budget(3)
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
+@cache_response('sales')
 def sales_summary(request):
     """Get sales summary for dashboard"""
-    user = request.user
-    
     # Get base queryset based on user permissions
-    if user.is_superuser or user.role == 'ADMIN':
-        sales_queryset = Sale.objects.all()
-    elif user.role == 'MANAGER':
-        managed_pharmacy_ids = user.managed_pharmacies.values_list('id', flat=True)
-        sales_queryset = Sale.objects.filter(pharmacy_id__in=managed_pharmacy_ids)
-    elif user.role == 'STAFF':
-        if user.assigned_pharmacy:
-            sales_queryset = Sale.objects.filter(pharmacy=user.assigned_pharmacy)
-        else:
-            sales_queryset = Sale.objects.none()
-    else:
-        sales_queryset = Sale.objects.none()
-    
-    today = timezone.now().date()
-    
-    summary = {
-        'today_sales': sales_queryset.filter(created_at__date=today).count(),
-        'today_revenue': sales_queryset.filter(created_at__date=today).aggregate(
-            total=Sum('total_amount')
-        )['total'] or 0,
-        'month_sales': sales_queryset.filter(
-            created_at__date__gte=today.replace(day=1)
-        ).count(),
-        'month_revenue': sales_queryset.filter(
-            created_at__date__gte=today.replace(day=1)
-        ).aggregate(
-            total=Sum('total_amount')
-        )['total'] or 0,
-        'total_sales': sales_queryset.count(),
-        'total_revenue': sales_queryset.aggregate(
-            total=Sum('total_amount')
-        )['total'] or 0,
-    }
+    rollups = get_scope(request).filter(DailySalesRollup.objects.all())
+    summary = summary_totals(rollups, local_today())
     
     return Response({
         'success': True,
         'summary': summary
-    })
\ No newline at end of file
+    })
@@ -0,0 +1,63 @@
+"""
+values()-based mirrors of the sales read serializers, for list pages.
+
+Each mapper produces exactly what the serializer of the same name in
+sales.serializers produces; keep the two in step when fields change.
+"""
+from collections import defaultdict
+
+from fylinx2.lean import DateTimeField, Field, ValuesMapper, as_decimal
+from fylinx2.timing import timed
+from .models import SaleItem
+
+
+money = as_decimal(10, 2)
+
+# Mirrors SaleItemSerializer
+sale_item_mapper = ValuesMapper({
+    'id': Field('id'),
+    'inventory': Field('inventory_id'),
+    'medicine_name': Field('inventory__medicine__name'),
+    'batch_number': Field('inventory__batch_number'),
+    'quantity': Field('quantity'),
+    'unit_price': Field('unit_price', money),
+    'total_price': Field('total_price', money),
+})
+
+# Mirrors SaleSerializer except `items`, which sale_dicts() adds
+sale_mapper = ValuesMapper({
+    'id': Field('id'),
+    'sale_number': Field('sale_number'),
+    'pharmacy': Field('pharmacy_id'),
+    'pharmacy_name': Field('pharmacy__name'),
+    'customer_name': Field('customer_name'),
+    'customer_phone': Field('customer_phone'),
+    'payment_method': Field('payment_method'),
+    'subtotal': Field('subtotal', money),
+    'discount': Field('discount', money),
+    'tax': Field('tax', money),
+    'total_amount': Field('total_amount', money),
+    'amount_paid': Field('amount_paid', money),
+    'change_amount': Field('change_amount', money),
+    'notes': Field('notes'),
+    'created_by_name': Field('created_by__username'),
+    'created_at': DateTimeField('created_at'),
+    'updated_at': DateTimeField('updated_at'),
+})
+
+
+@timed('serialize')
+def sale_dicts(rows, context=None):
+    """SaleSerializer output for a page of sale_mapper rows; items come from one query"""
+    sales = sale_mapper.many(rows, context)
+    items = defaultdict(list)
+    if sales:
+        item_rows = sale_item_mapper.values(
+            SaleItem.objects.filter(sale_id__in=[sale['id'] for sale in sales]).order_by('id'),
+            'sale_id'
+        )
+        for row in item_rows:
+            items[row['sale_id']].append(sale_item_mapper(row, context))
+    for sale in sales:
+        sale['items'] = items[sale['id']]
+    return sales
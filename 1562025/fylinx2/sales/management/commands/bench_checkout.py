@@ -0,0 +1,107 @@
+import time
+from datetime import timedelta
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from accounts.models import CustomUser
+from inventory.allocation import allocate_fefo
+from inventory.expiry import request_today
+from inventory.models import Inventory, Medicine
+from pharmacies.models import Pharmacy
+from sales.serializers import SaleCreateSerializer
+
+
+class Command(BaseCommand):
+    help = "Report statement count and latency of SaleCreateSerializer for several basket sizes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1,10,50,200')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument(
+            '--fefo', action='store_true',
+            help="Send medicine lines and let the server allocate batches first-expiry-first-out"
+        )
+        parser.add_argument('--batches-per-medicine', type=int, default=3)
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        repeat = options['repeat']
+
+        # Everything runs in one transaction that is rolled back at the end
+        with transaction.atomic():
+            request = SimpleNamespace(user=self._fixtures(max(sizes), options['batches_per_medicine']))
+            inventory_ids = list(
+                Inventory.objects.filter(batch_number__startswith='BENCH-').values_list('id', flat=True)
+            )
+            medicine_ids = list(
+                Medicine.objects.filter(manufacturer='Bench').order_by('id').values_list('id', flat=True)
+            )
+
+            self.stdout.write(f"{'lines':>6} {'statements':>11} {'avg ms':>9} {'alloc ms':>9}")
+            for size in sizes:
+                if options['fefo']:
+                    # Each line needs more than a near-expiry batch holds
+                    lines = [
+                        {'medicine': medicine_id, 'quantity': 150}
+                        for medicine_id in medicine_ids[:size]
+                    ]
+                else:
+                    lines = [
+                        {'inventory': inventory_id, 'quantity': 1, 'unit_price': '2.50'}
+                        for inventory_id in inventory_ids[:size]
+                    ]
+                payload = {
+                    'pharmacy': self.pharmacy.id,
+                    'payment_method': 'CASH',
+                    'amount_paid': '100000.00',
+                    'items': lines,
+                }
+                statements = 0
+                elapsed = 0.0
+                allocating = 0.0
+                for _ in range(repeat):
+                    if options['fefo']:
+                        started = time.perf_counter()
+                        allocate_fefo(self.pharmacy.id, lines, request_today(request))
+                        allocating += time.perf_counter() - started
+                    serializer = SaleCreateSerializer(data=payload, context={'request': request})
+                    serializer.is_valid(raise_exception=True)
+                    with CaptureQueriesContext(connection) as queries:
+                        started = time.perf_counter()
+                        serializer.save()
+                        elapsed += time.perf_counter() - started
+                    statements = len(queries)
+                allocation = f"{allocating / repeat * 1000:.2f}" if options['fefo'] else '-'
+                self.stdout.write(
+                    f"{size:>6} {statements:>11} {elapsed / repeat * 1000:>9.2f} {allocation:>9}"
+                )
+
+            transaction.set_rollback(True)
+
+    def _fixtures(self, lines, batches_per_medicine):
+        user = CustomUser.objects.create_user(username='bench-checkout', role='ADMIN')
+        self.pharmacy = Pharmacy.objects.create(name='Bench pharmacy', location='Bench', created_by=user)
+        today = timezone.now().date()
+        Medicine.objects.bulk_create([
+            Medicine(name=f"Bench medicine {n}", manufacturer='Bench', dosage_form='tablet', strength='1mg')
+            for n in range(lines)
+        ])
+        medicines = Medicine.objects.filter(manufacturer='Bench', name__startswith='Bench medicine ')
+        Inventory.objects.bulk_create([
+            Inventory(
+                pharmacy=self.pharmacy, medicine=medicine, batch_number=f"BENCH-{n}-{batch}",
+                # Small near-expiry batches in front of one large batch
+                quantity=100000 if batch == 0 else 100,
+                stock_deficit=10 - (100000 if batch == 0 else 100),
+                unit_price='1.00', selling_price='2.50',
+                expiry_date=today + timedelta(days=365 - batch), manufacture_date=today - timedelta(days=30),
+                supplier='Bench', created_by=user
+            )
+            for n, medicine in enumerate(medicines)
+            for batch in range(batches_per_medicine)
+        ])
+        return user
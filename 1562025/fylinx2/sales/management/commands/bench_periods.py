@@ -0,0 +1,109 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from accounts.models import CustomUser
+from pharmacies.models import Pharmacy
+from sales.models import Sale
+from sales.periods import filter_created_between, local_today, pharmacy_timezone, truncate_datetime
+
+
+WRITE_BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare date filters that cast created_at (created_at__date) with the half-open "
+        "ranges of sales.periods, and time the analytics buckets, on many sales"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=200000, help="Sales spread over all pharmacies")
+        parser.add_argument('--pharmacies', type=int, default=4)
+        parser.add_argument('--days', type=int, default=365, help="Days of history the sales cover")
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--time-zone', default='Africa/Nairobi', help="Time zone of the measured pharmacy")
+        parser.add_argument('--explain', action='store_true', help="Print each filter's query plan")
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+
+        # Everything runs in one transaction that is rolled back at the end
+        with transaction.atomic():
+            started = time.perf_counter()
+            pharmacy = self._fixtures(options['rows'], options['pharmacies'], options['days'], options['time_zone'])
+            self.stdout.write(
+                f"{options['rows']} sales over {options['days']} days in {options['pharmacies']} pharmacies "
+                f"({connection.vendor}), created in {time.perf_counter() - started:.1f}s"
+            )
+            tz = pharmacy_timezone(pharmacy)
+            today = local_today(tz)
+            sales = Sale.objects.filter(pharmacy=pharmacy)
+
+            self.stdout.write(f"{'window':>7} {'rows':>8} {'cast ms':>9} {'range ms':>9}")
+            for label, days in (('day', 1), ('week', 7), ('month', 30), ('year', 365)):
+                start = today - timedelta(days=days - 1)
+                cast = sales.filter(created_at__date__gte=start, created_at__date__lte=today)
+                ranged = filter_created_between(sales, start, today, tz)
+                rows, cast_ms = self._time(lambda: cast.count(), repeat)
+                ranged_rows, range_ms = self._time(lambda: ranged.count(), repeat)
+                # The cast compares UTC dates, so it disagrees at the ends of
+                # the window unless the pharmacy keeps UTC
+                self.stdout.write(f"{label:>7} {ranged_rows:>8} {cast_ms:>9.2f} {range_ms:>9.2f}"
+                                  + ('' if rows == ranged_rows else f"  (cast counts {rows})"))
+                if options['explain']:
+                    self.stdout.write(f"  cast:  {' | '.join(cast.explain().splitlines())}")
+                    self.stdout.write(f"  range: {' | '.join(ranged.explain().splitlines())}")
+
+            self.stdout.write(f"{'buckets':>7} {'groups':>8} {'ms':>9}")
+            month = filter_created_between(sales, today - timedelta(days=29), today, tz)
+            for granularity in ('hour', 'day'):
+                buckets = month.annotate(
+                    bucket=truncate_datetime(granularity, tz=tz)
+                ).values('bucket').annotate(count=Count('id')).order_by('bucket')
+                # all() each time; an evaluated queryset would serve its cache
+                groups, elapsed = self._time(lambda: len(buckets.all()), repeat)
+                self.stdout.write(f"{granularity:>7} {groups:>8} {elapsed:>9.2f}")
+
+            transaction.set_rollback(True)
+
+    def _time(self, query, repeat):
+        result = query()
+        started = time.perf_counter()
+        for _ in range(repeat):
+            query()
+        return result, (time.perf_counter() - started) / repeat * 1000
+
+    def _fixtures(self, rows, pharmacies, days, time_zone):
+        user = CustomUser.objects.create_user(username='bench-periods', role='ADMIN')
+        pharmacy_ids = [
+            Pharmacy.objects.create(
+                name=f"Bench pharmacy {n}", location='Bench', created_by=user,
+                time_zone=time_zone if n == 0 else 'UTC'
+            ).id
+            for n in range(pharmacies)
+        ]
+        for start in range(0, rows, WRITE_BATCH_SIZE):
+            Sale.objects.bulk_create([
+                Sale(
+                    pharmacy_id=pharmacy_ids[n % pharmacies], sale_number=f"BENCH-PERIOD-{n}",
+                    subtotal='10.00', total_amount='10.00', amount_paid='10.00', created_by=user
+                )
+                for n in range(start, min(start + WRITE_BATCH_SIZE, rows))
+            ])
+
+        # bulk_create stamps every sale with now; spread them evenly over the
+        # last `days` days, one UPDATE per hour over a contiguous id range
+        ids = Sale.objects.filter(sale_number__startswith='BENCH-PERIOD-').order_by('id').values_list('id', flat=True)
+        first_id, last_id = ids.first(), ids.last()
+        hours = days * 24
+        hour = timezone.now().replace(minute=30, second=0, microsecond=0)
+        for offset in range(hours):
+            low = first_id + (last_id - first_id + 1) * offset // hours
+            high = first_id + (last_id - first_id + 1) * (offset + 1) // hours
+            Sale.objects.filter(id__gte=low, id__lt=high).update(created_at=hour - timedelta(hours=offset))
+        return Pharmacy.objects.get(pk=pharmacy_ids[0])
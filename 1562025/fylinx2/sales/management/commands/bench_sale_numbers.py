@@ -0,0 +1,68 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from sales import sequences
+from sales.models import NumberSequence
+
+
+class Command(BaseCommand):
+    help = "Allocate document numbers from many concurrent checkouts and check for duplicates"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--checkouts', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, default=500)
+        parser.add_argument('--prefix', default='BENCH')
+        parser.add_argument('--pharmacy-id', type=int, default=None)
+
+    def handle(self, *args, **options):
+        checkouts = options['checkouts']
+        concurrency = min(options['concurrency'], checkouts)
+        prefix = options['prefix']
+        pharmacy_id = options['pharmacy_id']
+
+        sequences.reset_cache()
+        NumberSequence.objects.filter(key__startswith=f"{prefix}:").delete()
+
+        start_gate = threading.Barrier(concurrency)
+
+        def checkout(_):
+            try:
+                if concurrency > 1:
+                    start_gate.wait(timeout=60)
+                started = time.perf_counter()
+                with transaction.atomic():
+                    number = sequences.next_document_number(prefix, pharmacy_id)
+                return number, time.perf_counter() - started
+            finally:
+                connection.close()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(checkout, range(checkouts)))
+        elapsed = time.perf_counter() - started
+
+        numbers = [number for number, _ in results]
+        latencies = sorted(latency for _, latency in results)
+        duplicates = len(numbers) - len(set(numbers))
+        reserved = sum(
+            NumberSequence.objects.filter(key__startswith=f"{prefix}:").values_list('last_value', flat=True)
+        )
+        round_trips = reserved // sequences._block_size() + (1 if reserved % sequences._block_size() else 0)
+
+        self.stdout.write(f"checkouts:        {checkouts} ({concurrency} concurrent)")
+        self.stdout.write(f"elapsed:          {elapsed:.3f}s ({checkouts / elapsed:.0f}/s)")
+        self.stdout.write(f"p50 / p99:        {latencies[len(latencies) // 2] * 1000:.2f}ms / "
+                          f"{latencies[int(len(latencies) * 0.99) - 1] * 1000:.2f}ms")
+        self.stdout.write(f"block reservations: {round_trips}")
+        self.stdout.write(f"duplicates:       {duplicates}")
+
+        NumberSequence.objects.filter(key__startswith=f"{prefix}:").delete()
+        sequences.reset_cache()
+
+        if duplicates:
+            raise CommandError(f"{duplicates} duplicate numbers allocated")
+        self.stdout.write(self.style.SUCCESS("No duplicate numbers allocated"))
@@ -0,0 +1,136 @@
+import time
+from datetime import timedelta
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from accounts.models import CustomUser
+from inventory.lean import inventory_mapper, stock_movement_mapper
+from inventory.models import Inventory, Medicine, StockMovement
+from inventory.serializers import InventorySerializer, StockMovementSerializer
+from pharmacies.models import Pharmacy
+from sales.lean import sale_dicts, sale_mapper
+from sales.models import Sale, SaleItem
+from sales.serializers import SaleSerializer
+
+
+class Command(BaseCommand):
+    help = "Compare rows per second of the DRF list serializers and the values() fast path, and check their JSON matches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=2000, help="Rows per list")
+        parser.add_argument('--items-per-sale', type=int, default=3)
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        renderer = JSONRenderer()
+
+        # Everything runs in one transaction that is rolled back at the end
+        with transaction.atomic():
+            user = self._fixtures(rows, options['items_per_sale'])
+            context = {'request': SimpleNamespace(user=user)}
+            cases = [
+                (
+                    'inventory',
+                    lambda: InventorySerializer(
+                        Inventory.objects.select_related('medicine', 'pharmacy').order_by('id'),
+                        many=True, context=context
+                    ).data,
+                    lambda: inventory_mapper.many(
+                        inventory_mapper.values(Inventory.objects.order_by('id')), context
+                    ),
+                ),
+                (
+                    'stock movements',
+                    lambda: StockMovementSerializer(
+                        StockMovement.objects.select_related(
+                            'inventory__medicine', 'inventory__pharmacy', 'created_by'
+                        ).order_by('id'),
+                        many=True, context=context
+                    ).data,
+                    lambda: stock_movement_mapper.many(
+                        stock_movement_mapper.values(StockMovement.objects.order_by('id')), context
+                    ),
+                ),
+                (
+                    'sales',
+                    lambda: SaleSerializer(
+                        Sale.objects.select_related('pharmacy', 'created_by').prefetch_related(
+                            'items__inventory__medicine'
+                        ).order_by('id'),
+                        many=True, context=context
+                    ).data,
+                    lambda: sale_dicts(sale_mapper.values(Sale.objects.order_by('id')), context),
+                ),
+            ]
+
+            self.stdout.write(f"{'list':<16} {'rows':>6} {'drf rows/s':>11} {'lean rows/s':>12} {'speedup':>8}")
+            for name, drf, lean in cases:
+                drf_json, drf_seconds = self._time(lambda: renderer.render(drf()), options['repeat'])
+                lean_json, lean_seconds = self._time(lambda: renderer.render(lean()), options['repeat'])
+                if drf_json != lean_json:
+                    raise CommandError(f"{name}: values() path JSON differs from the serializer's")
+                self.stdout.write(
+                    f"{name:<16} {rows:>6} {rows / drf_seconds:>11.0f} {rows / lean_seconds:>12.0f} "
+                    f"{drf_seconds / lean_seconds:>7.1f}x"
+                )
+
+            transaction.set_rollback(True)
+
+    def _time(self, build, repeat):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            output = build()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return output, best
+
+    def _fixtures(self, rows, items_per_sale):
+        user = CustomUser.objects.create_user(username='bench-serializers', role='ADMIN')
+        pharmacy = Pharmacy.objects.create(name='Bench pharmacy', location='Bench', created_by=user)
+        today = timezone.now().date()
+        Medicine.objects.bulk_create([
+            Medicine(name=f"Bench medicine {n}", manufacturer='Bench', dosage_form='tablet', strength='1mg')
+            for n in range(rows)
+        ])
+        medicines = Medicine.objects.filter(manufacturer='Bench', name__startswith='Bench medicine ')
+        Inventory.objects.bulk_create([
+            Inventory(
+                pharmacy=pharmacy, medicine=medicine, batch_number=f"BENCH-{n}",
+                quantity=n % 20, stock_deficit=10 - n % 20,
+                unit_price='1.00', selling_price='2.50',
+                expiry_date=today + timedelta(days=n % 400 - 30), manufacture_date=today - timedelta(days=30),
+                supplier='Bench', created_by=user
+            )
+            for n, medicine in enumerate(medicines)
+        ])
+        inventories = list(Inventory.objects.filter(pharmacy=pharmacy).order_by('id'))
+        StockMovement.objects.bulk_create([
+            StockMovement(
+                inventory=inventory, movement_type='IN', quantity=inventory.quantity,
+                reference_number=f"BENCH-{inventory.id}", created_by=user
+            )
+            for inventory in inventories
+        ])
+        Sale.objects.bulk_create([
+            Sale(
+                pharmacy=pharmacy, sale_number=f"BENCH-SALE-{n}", subtotal='7.50', total_amount='7.50',
+                amount_paid='10.00', change_amount='2.50', created_by=user
+            )
+            for n in range(rows)
+        ])
+        sales = Sale.objects.filter(sale_number__startswith='BENCH-SALE-').order_by('id')
+        SaleItem.objects.bulk_create([
+            SaleItem(
+                sale=sale, inventory=inventories[(n + line) % len(inventories)],
+                quantity=1, unit_price='2.50', total_price='2.50'
+            )
+            for n, sale in enumerate(sales)
+            for line in range(items_per_sale)
+        ])
+        return user
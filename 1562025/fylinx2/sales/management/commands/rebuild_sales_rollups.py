@@ -0,0 +1,26 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from sales.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = "Rebuild the DailySalesRollup table from sales and returns history"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--since',
+            help="Only rebuild days on or after this date (YYYY-MM-DD); default is all history"
+        )
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            try:
+                since = datetime.strptime(options['since'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError("--since must be a date in YYYY-MM-DD format")
+
+        rows = rebuild(since)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} daily sales rollup rows"))
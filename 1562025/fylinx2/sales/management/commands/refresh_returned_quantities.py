@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db.models import OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from sales.models import SaleItem, SaleReturnItem
+
+
+class Command(BaseCommand):
+    help = "Recompute SaleItem.returned_quantity from SaleReturnItem for rows returned before it existed"
+
+    def handle(self, *args, **options):
+        returned = Coalesce(
+            Subquery(
+                SaleReturnItem.objects.filter(sale_item=OuterRef('pk')).values('sale_item').annotate(
+                    total=Sum('return_quantity')
+                ).values('total')
+            ),
+            Value(0)
+        )
+        stale = SaleItem.objects.exclude(returned_quantity=returned).update(returned_quantity=returned)
+        self.stdout.write(self.style.SUCCESS(f"Refreshed returned quantity on {stale} sale items"))
@@ -4,6 +4,16 @@ from pharmacies.models import Pharmacy
 from inventory.models import Inventory
 
 
+class NumberSequence(models.Model):
+    """Counter row behind block-allocated document numbers (see sales.sequences)"""
+    key = models.CharField(max_length=100, unique=True)
+    last_value = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.key} ({self.last_value})"
+
+
 class Sale(models.Model):
     """Model for sales transactions"""
     PAYMENT_METHODS = [
@@ -28,18 +38,30 @@ class Sale(models.Model):
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Set once the sale is counted in its DailySalesRollup row (see sales.rollups)
+    in_rollup = models.BooleanField(default=False, editable=False)
+    
+    class Meta:
+        indexes = [
+            # Serves per-pharmacy date-range filters, hourly bucketing and
+            # keyset pages on (created_at, id)
+            models.Index(fields=['pharmacy', 'created_at', 'id']),
+            models.Index(fields=['created_at', 'id']),
+        ]
     
     def __str__(self):
         return f"Sale {self.sale_number} - {self.pharmacy.name}"
     
     def save(self, *args, **kwargs):
         if not self.sale_number:
-            # Generate sale number
-            from django.utils import timezone
-            today = timezone.now().date()
-            count = Sale.objects.filter(created_at__date=today).count() + 1
-            self.sale_number = f"SALE-{today.strftime('%Y%m%d')}-{count:04d}"
+            # Generate sale number from the per-process block allocator
+            from .sequences import next_document_number
+            self.sale_number = next_document_number('SALE', self.pharmacy_id)
+        adding = self._state.adding
         super().save(*args, **kwargs)
+        if adding:
+            from .rollups import record_sale
+            record_sale(self)
 
 
 class SaleItem(models.Model):
@@ -49,6 +71,8 @@ class SaleItem(models.Model):
     quantity = models.PositiveIntegerField()
     unit_price = models.DecimalField(max_digits=10, decimal_places=2)
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
+    # Sum of SaleReturnItem.return_quantity for this line, kept by sales.returns
+    returned_quantity = models.PositiveIntegerField(default=0, editable=False)
     
     def __str__(self):
         return f"{self.inventory.medicine.name} x {self.quantity}"
@@ -75,18 +99,28 @@ class SaleReturn(models.Model):
     notes = models.TextField(blank=True)
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Set once the return is counted in its DailySalesRollup row (see sales.rollups)
+    in_rollup = models.BooleanField(default=False, editable=False)
+    
+    class Meta:
+        indexes = [
+            # Keyset pages on (created_at, id)
+            models.Index(fields=['created_at', 'id']),
+        ]
     
     def __str__(self):
         return f"Return {self.return_number} for Sale {self.original_sale.sale_number}"
     
     def save(self, *args, **kwargs):
         if not self.return_number:
-            # Generate return number
-            from django.utils import timezone
-            today = timezone.now().date()
-            count = SaleReturn.objects.filter(created_at__date=today).count() + 1
-            self.return_number = f"RET-{today.strftime('%Y%m%d')}-{count:04d}"
+            # Generate return number from the per-process block allocator
+            from .sequences import next_document_number
+            self.return_number = next_document_number('RET', self.original_sale.pharmacy_id)
+        adding = self._state.adding
         super().save(*args, **kwargs)
+        if adding:
+            from .rollups import record_return
+            record_return(self)
 
 
 class SaleReturnItem(models.Model):
@@ -97,4 +131,26 @@ class SaleReturnItem(models.Model):
     return_amount = models.DecimalField(max_digits=10, decimal_places=2)
     
     def __str__(self):
-        return f"Return {self.sale_item.inventory.medicine.name} x {self.return_quantity}"
\ No newline at end of file
+        return f"Return {self.sale_item.inventory.medicine.name} x {self.return_quantity}"
+
+
+class DailySalesRollup(models.Model):
+    """Per-day sales and return totals, maintained as sales and returns are written"""
+    pharmacy = models.ForeignKey(Pharmacy, on_delete=models.CASCADE, related_name='daily_sales_rollups')
+    date = models.DateField()
+    payment_method = models.CharField(max_length=20, choices=Sale.PAYMENT_METHODS)
+    sale_count = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    discount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    tax = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    return_count = models.PositiveIntegerField(default=0)
+    return_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    
+    class Meta:
+        unique_together = ['pharmacy', 'date', 'payment_method']
+        indexes = [
+            models.Index(fields=['date']),
+        ]
+    
+    def __str__(self):
+        return f"{self.pharmacy_id} {self.date} {self.payment_method}: {self.sale_count} sales"
@@ -0,0 +1,83 @@
+"""
+Returns engine: how much of each sale line has already been returned.
+
+SaleItem.returned_quantity is the running total of SaleReturnItem
+quantities for the line. It is raised by claim_returns() with conditional
+UPDATEs of CLAIM_BATCH_SIZE lines, which only succeed if every line stays
+within its sold quantity. Concurrent returns of the same sale therefore
+cannot over-return it, and validating a return never has to sum earlier
+returns.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import F
+
+from fylinx2.expressions import case_batch_size, case_by_pk
+from inventory.ledger import batched
+
+from .models import SaleItem
+
+
+# Lines per UPDATE: the CASE is repeated in the filter and in returned_quantity
+CLAIM_BATCH_SIZE = case_batch_size(2)
+
+
+class ReturnExceeded(Exception):
+    """Raised when one or more sale lines cannot take the requested return quantity"""
+
+    def __init__(self, exceeded):
+        self.exceeded = exceeded
+        super().__init__(
+            "Return quantity exceeds what is left on sale item "
+            + ", ".join(str(item['sale_item']) for item in exceeded)
+        )
+
+
+def claim_returns(lines):
+    """
+    Add return quantities to many sale lines with conditional UPDATEs,
+    CLAIM_BATCH_SIZE lines at a time in id order.
+
+    `lines` is an iterable of (sale_item_id, quantity) pairs; repeated ids are
+    summed. Either every line is updated or ReturnExceeded is raised, so
+    callers must run this inside transaction.atomic().
+    """
+    quantities = defaultdict(int)
+    for sale_item_id, quantity in lines:
+        quantities[sale_item_id] += quantity
+    if not quantities:
+        return
+
+    with transaction.atomic():
+        for ids in batched(sorted(quantities), CLAIM_BATCH_SIZE):
+            requested = case_by_pk(SaleItem, {pk: quantities[pk] for pk in ids})
+            updated = SaleItem.objects.filter(
+                pk__in=ids,
+                quantity__gte=F('returned_quantity') + requested
+            ).update(returned_quantity=F('returned_quantity') + requested)
+            if updated != len(ids):
+                # Undo every chunk so the report below compares against the
+                # quantities as they were before this call
+                transaction.set_rollback(True)
+                break
+        else:
+            return
+
+    remaining = {}
+    for ids in batched(quantities):
+        remaining.update(
+            (pk, quantity - returned)
+            for pk, quantity, returned in SaleItem.objects.filter(
+                pk__in=ids
+            ).values_list('id', 'quantity', 'returned_quantity')
+        )
+    raise ReturnExceeded([
+        {
+            'sale_item': pk,
+            'requested': quantity,
+            'available': remaining.get(pk, 0),
+        }
+        for pk, quantity in quantities.items()
+        if remaining.get(pk, 0) < quantity
+    ])
@@ -0,0 +1,191 @@
+"""
+Incremental maintenance of DailySalesRollup.
+
+Every new Sale or SaleReturn adds its totals to the (pharmacy, date,
+payment_method) rollup row once its transaction commits, so the checkout
+transaction never holds a lock on the shared rollup row. `date` is the local
+day in the pharmacy's time zone. If a worker dies between the commit and the
+rollup update, `manage.py rebuild_sales_rollups` recomputes the rows from
+history.
+
+A sale or return is counted at most once: its `in_rollup` flag is set in the
+same transaction as the rollup update, and only if it was not set yet. Both
+the update and rebuild() first lock the pharmacy rows involved, so a rebuild
+can run while sales are live: updates for its pharmacies wait for it, and
+then skip the sales it counted.
+"""
+import logging
+
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.db.models import Count, F, Q, Sum
+from django.utils import timezone
+
+from fylinx2.response_cache import invalidate
+from pharmacies.models import Pharmacy
+from .models import DailySalesRollup, Sale, SaleReturn
+from .periods import filter_created_between, get_timezone, pharmacy_timezone, truncate_datetime
+
+
+logger = logging.getLogger(__name__)
+
+
+def _add(pharmacy_id, date, payment_method, **amounts):
+    key = {'pharmacy_id': pharmacy_id, 'date': date, 'payment_method': payment_method}
+    increments = {field: F(field) + value for field, value in amounts.items()}
+
+    with transaction.atomic():
+        if not DailySalesRollup.objects.filter(**key).update(**increments):
+            try:
+                with transaction.atomic():
+                    DailySalesRollup.objects.create(**key, **amounts)
+            except IntegrityError:
+                # Another worker created the row first
+                DailySalesRollup.objects.filter(**key).update(**increments)
+
+    # The rollup lands after the sale's own commit, so cached summaries
+    # built in between must be dropped again
+    invalidate('sales')
+
+
+def _lock_pharmacies(pharmacies):
+    """Lock `pharmacies` in id order; where the backend can, without blocking inserts that reference them"""
+    no_key = connection.features.has_select_for_no_key_update
+    list(pharmacies.select_for_update(no_key=no_key).order_by('pk').values_list('pk', flat=True))
+
+
+def _add_after_commit(instance, key, **amounts):
+    """
+    Run _add() for key() -> (pharmacy_id, date, payment_method) after the
+    current transaction commits, unless `instance` (a Sale or SaleReturn)
+    has been counted by then. The sale is committed by that point, so a
+    failure must not reach the client as an error that invites a duplicate
+    retry: it is logged with the day to rebuild.
+    """
+    def add():
+        pharmacy_id, date, payment_method = key()
+        try:
+            with transaction.atomic():
+                _lock_pharmacies(Pharmacy.objects.filter(pk=pharmacy_id))
+                if type(instance).objects.filter(pk=instance.pk, in_rollup=False).update(in_rollup=True):
+                    _add(pharmacy_id, date, payment_method, **amounts)
+        except DatabaseError:
+            logger.exception(
+                "Sales rollup update failed for pharmacy %s on %s; "
+                "repair with `manage.py rebuild_sales_rollups --since %s`",
+                pharmacy_id, date, date
+            )
+
+    transaction.on_commit(add, robust=True)
+
+
+def record_sale(sale):
+    """Add a newly created sale to its rollup row after commit"""
+    _add_after_commit(
+        sale,
+        lambda: (
+            sale.pharmacy_id,
+            timezone.localdate(sale.created_at, pharmacy_timezone(sale.pharmacy)),
+            sale.payment_method
+        ),
+        sale_count=1,
+        revenue=sale.total_amount,
+        discount=sale.discount,
+        tax=sale.tax
+    )
+
+
+def record_return(sale_return):
+    """Add a newly created return to the rollup row of its return date"""
+    original_sale = sale_return.original_sale
+    _add_after_commit(
+        sale_return,
+        lambda: (
+            original_sale.pharmacy_id,
+            timezone.localdate(sale_return.created_at, pharmacy_timezone(original_sale.pharmacy)),
+            original_sale.payment_method
+        ),
+        return_count=1,
+        return_amount=sale_return.return_amount
+    )
+
+
+def rebuild(since=None):
+    """
+    Recompute rollup rows from the Sale and SaleReturn tables.
+
+    Each side is one grouped query per pharmacy time zone, so memory use
+    depends on the number of (pharmacy, day, payment method) rows, not on the
+    number of sales. Everything runs in one transaction holding every
+    pharmacy's lock: sales and returns in range are marked as counted, and
+    only marked ones are summed, so one committed in the meantime is left to
+    its own pending update. Returns the number of rollup rows written.
+    """
+    rollups = DailySalesRollup.objects.all()
+    if since:
+        rollups = rollups.filter(date__gte=since)
+
+    rows = {}
+    with transaction.atomic():
+        _lock_pharmacies(Pharmacy.objects.all())
+        time_zones = Pharmacy.objects.values_list('time_zone', flat=True).distinct().order_by()
+        for time_zone in time_zones:
+            tz = get_timezone(time_zone)
+            sales = Sale.objects.filter(pharmacy__time_zone=time_zone)
+            returns = SaleReturn.objects.filter(original_sale__pharmacy__time_zone=time_zone)
+            if since:
+                sales = filter_created_between(sales, start_date=since, tz=tz)
+                returns = filter_created_between(returns, start_date=since, tz=tz)
+            sales.filter(in_rollup=False).update(in_rollup=True)
+            returns.filter(in_rollup=False).update(in_rollup=True)
+
+            sale_totals = sales.filter(in_rollup=True).annotate(day=truncate_datetime('day', tz=tz)).values(
+                'pharmacy_id', 'day', 'payment_method'
+            ).annotate(
+                sale_count=Count('id'),
+                revenue=Sum('total_amount'),
+                discount_total=Sum('discount'),
+                tax_total=Sum('tax')
+            ).order_by()
+            for total in sale_totals:
+                key = (total['pharmacy_id'], total['day'], total['payment_method'])
+                rows[key] = DailySalesRollup(
+                    pharmacy_id=key[0], date=key[1], payment_method=key[2],
+                    sale_count=total['sale_count'],
+                    revenue=total['revenue'] or 0,
+                    discount=total['discount_total'] or 0,
+                    tax=total['tax_total'] or 0
+                )
+
+            return_totals = returns.filter(in_rollup=True).annotate(day=truncate_datetime('day', tz=tz)).values(
+                'original_sale__pharmacy_id', 'day', 'original_sale__payment_method'
+            ).annotate(
+                return_count=Count('id'),
+                returned_total=Sum('return_amount')
+            ).order_by()
+            for total in return_totals:
+                key = (total['original_sale__pharmacy_id'], total['day'], total['original_sale__payment_method'])
+                row = rows.setdefault(key, DailySalesRollup(
+                    pharmacy_id=key[0], date=key[1], payment_method=key[2]
+                ))
+                row.return_count = total['return_count']
+                row.return_amount = total['returned_total'] or 0
+
+        rollups.delete()
+        DailySalesRollup.objects.bulk_create(rows.values(), batch_size=1000)
+
+    invalidate('sales')
+    return len(rows)
+
+
+def summary_totals(rollups, today):
+    """Sale counts and revenue for `today`, its month and all time, in one pass over `rollups`"""
+    month_start = today.replace(day=1)
+    totals = rollups.aggregate(
+        today_sales=Sum('sale_count', filter=Q(date=today)),
+        today_revenue=Sum('revenue', filter=Q(date=today)),
+        month_sales=Sum('sale_count', filter=Q(date__gte=month_start)),
+        month_revenue=Sum('revenue', filter=Q(date__gte=month_start)),
+        total_sales=Sum('sale_count'),
+        total_revenue=Sum('revenue'),
+    )
+    return {key: value or 0 for key, value in totals.items()}
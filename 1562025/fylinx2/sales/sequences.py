@@ -0,0 +1,190 @@
+"""
+Block allocator for daily document numbers (sale and return numbers).
+
+Each worker process reserves a block of numbers from the NumberSequence row
+for the (prefix, day[, pharmacy]) key with a single conditional UPDATE, then
+hands numbers out of that block from memory. Most sales therefore allocate
+their number without touching the database, and two tills can never receive
+the same number because every block is reserved under the row lock.
+
+A checkout asks for its number inside its own transaction. The block is then
+reserved on a separate connection and committed at once, so the row lock is
+released straight away instead of being held until the sale commits, which
+would serialize every checkout of the day behind it.
+
+Numbers are unique but not gap-free: a block that is only partly used before
+the day rolls over or the process exits, or a number taken by a checkout
+that rolls back, leaves a gap.
+"""
+import threading
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import NumberSequence
+
+
+DEFAULT_BLOCK_SIZE = 50
+
+_lock = threading.Lock()
+# (prefix, day, pharmacy_id) -> list of [next_value, last_value] ranges
+_blocks = {}
+
+# The process's autocommit connection for reservations made inside a
+# transaction, used by one thread at a time under _reserve_lock
+_reserve_lock = threading.Lock()
+_reserve_connection = None
+
+
+def _block_size():
+    return max(int(getattr(settings, 'SALE_NUMBER_BLOCK_SIZE', DEFAULT_BLOCK_SIZE)), 1)
+
+
+def _per_pharmacy():
+    return getattr(settings, 'SALE_NUMBERS_PER_PHARMACY', False)
+
+
+def _sequence_key(prefix, day, pharmacy_id):
+    key = f"{prefix}:{day.strftime('%Y%m%d')}"
+    if pharmacy_id is not None:
+        key = f"{key}:{pharmacy_id}"
+    return key
+
+
+def _reserves_separately():
+    """
+    Whether blocks are reserved on the separate connection: only while the
+    caller is in a transaction. SQLite has a single writer, so a second
+    connection could not write before the caller commits; there the block
+    is reserved in the caller's transaction, which holds the write lock
+    until it commits anyway.
+    """
+    connection = connections[DEFAULT_DB_ALIAS]
+    return connection.in_atomic_block and connection.vendor != 'sqlite'
+
+
+def _separate_connection():
+    global _reserve_connection
+    if _reserve_connection is None:
+        _reserve_connection = connections.create_connection(DEFAULT_DB_ALIAS)
+        _reserve_connection.inc_thread_sharing()
+    # Honour CONN_MAX_AGE and drop a connection left broken by an error
+    _reserve_connection.close_if_unusable_or_obsolete()
+    return _reserve_connection
+
+
+def reserve_block(key, size):
+    """
+    Reserve `size` numbers for `key` and return the (first, last) range.
+
+    Inside a transaction the reservation is committed on its own (see
+    _reserves_separately()), so it survives the caller rolling back.
+    """
+    if not _reserves_separately():
+        return _reserve(key, size)
+
+    with _reserve_lock:
+        caller_connection = connections[DEFAULT_DB_ALIAS]
+        # The ORM below runs on the separate connection for this thread only
+        connections[DEFAULT_DB_ALIAS] = _separate_connection()
+        try:
+            return _reserve(key, size)
+        finally:
+            connections[DEFAULT_DB_ALIAS] = caller_connection
+
+
+def _reserve(key, size):
+    with transaction.atomic():
+        # The UPDATE takes the row lock before we read, so concurrent
+        # reservations for the same key are serialized by the database.
+        updated = NumberSequence.objects.filter(key=key).update(
+            last_value=F('last_value') + size,
+            updated_at=timezone.now()
+        )
+        if not updated:
+            try:
+                with transaction.atomic():
+                    NumberSequence.objects.create(key=key, last_value=size)
+                return 1, size
+            except IntegrityError:
+                # Another worker created the row first
+                NumberSequence.objects.filter(key=key).update(
+                    last_value=F('last_value') + size,
+                    updated_at=timezone.now()
+                )
+
+        last_value = NumberSequence.objects.filter(key=key).values_list(
+            'last_value', flat=True
+        ).get()
+
+    return last_value - size + 1, last_value
+
+
+def _take_cached(cache_key):
+    ranges = _blocks.get(cache_key)
+    while ranges:
+        block = ranges[0]
+        if block[0] <= block[1]:
+            value = block[0]
+            block[0] += 1
+            return value
+        ranges.pop(0)
+    return None
+
+
+def _publish(cache_key, first, last):
+    with _lock:
+        # Drop blocks left over from previous days
+        for stale_key in [k for k in _blocks if k[1] < cache_key[1]]:
+            del _blocks[stale_key]
+        _blocks.setdefault(cache_key, []).append([first, last])
+
+
+def next_number(prefix, pharmacy_id=None, day=None):
+    """Return the next sequence value for `prefix` on `day`"""
+    day = day or timezone.now().date()
+    if not _per_pharmacy():
+        pharmacy_id = None
+    cache_key = (prefix, day, pharmacy_id)
+
+    with _lock:
+        value = _take_cached(cache_key)
+    if value is not None:
+        return value
+
+    size = _block_size()
+    separately = _reserves_separately()
+    first, last = reserve_block(_sequence_key(prefix, day, pharmacy_id), size)
+    if last > first:
+        if separately:
+            _publish(cache_key, first + 1, last)
+        else:
+            # Only share the rest of the block once the reservation is durable;
+            # if the caller's transaction rolls back, the block is discarded with it.
+            transaction.on_commit(lambda: _publish(cache_key, first + 1, last))
+    return first
+
+
+def next_document_number(prefix, pharmacy_id=None):
+    """Build a formatted number such as SALE-20250619-0001"""
+    day = timezone.now().date()
+    value = next_number(prefix, pharmacy_id, day)
+    if _per_pharmacy() and pharmacy_id is not None:
+        return f"{prefix}-{pharmacy_id}-{day.strftime('%Y%m%d')}-{value:04d}"
+    return f"{prefix}-{day.strftime('%Y%m%d')}-{value:04d}"
+
+
+def reset_cache():
+    """
+    Forget all in-process blocks and close the reservation connection
+    (e.g. after fork or in benchmarks)
+    """
+    global _reserve_connection
+    with _lock:
+        _blocks.clear()
+    with _reserve_lock:
+        if _reserve_connection is not None:
+            _reserve_connection.close()
+            _reserve_connection = None
@@ -2,6 +2,11 @@ from rest_framework import serializers
 from django.db import transaction
 from .models import Sale, SaleItem, SaleReturn, SaleReturnItem
 from inventory.models import Inventory, StockMovement
+from inventory.allocation import allocate_fefo
+from inventory.expiry import request_today
+from inventory.stock import decrement_stock, increment_stock
+from pharmacies.scope import get_scope
+from .returns import claim_returns
 
 
 class SaleItemSerializer(serializers.ModelSerializer):
@@ -18,6 +23,30 @@ class SaleItemSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'total_price']
 
 
+class SaleItemCreateSerializer(serializers.ModelSerializer):
+    """
+    Serializer for sale lines on checkout; inventory rows are loaded in bulk by the parent.
+    
+    A line names either an exact `inventory` batch or a `medicine`, in which
+    case the server picks batches first-expiry-first-out. Medicine lines
+    default to each batch's selling price when `unit_price` is omitted.
+    """
+    inventory = serializers.IntegerField(required=False)
+    medicine = serializers.IntegerField(required=False)
+    unit_price = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+    
+    class Meta:
+        model = SaleItem
+        fields = ['inventory', 'medicine', 'quantity', 'unit_price']
+    
+    def validate(self, attrs):
+        if ('inventory' in attrs) == ('medicine' in attrs):
+            raise serializers.ValidationError("Provide either inventory or medicine")
+        if 'inventory' in attrs and 'unit_price' not in attrs:
+            raise serializers.ValidationError({'unit_price': "This field is required."})
+        return attrs
+
+
 class SaleSerializer(serializers.ModelSerializer):
     """Serializer for sales"""
     items = SaleItemSerializer(many=True, read_only=True)
@@ -40,7 +69,7 @@ class SaleSerializer(serializers.ModelSerializer):
 
 class SaleCreateSerializer(serializers.ModelSerializer):
     """Serializer for creating sales"""
-    items = SaleItemSerializer(many=True, write_only=True)
+    items = SaleItemCreateSerializer(many=True, write_only=True)
     
     class Meta:
         model = Sale
@@ -54,29 +83,59 @@ class SaleCreateSerializer(serializers.ModelSerializer):
         if not value:
             raise serializers.ValidationError("At least one item is required")
         
+        # Merge repeated lines for the same batch (or medicine) and price so
+        # stock is checked against the basket total rather than line by line
+        merged = {}
         for item in value:
-            inventory_id = item.get('inventory')
-            quantity = item.get('quantity', 0)
-            
-            if not inventory_id:
-                raise serializers.ValidationError("Inventory ID is required for each item")
-            
-            try:
-                inventory = Inventory.objects.get(id=inventory_id.id if hasattr(inventory_id, 'id') else inventory_id)
-                if inventory.quantity < quantity:
-                    raise serializers.ValidationError(
-                        f"Insufficient stock for {inventory.medicine.name}. "
-                        f"Available: {inventory.quantity}, Requested: {quantity}"
-                    )
-            except Inventory.DoesNotExist:
+            key = (item.get('inventory'), item.get('medicine'), item.get('unit_price'))
+            if key in merged:
+                merged[key]['quantity'] += item['quantity']
+            else:
+                merged[key] = dict(item)
+        # Medicine lines are allocated to batches in create(), under a lock
+        medicine_items = [item for item in merged.values() if 'medicine' in item]
+        items = [item for item in merged.values() if 'inventory' in item]
+        
+        # Load every referenced batch, with its medicine, in one query
+        inventory_ids = {item['inventory'] for item in items}
+        inventories = Inventory.objects.select_related('medicine').in_bulk(inventory_ids)
+        
+        requested = {}
+        for item in items:
+            requested[item['inventory']] = requested.get(item['inventory'], 0) + item['quantity']
+        
+        for inventory_id, quantity in requested.items():
+            inventory = inventories.get(inventory_id)
+            if inventory is None:
                 raise serializers.ValidationError(f"Invalid inventory ID: {inventory_id}")
+            if inventory.quantity < quantity:
+                raise serializers.ValidationError(
+                    f"Insufficient stock for {inventory.medicine.name}. "
+                    f"Available: {inventory.quantity}, Requested: {quantity}"
+                )
         
-        return value
+        # Carry the loaded rows forward so create() does not read them again
+        for item in items:
+            item['inventory'] = inventories[item['inventory']]
+        
+        return items + medicine_items
     
     def create(self, validated_data):
         items_data = validated_data.pop('items')
         
         with transaction.atomic():
+            # Split medicine lines across batches, soonest expiry first,
+            # locking the explicit batches in the same id order
+            medicine_items = [item for item in items_data if 'medicine' in item]
+            if medicine_items:
+                inventory_items = [item for item in items_data if 'inventory' in item]
+                items_data = inventory_items + allocate_fefo(
+                    validated_data['pharmacy'].id,
+                    medicine_items,
+                    request_today(self.context.get('request')),
+                    lock_ids={item['inventory'].id for item in inventory_items}
+                )
+            
             # Calculate totals
             subtotal = sum(
                 item['quantity'] * item['unit_price'] 
@@ -97,30 +156,35 @@ class SaleCreateSerializer(serializers.ModelSerializer):
                 **validated_data
             )
             
-            # Create sale items and update inventory
-            for item_data in items_data:
-                inventory = item_data['inventory']
-                quantity = item_data['quantity']
-                
-                # Create sale item
-                SaleItem.objects.create(
+            # Take stock for every line with conditional UPDATEs; a
+            # shortfall on any line rolls the whole sale back
+            decrement_stock(
+                (item_data['inventory'].id, item_data['quantity'])
+                for item_data in items_data
+            )
+            
+            # Create sale items and stock movements in bulk
+            user = self.context['request'].user
+            notes = f"Sale to {sale.customer_name or 'Walk-in customer'}"
+            SaleItem.objects.bulk_create([
+                SaleItem(
                     sale=sale,
+                    total_price=item_data['quantity'] * item_data['unit_price'],
                     **item_data
                 )
-                
-                # Update inventory quantity
-                inventory.quantity -= quantity
-                inventory.save()
-                
-                # Create stock movement
-                StockMovement.objects.create(
-                    inventory=inventory,
+                for item_data in items_data
+            ])
+            StockMovement.objects.bulk_create([
+                StockMovement(
+                    inventory=item_data['inventory'],
                     movement_type='OUT',
-                    quantity=-quantity,
+                    quantity=-item_data['quantity'],
                     reference_number=sale.sale_number,
-                    notes=f"Sale to {sale.customer_name or 'Walk-in customer'}",
-                    created_by=self.context['request'].user
+                    notes=notes,
+                    created_by=user
                 )
+                for item_data in items_data
+            ])
         
         return sale
 
@@ -156,9 +220,15 @@ class SaleReturnSerializer(serializers.ModelSerializer):
         ]
 
 
+class SaleReturnItemCreateSerializer(serializers.Serializer):
+    """Serializer for return lines; sale items are loaded in bulk by the parent"""
+    sale_item = serializers.IntegerField()
+    return_quantity = serializers.IntegerField(min_value=1)
+
+
 class SaleReturnCreateSerializer(serializers.ModelSerializer):
     """Serializer for creating sale returns"""
-    items = SaleReturnItemSerializer(many=True, write_only=True)
+    items = SaleReturnItemCreateSerializer(many=True, write_only=True)
     
     class Meta:
         model = SaleReturn
@@ -166,79 +236,92 @@ class SaleReturnCreateSerializer(serializers.ModelSerializer):
             'original_sale', 'reason', 'notes', 'items'
         ]
     
-    def validate_items(self, value):
-        if not value:
-            raise serializers.ValidationError("At least one item is required")
+    def validate_original_sale(self, value):
+        request = self.context.get('request')
+        if request is not None and not get_scope(request).allows(value.pharmacy_id):
+            raise serializers.ValidationError("You do not have permission to return this sale")
+        return value
+    
+    def validate(self, attrs):
+        items = attrs.get('items')
+        if not items:
+            raise serializers.ValidationError({'items': "At least one item is required"})
         
-        for item in value:
-            sale_item_id = item.get('sale_item')
-            return_quantity = item.get('return_quantity', 0)
-            
-            try:
-                sale_item = SaleItem.objects.get(id=sale_item_id.id if hasattr(sale_item_id, 'id') else sale_item_id)
-                
-                # Check if return quantity is valid
-                already_returned = SaleReturnItem.objects.filter(
-                    sale_item=sale_item
-                ).aggregate(
-                    total_returned=models.Sum('return_quantity')
-                )['total_returned'] or 0
-                
-                available_for_return = sale_item.quantity - already_returned
-                
-                if return_quantity > available_for_return:
-                    raise serializers.ValidationError(
-                        f"Cannot return {return_quantity} items. "
-                        f"Available for return: {available_for_return}"
-                    )
-            except SaleItem.DoesNotExist:
-                raise serializers.ValidationError(f"Invalid sale item ID: {sale_item_id}")
+        # Merge repeated lines for the same sale item
+        requested = {}
+        for item in items:
+            requested[item['sale_item']] = requested.get(item['sale_item'], 0) + item['return_quantity']
         
-        return value
+        # Every line of the original sale that is being returned, in one query
+        sale_items = SaleItem.objects.filter(
+            sale=attrs['original_sale'], id__in=list(requested)
+        ).only('id', 'inventory_id', 'quantity', 'returned_quantity', 'unit_price').in_bulk()
+        
+        errors = []
+        for sale_item_id, return_quantity in requested.items():
+            sale_item = sale_items.get(sale_item_id)
+            if sale_item is None:
+                errors.append(f"Invalid sale item ID for this sale: {sale_item_id}")
+                continue
+            available_for_return = sale_item.quantity - sale_item.returned_quantity
+            if return_quantity > available_for_return:
+                errors.append(
+                    f"Cannot return {return_quantity} of sale item {sale_item_id}. "
+                    f"Available for return: {available_for_return}"
+                )
+        if errors:
+            raise serializers.ValidationError({'items': errors})
+        
+        # Carry the loaded rows forward so create() does not read them again
+        attrs['items'] = [
+            {'sale_item': sale_items[sale_item_id], 'return_quantity': return_quantity}
+            for sale_item_id, return_quantity in requested.items()
+        ]
+        return attrs
     
     def create(self, validated_data):
         items_data = validated_data.pop('items')
+        user = self.context['request'].user
         
         with transaction.atomic():
-            # Calculate return amount
-            return_amount = sum(
-                item['return_quantity'] * item['sale_item'].unit_price
-                for item in items_data
+            # Reserve the quantities on the sale lines first; a concurrent
+            # return of the same lines raises ReturnExceeded and rolls back
+            claim_returns(
+                (item_data['sale_item'].id, item_data['return_quantity'])
+                for item_data in items_data
             )
             
-            # Create sale return
+            for item_data in items_data:
+                item_data['return_amount'] = item_data['return_quantity'] * item_data['sale_item'].unit_price
+            
             sale_return = SaleReturn.objects.create(
-                return_amount=return_amount,
-                created_by=self.context['request'].user,
+                return_amount=sum(item_data['return_amount'] for item_data in items_data),
+                created_by=user,
                 **validated_data
             )
             
-            # Create return items and update inventory
-            for item_data in items_data:
-                sale_item = item_data['sale_item']
-                return_quantity = item_data['return_quantity']
-                return_amount = return_quantity * sale_item.unit_price
-                
-                # Create return item
-                SaleReturnItem.objects.create(
-                    sale_return=sale_return,
-                    return_amount=return_amount,
-                    **item_data
-                )
-                
-                # Update inventory quantity (add back to stock)
-                inventory = sale_item.inventory
-                inventory.quantity += return_quantity
-                inventory.save()
-                
-                # Create stock movement
-                StockMovement.objects.create(
-                    inventory=inventory,
+            # Create return items and stock movements in bulk
+            SaleReturnItem.objects.bulk_create([
+                SaleReturnItem(sale_return=sale_return, **item_data)
+                for item_data in items_data
+            ])
+            notes = f"Return from sale {sale_return.original_sale.sale_number}"
+            StockMovement.objects.bulk_create([
+                StockMovement(
+                    inventory_id=item_data['sale_item'].inventory_id,
                     movement_type='IN',
-                    quantity=return_quantity,
+                    quantity=item_data['return_quantity'],
                     reference_number=sale_return.return_number,
-                    notes=f"Return from sale {sale_return.original_sale.sale_number}",
-                    created_by=self.context['request'].user
+                    notes=notes,
+                    created_by=user
                 )
+                for item_data in items_data
+            ])
+            
+            # Add returned quantities back to stock with one UPDATE
+            increment_stock(
+                (item_data['sale_item'].inventory_id, item_data['return_quantity'])
+                for item_data in items_data
+            )
         
-        return sale_return
\ No newline at end of file
+        return sale_return
@@ -0,0 +1,7 @@
+from fylinx2.response_cache import invalidate_on
+from .models import Sale, SaleReturn
+
+
+# Cached API responses reading sales; a sale or return also moves stock
+invalidate_on(Sale, 'sales', 'inventory')
+invalidate_on(SaleReturn, 'sales', 'inventory')
@@ -1,3 +1,304 @@
-from django.test import TestCase
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Prefetch
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from accounts.models import CustomUser
+from fylinx2.expressions import MAX_QUERY_PARAMS
+from fylinx2.queries import assert_query_budget
+from fylinx2.testing import API_PREFIX, EndpointBudgetMixin, budget_fixtures
+from inventory.models import Inventory
+from inventory.tests import ParameterCounter, create_batches
+from pharmacies.models import Pharmacy
+from . import sequences
+from .api_views import SaleListCreateAPIView
+from .lean import sale_dicts, sale_mapper
+from .models import DailySalesRollup, NumberSequence, Sale, SaleItem
+from .returns import ReturnExceeded, claim_returns
+from .rollups import rebuild
+from .serializers import SaleSerializer
+
+
+class RollupTests(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='rollup-admin', role='ADMIN')
+        self.pharmacy = Pharmacy.objects.create(name='Rollup pharmacy', location='Test', created_by=self.user)
+
+    def create_sale(self, number):
+        return Sale.objects.create(
+            pharmacy=self.pharmacy, sale_number=f"ROLLUP-{number}", subtotal='4.00',
+            total_amount='4.00', amount_paid='4.00', created_by=self.user
+        )
+
+    def test_sale_is_added_to_its_rollup_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_sale(1)
+        rollup = DailySalesRollup.objects.get()
+        self.assertEqual((rollup.sale_count, str(rollup.revenue)), (1, '4.00'))
+
+    def test_failed_rollup_update_is_logged_not_raised(self):
+        # The sale is already committed; a failure must not turn into an error response
+        with mock.patch('sales.rollups._add', side_effect=DatabaseError("lock timeout")), \
+                self.assertLogs('sales.rollups', 'ERROR') as logs, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.create_sale(2)
+        self.assertIn('rebuild_sales_rollups --since', logs.output[0])
+        self.assertTrue(Sale.objects.filter(sale_number='ROLLUP-2').exists())
+        # Left for the next rebuild to count
+        self.assertEqual(rebuild(), 1)
+        self.assertEqual(DailySalesRollup.objects.get().sale_count, 1)
+
+    def test_sale_counted_by_a_rebuild_is_not_added_again(self):
+        # The rebuild runs between the sale's commit and its rollup update
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.create_sale(3)
+        rebuild()
+        for callback in callbacks:
+            callback()
+        self.assertEqual(DailySalesRollup.objects.get().sale_count, 1)
+
+    def test_rebuild_keeps_sales_already_added(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_sale(4)
+            self.create_sale(5)
+        self.assertEqual(rebuild(), 1)
+        rollup = DailySalesRollup.objects.get()
+        self.assertEqual((rollup.sale_count, str(rollup.revenue)), (2, '8.00'))
+
+
+class ClaimReturnsTests(TestCase):
+    """Returns of many lines stay within SQL Server's parameter limit"""
+
+    def setUp(self):
+        user, batches = create_batches(700)
+        sale = Sale.objects.create(
+            pharmacy=batches[0].pharmacy, sale_number='CLAIM-1', subtotal='1400.00',
+            total_amount='1400.00', amount_paid='1400.00', created_by=user
+        )
+        self.items = SaleItem.objects.bulk_create([
+            SaleItem(sale=sale, inventory=batch, quantity=2, unit_price='1.00', total_price='2.00')
+            for batch in batches
+        ])
+
+    def test_large_claim(self):
+        counter = ParameterCounter()
+        with connection.execute_wrapper(counter), transaction.atomic():
+            claim_returns((item.id, 1) for item in self.items)
+        self.assertLessEqual(max(counter.counts), MAX_QUERY_PARAMS)
+        self.assertEqual(set(SaleItem.objects.values_list('returned_quantity', flat=True)), {1})
+
+    def test_excess_in_a_later_chunk_rolls_back_every_chunk(self):
+        with self.assertRaises(ReturnExceeded) as raised, transaction.atomic():
+            claim_returns([(item.id, 1) for item in self.items] + [(self.items[-1].id, 2)])
+        self.assertEqual(
+            raised.exception.exceeded,
+            [{'sale_item': self.items[-1].id, 'requested': 3, 'available': 2}]
+        )
+        self.assertEqual(set(SaleItem.objects.values_list('returned_quantity', flat=True)), {0})
+
+
+def post_sale(client, pharmacy, items):
+    return client.post(API_PREFIX + 'sales/', {
+        'pharmacy': pharmacy.id, 'payment_method': 'CASH', 'amount_paid': '1000.00', 'items': items
+    }, format='json')
+
+
+class CheckoutTests(TestCase):
+    """Checkout merges repeated lines and runs the same statements for any basket size"""
+
+    def setUp(self):
+        self.user, self.batches = create_batches(10, quantity=5)
+        self.pharmacy = self.batches[0].pharmacy
+        self.client = APIClient()
+        self.client.force_login(self.user)
+
+    def line(self, batch, quantity):
+        return {'inventory': batch.pk, 'quantity': quantity, 'unit_price': '2.00'}
+
+    def test_repeated_lines_are_checked_together(self):
+        batch = self.batches[0]
+        response = post_sale(self.client, self.pharmacy, [self.line(batch, 3), self.line(batch, 3)])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Available: 5, Requested: 6', str(response.json()['errors']))
+        self.assertFalse(Sale.objects.exists())
+
+        response = post_sale(self.client, self.pharmacy, [self.line(batch, 2), self.line(batch, 3)])
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(list(SaleItem.objects.values_list('inventory_id', 'quantity')), [(batch.pk, 5)])
+        batch.refresh_from_db()
+        self.assertEqual(batch.quantity, 0)
+
+    def test_statement_count_is_flat(self):
+        budget = SaleListCreateAPIView.query_budget['POST']
+        # The day's first sale also creates its number sequence row
+        post_sale(self.client, self.pharmacy, [self.line(self.batches[0], 1)])
+        counts = []
+        for batches in (self.batches[:1], self.batches):
+            with self.subTest(lines=len(batches)), assert_query_budget(budget) as recorder:
+                response = post_sale(self.client, self.pharmacy, [self.line(batch, 1) for batch in batches])
+                self.assertEqual(response.status_code, 201, response.content)
+            counts.append(recorder.count)
+        self.assertEqual(counts[0], counts[1])
+
+
+class FefoCheckoutTests(TestCase):
+    """Medicine lines are split across batches soonest expiry first"""
+
+    def setUp(self):
+        self.user, batches = create_batches(5)
+        today = timezone.now().date()
+        # In FEFO order: 4 is empty, 1 has expired, 2 and 3 expire the same
+        # day (2 first, by id), then 0
+        for batch, days, quantity in zip(batches, (30, -1, 10, 10, 5), (10, 10, 10, 10, 0)):
+            Inventory.objects.filter(pk=batch.pk).update(
+                expiry_date=today + timedelta(days=days), quantity=quantity
+            )
+        self.batches = [batch.pk for batch in batches]
+        self.pharmacy = batches[0].pharmacy
+        self.medicine = batches[0].medicine_id
+        self.client = APIClient()
+        self.client.force_login(self.user)
+
+    def quantities(self):
+        quantities = dict(Inventory.objects.values_list('id', 'quantity'))
+        return [quantities[pk] for pk in self.batches]
+
+    def sold(self, response):
+        self.assertEqual(response.status_code, 201, response.content)
+        return list(
+            SaleItem.objects.filter(sale_id=response.json()['sale']['id'])
+            .order_by('id').values_list('inventory_id', 'quantity')
+        )
+
+    def test_equal_expiry_is_taken_in_id_order(self):
+        response = post_sale(self.client, self.pharmacy, [{'medicine': self.medicine, 'quantity': 3}])
+        self.assertEqual(self.sold(response), [(self.batches[2], 3)])
+
+    def test_split_skips_expired_and_empty_batches(self):
+        response = post_sale(self.client, self.pharmacy, [{'medicine': self.medicine, 'quantity': 25}])
+        self.assertEqual(
+            self.sold(response),
+            [(self.batches[2], 10), (self.batches[3], 10), (self.batches[0], 5)]
+        )
+        self.assertEqual(self.quantities(), [5, 10, 0, 0, 0])
+
+    def test_shortfall_rolls_back(self):
+        # 30 unexpired units; the expired batch does not count
+        response = post_sale(self.client, self.pharmacy, [
+            {'medicine': self.medicine, 'quantity': 20}, {'medicine': self.medicine, 'quantity': 11},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.json()['errors']['items'],
+            [{'medicine': self.medicine, 'requested': 31, 'available': 30}]
+        )
+        self.assertEqual(self.quantities(), [10, 10, 10, 10, 0])
+        self.assertFalse(Sale.objects.exists())
+
+
+class Rollback(Exception):
+    pass
+
+
+@override_settings(SALE_NUMBER_BLOCK_SIZE=3)
+class SequenceTests(TransactionTestCase):
+    """Concurrent checkouts, some rolled back, never share a document number"""
+
+    def setUp(self):
+        sequences.reset_cache()
+        self.addCleanup(sequences.reset_cache)
+
+    def test_concurrent_and_rolled_back_checkouts(self):
+        handed_out, committed = [], []
+        record = threading.Lock()
+
+        def checkout(n):
+            try:
+                with transaction.atomic():
+                    number = sequences.next_number('TEST')
+                    with record:
+                        handed_out.append(number)
+                    if n % 3 == 0:
+                        raise Rollback
+                with record:
+                    committed.append(number)
+            except (Rollback, DatabaseError):
+                # SQLite reports a concurrent writer as an error; that
+                # checkout rolls back like any other
+                pass
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(checkout, range(96)))
+
+        self.assertTrue(committed)
+        self.assertEqual(len(committed), len(set(committed)))
+        self.assertLessEqual(max(committed), NumberSequence.objects.get().last_value)
+        if connection.vendor != 'sqlite':
+            # Every block is committed when it is reserved, so a number taken
+            # by a checkout that rolled back is a gap, never handed out again
+            self.assertEqual(len(handed_out), len(set(handed_out)))
+
+
+class LeanMapperTests(TestCase):
+    """sale_dicts() renders the same JSON bytes as SaleSerializer"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = budget_fixtures(6)['admin']
+
+    def test_sales(self):
+        renderer = JSONRenderer()
+        queryset = Sale.objects.select_related('pharmacy', 'created_by').prefetch_related(
+            Prefetch('items', SaleItem.objects.select_related('inventory__medicine').order_by('id'))
+        ).order_by('id')
+        for zone in ('UTC', 'Asia/Kolkata'):
+            context = {'request': SimpleNamespace(user=self.admin)}
+            with self.subTest(time_zone=zone), timezone.override(zone):
+                serialized = renderer.render(SaleSerializer(queryset, many=True, context=context).data)
+                mapped = renderer.render(sale_dicts(sale_mapper.values(queryset), context))
+                self.assertEqual(mapped, serialized)
+
+
+class QueryBudgetTests(EndpointBudgetMixin, TestCase):
+
+    def requests(self):
+        """(method, path, data, status) for every sales endpoint"""
+        pharmacy = self.fixtures['pharmacies'][0]
+        sale = self.fixtures['sales'][0]
+        return [
+            ('GET', 'sales/', None, None),
+            ('POST', 'sales/', {
+                'pharmacy': pharmacy.id, 'payment_method': 'CASH', 'amount_paid': '100.00',
+                'items': [
+                    {'inventory': item.id, 'quantity': 1, 'unit_price': '2.00'}
+                    for item in self.fixtures['inventories'] if item.pharmacy_id == pharmacy.id
+                ][:5]
+            }, None),
+            ('GET', f"sales/{sale.id}/", None, None),
+            ('GET', 'sales/export/', None, None),
+            ('GET', 'sales/items/export/', None, None),
+            ('GET', 'sale-returns/', None, None),
+            ('POST', 'sale-returns/', {
+                'original_sale': sale.id, 'reason': 'OTHER',
+                'items': [{'sale_item': sale.items.order_by('id').last().id, 'return_quantity': 1}]
+            }, None),
+            ('GET', 'sales/analytics/', None, None),
+            ('GET', 'sales/summary/', None, None),
+        ]
+
+    def test_admin(self):
+        self.assertRequestsWithinBudget(self.fixtures['admin'], self.requests())
+
+    def test_manager(self):
+        self.assertRequestsWithinBudget(self.fixtures['manager'], self.requests())